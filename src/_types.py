@@ -1,11 +1,16 @@
 from pydantic import BaseModel
 from dataclasses import dataclass
+from datetime import datetime
 
 class Message(BaseModel):
 
     role: str
     content: str 
     messenger_timestamp: str | None = None
+    # Chat history row id, None until the message is stored
+    id: int | None = None
+    # Time the message was written, set before it is stored
+    timestamp: datetime | None = None
 
 # Request Models.
 class MessengerWebhookData(BaseModel):
@@ -36,6 +41,27 @@ class MessengerWebhookData(BaseModel):
                 return messaging_events[0]["timestamp"]
         return None
 
+    def split_by_sender(self) -> list["MessengerWebhookData"]:
+        """
+        Split the webhook into one webhook per sender, holding only that sender's
+        message events in their original order.
+        """
+        if self.object != "page":
+            return []
+        by_sender: dict[str, list[dict]] = {}
+        for entry in self.entry:
+            for event in entry.get("messaging", []):
+                if not event.get("message"):
+                    continue
+                sender_entries = by_sender.setdefault(event["sender"]["id"], [])
+                if not sender_entries or sender_entries[-1]["id"] != entry.get("id"):
+                    sender_entries.append({**entry, "messaging": []})
+                sender_entries[-1]["messaging"].append(event)
+        return [
+            MessengerWebhookData(object=self.object, entry=entries)
+            for entries in by_sender.values()
+        ]
+
     def is_same_timestamp(self, timestamp: str) -> bool:
         """
         Check if the current timestamp is the same as the provided timestamp.
@@ -55,4 +81,20 @@ class ClientStatus:
 @dataclass
 class Platform:
     LINE = "line"
-    MESSENGER = "messenger"
\ No newline at end of file
+    MESSENGER = "messenger"
+
+@dataclass
+class IncomingMessage:
+    """A user message handed off to be answered"""
+    text: str
+    # Platform timestamp of the message, in milliseconds since the epoch
+    timestamp: str
+    # Messenger message mid or LINE webhookEventId
+    event_id: str | None = None
+    # Whether an earlier attempt of the webhook job already answered the message
+    replied: bool = False
+
+    @property
+    def sort_key(self) -> float:
+        """The platform timestamp in milliseconds, messages without one sort last"""
+        return int(self.timestamp) if self.timestamp.isdigit() else float("inf")
@@ -1,11 +1,54 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
 import json
 from typing import List, Dict, Any, Optional, Union
 
 from pydantic import BaseModel
 from src.utils.common import ConfigUtils
 from src._types import Message
-from src.utils.functions_calling import FunctionCallingUtils
+from src.agents.tools import tool_registry
+from src.agents.context import ContextBuilder
+from src.utils.retrieval import PriceSheetRetriever
+from src.utils.answer_cache import AnswerCache
+from src.agents.usage import prompt_cache_stats
+from src.settings import (
+    OPENAI_TIMEOUT,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_MAX_RETRIES,
+    MAX_TOOL_ROUNDS,
+)
+
+# Async clients shared by all agents, one per API key.
+_async_clients: dict[str, AsyncOpenAI] = {}
+
+
+def get_async_openai_client(api_key: str) -> AsyncOpenAI:
+    """
+    Get the shared AsyncOpenAI client for an API key.
+    The client keeps a pool of connections that is reused across requests.
+    """
+    if api_key not in _async_clients:
+        _async_clients[api_key] = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=OPENAI_MAX_RETRIES,
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+            ),
+        )
+    return _async_clients[api_key]
+
+
+async def close_async_openai_clients():
+    """Close the shared async clients, called on application shutdown"""
+    for client in _async_clients.values():
+        await client.close()
+    _async_clients.clear()
 
 
 class BaseAgent:
@@ -19,7 +62,10 @@ class BaseAgent:
             api_key: str = ConfigUtils.get_env("OPENAI_API_KEY"),
             model: str = "gpt-4o",  # Default model, can be changed to gpt-4 or others
             temperature: float = 0.7,  # Default temperature for creativity level
-            system_prompt: Optional[str] = None
+            system_prompt: Optional[str] = None,
+            context_token_budget: Optional[int] = None,
+            retriever: Optional[PriceSheetRetriever] = None,
+            answer_cache: Optional[AnswerCache] = None
             ):
         """
         Initialize the OpenAI client.
@@ -27,16 +73,25 @@ class BaseAgent:
         Args:
             api_key (str): Your OpenAI API key
             model (str): The model to use (default: gpt-4)
+            context_token_budget (int, optional): Maximum input tokens, older turns are dropped to fit
+            retriever (PriceSheetRetriever, optional): Adds reference rows relevant to the latest messages
+            answer_cache (AnswerCache, optional): Reuses answers to first-turn questions
         """
         self.client = OpenAI(
             api_key=api_key,
             )
+        self.async_client = get_async_openai_client(api_key)
         self.model = model
         self.messages: List[Message] = []
         self.system_prompt = self.set_system_prompt(
             system_prompt=system_prompt
             )
         self.temperature = temperature
+        self.context_builder = (
+            ContextBuilder(model=model, budget=context_token_budget) if context_token_budget else None
+        )
+        self.retriever = retriever
+        self.answer_cache = answer_cache
 
     def set_system_prompt(self, system_prompt: str):
         """
@@ -71,6 +126,76 @@ class BaseAgent:
         messages = self.get_messages()
         return [{"role": msg.role, "content": msg.content} for msg in messages]
 
+    def get_tools(self, functions: Union[callable, List[callable], None] = None) -> List[dict]:
+        """
+        Get the tool schemas of the given functions from the tool registry.
+
+        Args:
+            functions (callable | list[callable], optional): Tools the model can call, all registered tools if None.
+        """
+        if functions is None:
+            return tool_registry.get_schemas()
+        if callable(functions):
+            functions = [functions]
+        for func in functions:
+            if tool_registry.get_tool(func.__name__) is None:
+                tool_registry.register(func)
+        return tool_registry.get_schemas(func.__name__ for func in functions)
+
+    def record_usage(self, response):
+        """
+        Record the prompt cache usage of a response.
+        """
+        usage = getattr(response, "usage", None)
+        cached_tokens = prompt_cache_stats.record(self.model, usage)
+        if usage is not None:
+            print(f"Input tokens: {usage.input_tokens}, cached: {cached_tokens}")
+
+    def get_cacheable_question(self, input_messages: list[Message]) -> Optional[str]:
+        """
+        Get the question of a context-free input, one user message without history
+        or summary, whose answer can be served from the answer cache.
+        """
+        if self.answer_cache is None or len(input_messages) != 1:
+            return None
+        message = input_messages[0]
+        return message.content if message.role == "user" else None
+
+    def build_input(self, input_messages: list[Message]) -> List[Dict[str, str]]:
+        """
+        Build the API input from the agent messages followed by the input messages.
+
+        The layout keeps the leading tokens identical across requests so that the
+        provider's prompt cache can reuse them: the frozen system prompt first, then
+        the per-user summary and the conversation, and the volatile retrieved rows
+        right before the latest message.
+        When a context token budget is set, the oldest input messages that do not fit are dropped.
+        System messages at the start of the input, such as a conversation summary, are always kept.
+        """
+        input_messages = list(input_messages)
+        pinned = 0
+        while pinned < len(input_messages) and input_messages[pinned].role == "system":
+            pinned += 1
+        system_messages = self.get_messages() + input_messages[:pinned]
+        history = input_messages[pinned:]
+
+        context_messages = []
+        if self.retriever is not None:
+            context_message = self.retriever.get_context_message(history)
+            if context_message is not None:
+                context_messages.append(context_message)
+
+        if self.context_builder is None:
+            messages = system_messages + history[:-1] + context_messages + history[-1:]
+        else:
+            messages, report = self.context_builder.build(system_messages, history, context_messages)
+            if report.dropped_turns:
+                print(
+                    f"Context budget {report.budget}: using {report.used_tokens} tokens, "
+                    f"dropped {report.dropped_turns} turns ({report.dropped_tokens} tokens)"
+                )
+        return [{"role": msg.role, "content": msg.content} for msg in messages]
+
 
     def invoke(
             self,
@@ -91,10 +216,7 @@ class BaseAgent:
         Raises:
             Exception: If API call fails
         """
-        messages = self.get_dict_messages()
-        messages.extend(
-            [{"role": msg.role, "content": msg.content} for msg in input_messages]
-        )
+        messages = self.build_input(input_messages)
         
         try:
             response = self.client.responses.create(
@@ -102,6 +224,7 @@ class BaseAgent:
                 input=messages,
                 temperature=self.temperature,
             )
+            self.record_usage(response)
 
             return response.output_text
 
@@ -112,50 +235,143 @@ class BaseAgent:
     def invoke_with_function_calling(
             self,
             input_messages: list[dict],
-            functions: callable = None,
+            functions: Union[callable, List[callable], None] = None,
         ) -> str:
         """
         Send a prompt with function calling to OpenAI API and return the response.
-        
+
+        Every function call of a response is run, concurrently when there are several,
+        and the results are sent back to the model for its final answer.
+
         Args:
             input_messages (list[dict]): List of messages to send
-            functions (list[dict]): List of functions to call
-            function_call (Optional[dict]): Specific function to call, if any
-            
+            functions (callable | list[callable], optional): Functions the model can call, all registered tools if None
+
         Returns:
             str: The AI's response content
-            
+        """
+        question = self.get_cacheable_question(input_messages)
+        if question is not None:
+            cached = self.answer_cache.get(question)
+            if cached is not None:
+                return cached
+
+        input_items = self.build_input(input_messages)
+        tools = self.get_tools(functions)
+        called_tools = False
+        try:
+            for tool_round in range(MAX_TOOL_ROUNDS + 1):
+                # Force a text answer once the tool rounds are used up.
+                tool_choice = {"tool_choice": "none"} if tool_round == MAX_TOOL_ROUNDS else {}
+                response = self.client.responses.create(
+                    model=self.model,
+                    input=input_items,
+                    tools=tools,
+                    temperature=self.temperature,
+                    **tool_choice,
+                )
+                self.record_usage(response)
+                calls = [item for item in response.output if item.type == "function_call"]
+                if not calls:
+                    break
+                called_tools = True
+                input_items += response.output
+                input_items += tool_registry.run_all(calls)
+
+            output_text = response.output_text
+            # Tool results depend on their side effects, only plain answers are cached.
+            if question is not None and not called_tools:
+                self.answer_cache.set(question, output_text)
+            return output_text
+
+        except Exception as e:
+            print(f"Error calling OpenAI API with function calling: {str(e)}")
+            return "ทำรายการไม่สำเร็จ กรุณาลองใหม่อีกครั้ง"
+
+
+    async def ainvoke(
+            self,
+            input_messages: list[Message],
+            ) -> str:
+        """
+        Async version of `invoke` using the shared AsyncOpenAI client.
+
+        Args:
+            input_messages (list[Message]): List of messages to send
+
+        Returns:
+            str: The AI's response content
+
         Raises:
             Exception: If API call fails
         """
-        messages = self.get_dict_messages()
-        messages.extend(
-            [{"role": msg.role, "content": msg.content} for msg in input_messages]
-        )
-        func_name = functions.__name__ 
-        print("Function name", func_name)
-        schema = FunctionCallingUtils.load_schema(func_name)
-        print("Schema", schema)
+        messages = self.build_input(input_messages)
+
         try:
-            response = self.client.responses.create(
+            response = await self.async_client.responses.create(
                 model=self.model,
                 input=messages,
-                tools=[schema],
                 temperature=self.temperature,
             )
-            print("RESPONSE", response)
-            resp_output = response.output[0]
-            print(resp_output.type)
-            match resp_output.type:
-                case "function_call":
-                    print(f"Input arguments: {resp_output.arguments}")
-                    input_args = json.loads(resp_output.arguments)
-                    output_text = functions(**input_args)
-                case _:
-                    output_text = response.output[0].content[0].text
-            # returned_value = functions(**input_args)
+            self.record_usage(response)
+
+            return response.output_text
+
+        except Exception as e:
+            raise Exception(f"Error calling OpenAI API: {str(e)}")
+
+
+    async def ainvoke_with_function_calling(
+            self,
+            input_messages: list[Message],
+            functions: Union[callable, List[callable], None] = None,
+        ) -> str:
+        """
+        Async version of `invoke_with_function_calling` using the shared AsyncOpenAI client.
+        Function calls run concurrently, synchronous functions in worker threads.
+        First-turn questions are answered from the answer cache when possible.
+
+        Args:
+            input_messages (list[Message]): List of messages to send
+            functions (callable | list[callable], optional): Functions the model can call, all registered tools if None
+
+        Returns:
+            str: The AI's response content
+        """
+        question = self.get_cacheable_question(input_messages)
+        if question is not None:
+            cached = self.answer_cache.get(question)
+            if cached is not None:
+                return cached
+
+        input_items = self.build_input(input_messages)
+        tools = self.get_tools(functions)
+        called_tools = False
+        try:
+            for tool_round in range(MAX_TOOL_ROUNDS + 1):
+                # Force a text answer once the tool rounds are used up.
+                tool_choice = {"tool_choice": "none"} if tool_round == MAX_TOOL_ROUNDS else {}
+                response = await self.async_client.responses.create(
+                    model=self.model,
+                    input=input_items,
+                    tools=tools,
+                    temperature=self.temperature,
+                    **tool_choice,
+                )
+                self.record_usage(response)
+                calls = [item for item in response.output if item.type == "function_call"]
+                if not calls:
+                    break
+                called_tools = True
+                input_items += response.output
+                input_items += await tool_registry.arun_all(calls)
+
+            output_text = response.output_text
+            # Tool results depend on their side effects, only plain answers are cached.
+            if question is not None and not called_tools:
+                self.answer_cache.set(question, output_text)
             return output_text
 
         except Exception as e:
-            # raise Exception(f"Error calling OpenAI API with function calling: {str(e)}")
+            print(f"Error calling OpenAI API with function calling: {str(e)}")
             return "ทำรายการไม่สำเร็จ กรุณาลองใหม่อีกครั้ง"
@@ -0,0 +1,165 @@
+import math
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable
+
+import tiktoken
+
+from src._types import Message
+from src.settings import CONFIG_FILE, TIKTOKEN_CACHE_DIR
+from src.utils.common import ConfigUtils
+
+# Tokens added by the API around every message (role and separators).
+MESSAGE_OVERHEAD_TOKENS = 4
+DEFAULT_ENCODING = "o200k_base"
+# Rough size of a token when no tokenizer is loaded. Counting UTF-8 bytes
+# overestimates Thai text, so the budget errs on the side of dropping turns.
+ESTIMATE_BYTES_PER_TOKEN = 4
+
+# Tokenizers loaded by preload_encodings, keyed by model. A model that failed
+# to load maps to None and is counted with the estimate.
+_encodings: dict[str, tiktoken.Encoding | None] = {}
+
+
+def load_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Load the tokenizer of a model, falling back to the encoding of the recent
+    OpenAI models for unknown names. tiktoken downloads the BPE file the
+    first time, so this is only called at startup or at image build time.
+    """
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", str(TIKTOKEN_CACHE_DIR))
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def preload_encodings(models: Iterable[str]) -> dict[str, bool]:
+    """
+    Load the tokenizers of the given models so requests never download one.
+    A failed load is logged and the model is counted with the estimate.
+
+    Returns:
+        dict[str, bool]: Whether the tokenizer of each model was loaded.
+    """
+    loaded = {}
+    for model in models:
+        try:
+            _encodings[model] = load_encoding(model)
+        except Exception as e:
+            print(f"Could not load the tokenizer for {model}, estimating tokens instead: {e}")
+            _encodings[model] = None
+        loaded[model] = _encodings[model] is not None
+    # Drop counts estimated before the tokenizers were available.
+    count_tokens.cache_clear()
+    return loaded
+
+
+def preload_config_encodings() -> dict[str, bool]:
+    """
+    Preload the tokenizer of the model set in the config file.
+    """
+    model = ConfigUtils.load_config(file_path=CONFIG_FILE).get("model") or DEFAULT_ENCODING
+    return preload_encodings([model])
+
+
+def get_encoding(model: str) -> tiktoken.Encoding | None:
+    """
+    Get the preloaded tokenizer of a model, or None if it was not loaded.
+    """
+    return _encodings.get(model)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text.encode("utf-8")) / ESTIMATE_BYTES_PER_TOKEN)
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count the tokens of a text. Results are cached, so the large system prompt
+    is only tokenized once.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text))
+
+
+@dataclass
+class ContextReport:
+    budget: int
+    used_tokens: int
+    kept_turns: int
+    dropped_turns: int
+    dropped_tokens: int
+
+
+class ContextBuilder:
+    """
+    Assembles the model input within a token budget.
+
+    The system messages, the context messages and the latest turn are always
+    kept. Older turns are added newest first until the budget is used up;
+    everything older than the first turn that does not fit is dropped.
+    """
+
+    def __init__(self, model: str, budget: int):
+        self.model = model
+        self.budget = budget
+
+    def count_message_tokens(self, message: Message) -> int:
+        return count_tokens(message.content, self.model) + MESSAGE_OVERHEAD_TOKENS
+
+    def build(
+            self,
+            system_messages: list[Message],
+            history: list[Message],
+            context_messages: list[Message] = (),
+        ) -> tuple[list[Message], ContextReport]:
+        """
+        Build the messages to send.
+
+        Args:
+            system_messages (list[Message]): Messages always sent first.
+            history (list[Message]): Conversation turns in chronological order, the last one is the latest turn.
+            context_messages (list[Message]): Messages always sent, placed right before the latest turn.
+
+        Returns:
+            tuple[list[Message], ContextReport]: The messages and a report of what was dropped.
+        """
+        context_messages = list(context_messages)
+        used_tokens = sum(self.count_message_tokens(msg) for msg in system_messages + context_messages)
+        latest = history[-1:]
+        used_tokens += sum(self.count_message_tokens(msg) for msg in latest)
+        kept: list[Message] = []
+
+        older = history[:-1]
+        dropped = len(older)
+        for i in range(len(older) - 1, -1, -1):
+            tokens = self.count_message_tokens(older[i])
+            if used_tokens + tokens > self.budget:
+                break
+            kept.append(older[i])
+            used_tokens += tokens
+            dropped -= 1
+
+        dropped_tokens = sum(self.count_message_tokens(msg) for msg in older[:dropped])
+        report = ContextReport(
+            budget=self.budget,
+            used_tokens=used_tokens,
+            kept_turns=len(kept) + len(latest),
+            dropped_turns=dropped,
+            dropped_tokens=dropped_tokens,
+        )
+        return system_messages + kept[::-1] + context_messages + latest, report
+
+
+if __name__ == "__main__":
+    # Warm the tiktoken cache at image build time so containers start offline.
+    loaded = preload_config_encodings()
+    for name, ok in loaded.items():
+        print(f"Tokenizer for {name}: {'loaded' if ok else 'failed'}")
+    if not all(loaded.values()):
+        raise SystemExit(1)
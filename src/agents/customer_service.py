@@ -1,23 +1,38 @@
+import asyncio
+import os
 import sys
+import threading
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 from src.agents.base_agent import BaseAgent
 from src.utils.loader import PdfFile
+from src.utils.prompts_utils import get_prompt
+from src.utils.retrieval import PriceSheetRetriever
+from src.utils.answer_cache import AnswerCache
 from src.utils.common import ConfigUtils, CommonUtils
-from src.settings import CONFIG_FILE, PRICE_SHEET_PATH, OPERATOR_PROMPT_PATH
+from src.settings import (
+    CONFIG_FILE,
+    PRICE_SHEET_PATH,
+    OPERATOR_PROMPT_PATH,
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_MAX_BYTES,
+    ANSWER_CACHE_SIMILARITY,
+)
 from src.gcp.drive import GoogleDrive
   # Adjust the path as needed
 
 
-def get_operator_agent() -> BaseAgent:
+def build_operator_agent() -> BaseAgent:
     """
     Create and return an instance of the operator agent.
     The agent is configured with a system prompt and a price sheet.
     """
     # Load configuration
     config = ConfigUtils.load_config(file_path=CONFIG_FILE)
-    
+
     # Load the price sheet
     if CommonUtils.is_folder_empty(PRICE_SHEET_PATH.parent):
         google_drive = GoogleDrive()
@@ -28,17 +43,163 @@ def get_operator_agent() -> BaseAgent:
 
     pdf_file = PdfFile(file_path=PRICE_SHEET_PATH)
     price_sheet_content = pdf_file.get_markdown()
-    
+    # Only the rows relevant to the conversation are sent, see PriceSheetRetriever.
+    retriever = PriceSheetRetriever(
+        markdown=price_sheet_content,
+        top_k=config.get('retrieval_top_k', 8)
+    )
+
     # Load the operator prompt
-    with open(OPERATOR_PROMPT_PATH, 'r', encoding='utf-8') as file:
-        system_prompt = file.read().format(price_sheet=price_sheet_content)
-    
+    system_prompt = get_prompt(OPERATOR_PROMPT_PATH)
+
+    # A new agent starts with an empty answer cache, so answers never outlive
+    # the price sheet or prompt they were generated from.
+    answer_cache = AnswerCache(
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        ttl=ANSWER_CACHE_TTL,
+        max_bytes=ANSWER_CACHE_MAX_BYTES,
+        threshold=ANSWER_CACHE_SIMILARITY,
+    ) if ANSWER_CACHE_ENABLED else None
+
     # Create the operator agent
     operator_agent = BaseAgent(
         model=config.get('model', 'gpt-4o-mini-2024-07-18'),
         temperature=config.get('temperature', 0),
-        system_prompt=system_prompt
+        system_prompt=system_prompt,
+        context_token_budget=config.get('context_token_budget'),
+        retriever=retriever,
+        answer_cache=answer_cache
     )
-    
+
     return operator_agent
 
+
+class OperatorAgentRegistry:
+    """
+    Process-wide cache of the operator agent.
+
+    The agent is built once and shared between requests. It is rebuilt only
+    when one of its source files (config, prompt or price sheet) changes on disk.
+    From async code the rebuild runs in a thread and the previous agent keeps
+    being served until the new one is ready.
+    """
+
+    def __init__(self, source_files: list[str | Path] | None = None):
+        self.source_files = source_files or [CONFIG_FILE, OPERATOR_PROMPT_PATH, PRICE_SHEET_PATH]
+        self._agent: BaseAgent | None = None
+        self._fingerprint: tuple | None = None
+        self._lock = threading.Lock()
+        self._rebuild_task: asyncio.Task | None = None
+        # Fingerprint of the sources that last failed to build, not retried until they change.
+        self._failed_fingerprint: tuple | None = None
+        self.last_error: str | None = None
+
+    def get_fingerprint(self) -> tuple:
+        """
+        Get a cheap fingerprint of the source files based on mtime and size.
+
+        Returns:
+            tuple: One (path, mtime_ns, size) entry per source file. Missing files
+            are recorded with None values so that their creation triggers a rebuild.
+        """
+        fingerprint = []
+        for file_path in self.source_files:
+            try:
+                stat = os.stat(file_path)
+                fingerprint.append((str(file_path), stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                fingerprint.append((str(file_path), None, None))
+        return tuple(fingerprint)
+
+    def _rebuild(self) -> BaseAgent:
+        with self._lock:
+            # Another thread may have rebuilt the agent while we were waiting.
+            fingerprint = self.get_fingerprint()
+            if self._agent is not None and fingerprint == self._fingerprint:
+                return self._agent
+            print("Building operator agent...")
+            try:
+                agent = build_operator_agent()
+            except Exception as e:
+                self._failed_fingerprint = fingerprint
+                self.last_error = str(e)
+                raise
+            self._agent = agent
+            # The price sheet may have just been downloaded, take a fresh fingerprint.
+            self._fingerprint = self.get_fingerprint()
+            self._failed_fingerprint = None
+            self.last_error = None
+            return agent
+
+    def get_agent(self) -> BaseAgent:
+        """
+        Get the shared operator agent, rebuilding it if any source file changed.
+        Blocks while rebuilding, use `aget_agent` from async code.
+        """
+        fingerprint = self.get_fingerprint()
+        if self._agent is not None and fingerprint == self._fingerprint:
+            return self._agent
+        return self._rebuild()
+
+    async def aget_agent(self) -> BaseAgent:
+        """
+        Get the shared operator agent without blocking the event loop.
+
+        When a source file changed, the agent is rebuilt in a thread and the current
+        one is returned meanwhile. Only the first build is waited for.
+        """
+        agent = self._agent
+        fingerprint = self.get_fingerprint()
+        if agent is not None and fingerprint == self._fingerprint:
+            return agent
+
+        if self._rebuild_task is None and (agent is None or fingerprint != self._failed_fingerprint):
+            self._rebuild_task = asyncio.create_task(asyncio.to_thread(self._rebuild))
+            self._rebuild_task.add_done_callback(self._on_rebuilt)
+        if agent is not None:
+            return agent
+        return await asyncio.shield(self._rebuild_task)
+
+    def _on_rebuilt(self, task: asyncio.Task):
+        self._rebuild_task = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Failed to build operator agent, keeping the previous one: {task.exception()}")
+
+    async def start(self):
+        """Build the agent ahead of the first message"""
+        try:
+            await self.aget_agent()
+        except Exception as e:
+            print(f"Failed to build operator agent, it will be built on first use: {e}")
+
+    def get_cached_agent(self) -> BaseAgent | None:
+        """
+        Get the current agent without building or refreshing it.
+        """
+        return self._agent
+
+    def invalidate(self):
+        """
+        Drop the cached agent so that the next call rebuilds it.
+        """
+        with self._lock:
+            self._agent = None
+            self._fingerprint = None
+            self._failed_fingerprint = None
+
+
+operator_agent_registry = OperatorAgentRegistry()
+
+
+def get_operator_agent() -> BaseAgent:
+    """
+    Return the shared instance of the operator agent.
+    """
+    return operator_agent_registry.get_agent()
+
+
+async def aget_operator_agent() -> BaseAgent:
+    """
+    Return the shared instance of the operator agent, without blocking the event loop.
+    """
+    return await operator_agent_registry.aget_agent()
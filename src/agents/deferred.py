@@ -0,0 +1,171 @@
+import asyncio
+import inspect
+import json
+from logging import getLogger
+from typing import Any, Callable
+
+from src.gcp.sql import AsyncToolJobTable
+from src.settings import (
+    DEFERRED_TOOL_MAX_ATTEMPTS,
+    DEFERRED_TOOL_RETRY_DELAY,
+    DEFERRED_TOOL_CONCURRENCY,
+)
+
+logger = getLogger(__name__)
+
+
+class DeferredToolRunner:
+    """
+    Runs the side effects of deferrable tools in the background.
+
+    The agent answers with the tool's confirmation right away while the tool runs
+    here with retries. Every run is recorded in the `tooljob` table, so failed
+    runs can be listed and replayed.
+    """
+
+    def __init__(
+            self,
+            get_tool: Callable[[str], Any],
+            max_attempts: int = DEFERRED_TOOL_MAX_ATTEMPTS,
+            retry_delay: float = DEFERRED_TOOL_RETRY_DELAY,
+            concurrency: int = DEFERRED_TOOL_CONCURRENCY,
+            table: AsyncToolJobTable = None,
+        ):
+        """
+        Args:
+            get_tool (Callable[[str], Tool | None]): Looks up a registered tool by name.
+            max_attempts (int): Attempts before a job is marked as failed.
+            retry_delay (float): Seconds before the first retry, doubled on every attempt.
+            concurrency (int): Maximum number of jobs running at once.
+            table (AsyncToolJobTable, optional): Where job outcomes are recorded.
+        """
+        self.get_tool = get_tool
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.concurrency = concurrency
+        self.table = table or AsyncToolJobTable()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+        self.succeeded = 0
+        self.failed = 0
+
+    async def _record(self, job_id: int | None, tool_name: str, arguments: str, status: str, attempts: int, error: str = None) -> int | None:
+        """Record a job state, the job still runs if the database is unavailable"""
+        try:
+            if job_id is None:
+                return await self.table.insert(tool_name=tool_name, arguments=arguments, status=status)
+            await self.table.update(job_id, status=status, attempts=attempts, last_error=error)
+        except Exception as e:
+            logger.error(f"Could not record tool job {job_id or tool_name} as {status}: {e}")
+        return job_id
+
+    async def _call(self, tool, arguments: dict, attempt: int):
+        if "attempt" in inspect.signature(tool.func).parameters:
+            # Lets a tool whose write may land and still fail check for it on retries only.
+            arguments = {**arguments, "attempt": attempt}
+        if inspect.iscoroutinefunction(tool.func):
+            return await tool.func(**arguments)
+        return await asyncio.to_thread(tool.func, **arguments)
+
+    async def run_job(self, tool, arguments: dict, job_id: int | None = None) -> bool:
+        """
+        Run a tool with retries and record the outcome. A tool with an `attempt`
+        parameter gets the attempt number, a replayed job starts at the second attempt
+        since its previous run may have had an effect.
+
+        Args:
+            tool (Tool): The tool to run.
+            arguments (dict): Keyword arguments of the tool.
+            job_id (int, optional): Id of an existing job being replayed.
+
+        Returns:
+            bool: True if the tool succeeded.
+        """
+        encoded = json.dumps(arguments, ensure_ascii=False)
+        previous_attempts = 0 if job_id is None else 1
+        if job_id is None:
+            job_id = await self._record(None, tool.name, encoded, "running", 0)
+        else:
+            await self._record(job_id, tool.name, encoded, "running", 0)
+
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if self._semaphore is not None:
+                    async with self._semaphore:
+                        await self._call(tool, arguments, previous_attempts + attempt)
+                else:
+                    await self._call(tool, arguments, previous_attempts + attempt)
+                await self._record(job_id, tool.name, encoded, "succeeded", attempt)
+                self.succeeded += 1
+                return True
+            except Exception as e:
+                error = str(e)
+                logger.warning(f"Tool {tool.name} attempt {attempt}/{self.max_attempts} failed: {error}")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+        await self._record(job_id, tool.name, encoded, "failed", self.max_attempts, error)
+        self.failed += 1
+        logger.error(f"Tool {tool.name} failed after {self.max_attempts} attempts: {error}")
+        return False
+
+    def _track(self, task: asyncio.Task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def submit(self, tool, arguments: dict):
+        """
+        Schedule a tool run and return immediately.
+        Can be called from the event loop or from a worker thread.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is not None and (self._loop is None or running_loop is self._loop):
+            self._track(running_loop.create_task(self.run_job(tool, arguments)))
+        elif self._loop is not None:
+            def schedule():
+                self._track(self._loop.create_task(self.run_job(tool, arguments)))
+            self._loop.call_soon_threadsafe(schedule)
+        else:
+            # No event loop to run in the background, e.g. a script.
+            asyncio.run(self.run_job(tool, arguments))
+
+    async def replay(self, job_id: int) -> bool:
+        """
+        Run a recorded job again.
+
+        Raises:
+            ValueError: If the job or its tool does not exist.
+        """
+        job = await self.table.read(job_id)
+        if job is None:
+            raise ValueError(f"Tool job {job_id} not found")
+        tool = self.get_tool(job.tool_name)
+        if tool is None:
+            raise ValueError(f"Tool '{job.tool_name}' is not registered")
+        return await self.run_job(tool, json.loads(job.arguments), job_id=job_id)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def stop(self, timeout: float = 30):
+        """Wait for the running jobs to finish"""
+        if self._tasks:
+            logger.info(f"Waiting for {len(self._tasks)} tool jobs.")
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        self._loop = None
+        self._semaphore = None
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._tasks),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+        }
@@ -1,17 +1,41 @@
 from src.gcp.gsheet import Sheet
+from src.agents.tools import tool_registry
 
+_client_info_sheet: Sheet | None = None
 
+
+def get_client_info_sheet() -> Sheet:
+    """
+    Get the shared Client info sheet, so gspread is only authorized once.
+    """
+    global _client_info_sheet
+    if _client_info_sheet is None:
+        _client_info_sheet = Sheet(spreadsheet_name="Client-detail-spread-sheet", sheet_name="Client info")
+    return _client_info_sheet
+
+
+@tool_registry.register(deferrable=True, confirmation="บันทึกข้อมูลสำเร็จ")
 def add_contact_info(
         name: str="",
         email: str="", 
         phone: str="", 
         address: str="", 
-        additional_requirements: str=""):
+        additional_requirements: str="",
+        attempt: int=1):
     """
     Add client contact information to the Google Sheet.
+
+    Runs in the background, the row is appended directly so that a failed write
+    raises and is retried, then recorded as failed in the tool jobs. A write can
+    land and still time out, so on a retry a row that is already in the sheet is
+    not appended again. The first attempt always appends, the same contact can be
+    submitted twice.
     """
-    sheet = Sheet(spreadsheet_name="Client-detail-spread-sheet", sheet_name="Client info")
     content = [name, email, phone, address, additional_requirements]
+    sheet = get_client_info_sheet()
+    if attempt > 1 and sheet.has_row(content):
+        print(f"Contact info {content} is already in Google Sheet.")
+        return "บันทึกข้อมูลสำเร็จ"
     sheet.add_content(content)
     print(f"Added contact info: {content} to Google Sheet.")
     return "บันทึกข้อมูลสำเร็จ"
@@ -0,0 +1,177 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+
+from src.agents.base_agent import BaseAgent
+from src.gcp.sql import AsyncChatHistoryTable, AsyncConversationSummaryTable
+from src.settings import (
+    CONFIG_FILE,
+    SUMMARY_THRESHOLD,
+    SUMMARY_KEEP_RECENT,
+    SUMMARY_FOLD_CHUNK,
+    SUMMARY_PROMPT_PATH,
+)
+from src.utils.cache import TTLCache
+from src.utils.common import ConfigUtils
+from src.utils.prompts_utils import get_prompt
+from src._types import Message
+
+
+@dataclass(frozen=True)
+class ConversationSummary:
+    summary: str
+    last_message_id: int
+    # Timestamp of the last folded message, None for summaries stored without one
+    last_message_at: datetime | None = None
+
+
+NO_SUMMARY = ConversationSummary(summary="", last_message_id=0)
+
+
+class ConversationSummarizer:
+    """
+    Keeps prompts constant-size by folding older turns into a stored summary.
+
+    Once more than `threshold` messages of a conversation are not covered by its
+    summary, a background task condenses all but the `keep_recent` latest of them
+    into the summary. Prompts are built from the summary plus the turns after it.
+
+    Coverage is tracked by message timestamp, since messages queued by the write-behind
+    have no row id until they are flushed. Long histories are folded `fold_chunk`
+    messages at a time.
+    """
+
+    def __init__(
+            self,
+            threshold: int = SUMMARY_THRESHOLD,
+            keep_recent: int = SUMMARY_KEEP_RECENT,
+            fold_chunk: int = SUMMARY_FOLD_CHUNK,
+            summary_table: AsyncConversationSummaryTable = None,
+            history_table: AsyncChatHistoryTable = None,
+            cache_ttl: float = 900,
+            max_users: int = 1000,
+        ):
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self.fold_chunk = fold_chunk
+        self.summary_table = summary_table or AsyncConversationSummaryTable()
+        self.history_table = history_table or AsyncChatHistoryTable()
+        self._cache = TTLCache(max_entries=max_users, ttl=cache_ttl)
+        self._agent: BaseAgent | None = None
+        self._in_flight: dict[str, asyncio.Task] = {}
+
+    def get_agent(self) -> BaseAgent:
+        if self._agent is None:
+            config = ConfigUtils.load_config(file_path=CONFIG_FILE)
+            self._agent = BaseAgent(
+                model=config.get('model', 'gpt-4o-mini-2024-07-18'),
+                temperature=0,
+                system_prompt=get_prompt(SUMMARY_PROMPT_PATH)
+            )
+        return self._agent
+
+    async def get_summary(self, user_uuid: str) -> ConversationSummary:
+        """
+        Get the stored summary of a user, NO_SUMMARY if there is none.
+        """
+        summary = self._cache.get(user_uuid)
+        if summary is None:
+            row = await self.summary_table.read(user_uuid)
+            summary = ConversationSummary(row.summary, row.last_message_id, row.last_message_at) if row else NO_SUMMARY
+            self._cache.set(user_uuid, summary)
+        return summary
+
+    @staticmethod
+    def is_summarized(msg: Message, summary: ConversationSummary) -> bool:
+        if summary.last_message_at is not None and msg.timestamp is not None:
+            return msg.timestamp <= summary.last_message_at
+        # Messages without an id are still queued for writing, so they are newer than the summary.
+        return msg.id is not None and msg.id <= summary.last_message_id
+
+    @classmethod
+    def get_unsummarized(cls, history: list[Message], summary: ConversationSummary) -> list[Message]:
+        return [msg for msg in history if not cls.is_summarized(msg, summary)]
+
+    async def get_prompt_messages(self, user_uuid: str, history: list[Message]) -> list[Message]:
+        """
+        Build the conversation part of the prompt: the summary, then the turns it does not cover.
+
+        Args:
+            user_uuid (str): The user UUID.
+            history (list[Message]): The recent conversation window.
+
+        Returns:
+            list[Message]: Messages to send before the latest user turn.
+        """
+        summary = await self.get_summary(user_uuid)
+        messages = self.get_unsummarized(history, summary)
+        if summary.summary:
+            messages = [
+                Message(role="system", content=f"Summary of the earlier conversation:\n{summary.summary}")
+            ] + messages
+        return messages
+
+    def schedule(self, user_uuid: str, history: list[Message]):
+        """
+        Start summarizing a conversation in the background if enough turns are not summarized.
+        Must be called from the event loop.
+        """
+        if user_uuid in self._in_flight:
+            return
+        summary = self._cache.get(user_uuid) or NO_SUMMARY
+        if len(self.get_unsummarized(history, summary)) < self.threshold:
+            return
+
+        task = asyncio.create_task(self.summarize(user_uuid))
+        self._in_flight[user_uuid] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(user_uuid, None))
+
+    async def fold(self, summary: ConversationSummary, rows: list) -> ConversationSummary:
+        """
+        Fold chat history rows, oldest first, into a summary.
+        """
+        transcript = "\n".join(f"{row.role}: {row.content}" for row in rows)
+        prompt = (
+            f"Previous summary:\n{summary.summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}"
+        )
+        text = await self.get_agent().ainvoke([Message(role="user", content=prompt)])
+        return ConversationSummary(
+            summary=text.strip(),
+            last_message_id=rows[-1].id,
+            last_message_at=rows[-1].timestamp,
+        )
+
+    async def summarize(self, user_uuid: str) -> ConversationSummary:
+        """
+        Fold the turns that are not summarized, except the latest `keep_recent`, into the summary.
+        """
+        try:
+            summary = await self.get_summary(user_uuid)
+            folded = 0
+            while True:
+                limit = self.fold_chunk + self.keep_recent
+                rows = await self.history_table.read_after(user_uuid, summary.last_message_id, limit=limit)
+                if len(rows) <= self.keep_recent:
+                    break
+
+                # With a full page there may be newer rows, its tail is folded on the next pass.
+                to_fold = rows[:len(rows) - self.keep_recent]
+                summary = await self.fold(summary, to_fold)
+                await self.summary_table.upsert(
+                    user_uuid, summary.summary, summary.last_message_id, summary.last_message_at
+                )
+                self._cache.set(user_uuid, summary)
+                folded += len(to_fold)
+                if len(rows) < limit:
+                    break
+
+            if folded:
+                print(f"Summarized {folded} messages for user {user_uuid}")
+            return summary
+        except Exception as e:
+            print(f"Failed to summarize conversation of user {user_uuid}: {e}")
+            return NO_SUMMARY
+
+
+conversation_summarizer = ConversationSummarizer()
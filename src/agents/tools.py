@@ -0,0 +1,207 @@
+import asyncio
+import inspect
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
+
+from src.settings import FUNCTION_CALLINGS_FILE
+from src.utils.functions_calling import FunctionCallingUtils
+from src.agents.deferred import DeferredToolRunner
+
+
+@dataclass(frozen=True)
+class Tool:
+    name: str
+    func: Callable
+    schema: dict
+    # Deferrable tools answer with `confirmation` at once and run in the background.
+    deferrable: bool = False
+    confirmation: str | None = None
+
+
+class ToolRegistry:
+    """
+    Registry of the Python functions the agents can call.
+
+    Functions are registered by name, usually with the `register` decorator. Their
+    schemas are read from the function calling file and validated once by `load`,
+    and then served from memory on every request.
+    """
+
+    def __init__(self, schema_file=FUNCTION_CALLINGS_FILE):
+        self.schema_file = schema_file
+        self._funcs: dict[str, Callable] = {}
+        self._options: dict[str, dict] = {}
+        self._tools: dict[str, Tool] | None = None
+        self._lock = threading.Lock()
+        self.deferred = DeferredToolRunner(get_tool=self.get_tool)
+
+    def register(
+            self,
+            func: Callable | None = None,
+            *,
+            name: str | None = None,
+            deferrable: bool = False,
+            confirmation: str | None = None,
+        ):
+        """
+        Register a function as a tool, usable as a decorator.
+
+        Args:
+            func (Callable): The function to register.
+            name (str, optional): Tool name, defaults to the function name.
+            deferrable (bool): Run the tool in the background and answer with `confirmation` at once.
+            confirmation (str, optional): Output returned to the model for a deferred run.
+        """
+        if deferrable and not confirmation:
+            raise ValueError("Deferrable tools need a confirmation")
+
+        def decorator(func: Callable) -> Callable:
+            tool_name = name or func.__name__
+            with self._lock:
+                self._funcs[tool_name] = func
+                self._options[tool_name] = dict(deferrable=deferrable, confirmation=confirmation)
+                # Registered after loading, validate it on the next access.
+                self._tools = None
+            return func
+
+        return decorator(func) if func is not None else decorator
+
+    @staticmethod
+    def validate_schema(name: str, func: Callable, schema: dict):
+        """
+        Check that a schema describes a function.
+
+        Raises:
+            ValueError: If the schema is missing or does not match the function signature.
+        """
+        if not schema:
+            raise ValueError(f"No schema found for tool '{name}'")
+        if schema.get("type") != "function" or schema.get("name") != name:
+            raise ValueError(f"Schema of tool '{name}' must be of type 'function' and named '{name}'")
+        parameters = schema.get("parameters", {})
+        if parameters.get("type") != "object":
+            raise ValueError(f"Parameters of tool '{name}' must be an object")
+
+        signature = inspect.signature(func)
+        accepts_kwargs = any(p.kind == p.VAR_KEYWORD for p in signature.parameters.values())
+        unknown = set(parameters.get("properties", {})) - set(signature.parameters)
+        if unknown and not accepts_kwargs:
+            raise ValueError(f"Tool '{name}' does not accept the schema parameters {sorted(unknown)}")
+
+    def load(self) -> dict[str, Tool]:
+        """
+        Read and validate the schemas of all registered tools. Called once at startup,
+        later calls return the loaded tools.
+        """
+        if self._tools is not None:
+            return self._tools
+        with self._lock:
+            if self._tools is None:
+                schemas = FunctionCallingUtils.load_schemas(self.schema_file)
+                tools = {}
+                for name, func in self._funcs.items():
+                    schema = schemas.get(name, {})
+                    self.validate_schema(name, func, schema)
+                    tools[name] = Tool(name=name, func=func, schema=schema, **self._options[name])
+                self._tools = tools
+                print(f"Loaded tools: {sorted(tools)}")
+            return self._tools
+
+    def get_tool(self, name: str) -> Tool | None:
+        return self.load().get(name)
+
+    def get_schemas(self, names: Iterable[str] | None = None) -> list[dict]:
+        """
+        Get the schemas of the given tools, or of all tools. The list is sorted by
+        name so that the same tools always produce the same request prefix.
+        """
+        tools = self.load()
+        names = sorted(tools if names is None else set(names))
+        return [tools[name].schema for name in names]
+
+    @staticmethod
+    def _output(call, output: Any) -> dict:
+        return {
+            "type": "function_call_output",
+            "call_id": call.call_id,
+            "output": output if isinstance(output, str) else json.dumps(output, ensure_ascii=False),
+        }
+
+    def _prepare(self, call) -> tuple[Tool | None, dict | None, str | None]:
+        tool = self.get_tool(call.name)
+        if tool is None:
+            return None, None, f"Unknown tool '{call.name}'"
+        try:
+            return tool, json.loads(call.arguments or "{}"), None
+        except json.JSONDecodeError as e:
+            return None, None, f"Invalid arguments for tool '{call.name}': {e}"
+
+    async def arun(self, call) -> dict:
+        """
+        Run one function call of a response.
+        Synchronous functions are run in a worker thread. Deferrable tools are handed
+        to the background runner and return their confirmation.
+
+        Returns:
+            dict: The `function_call_output` input item holding the result or the error.
+        """
+        tool, args, error = self._prepare(call)
+        if error is not None:
+            return self._output(call, error)
+        if tool.deferrable:
+            self.deferred.submit(tool, args)
+            return self._output(call, tool.confirmation)
+        print(f"Calling tool {call.name} with arguments: {call.arguments}")
+        try:
+            if inspect.iscoroutinefunction(tool.func):
+                output = await tool.func(**args)
+            else:
+                output = await asyncio.to_thread(tool.func, **args)
+        except Exception as e:
+            print(f"Error running tool {call.name}: {str(e)}")
+            output = f"Error running tool '{call.name}': {str(e)}"
+        return self._output(call, output)
+
+    async def arun_all(self, calls: list) -> list[dict]:
+        """
+        Run the function calls of a response concurrently.
+
+        Returns:
+            list[dict]: The `function_call_output` items, in the order of the calls.
+        """
+        return list(await asyncio.gather(*(self.arun(call) for call in calls)))
+
+    def run(self, call) -> dict:
+        """
+        Synchronous version of `arun`.
+        """
+        tool, args, error = self._prepare(call)
+        if error is not None:
+            return self._output(call, error)
+        if tool.deferrable:
+            self.deferred.submit(tool, args)
+            return self._output(call, tool.confirmation)
+        print(f"Calling tool {call.name} with arguments: {call.arguments}")
+        try:
+            output = tool.func(**args)
+            if inspect.isawaitable(output):
+                output = asyncio.run(output)
+        except Exception as e:
+            print(f"Error running tool {call.name}: {str(e)}")
+            output = f"Error running tool '{call.name}': {str(e)}"
+        return self._output(call, output)
+
+    def run_all(self, calls: list) -> list[dict]:
+        """
+        Synchronous version of `arun_all`, running several calls in worker threads.
+        """
+        if len(calls) <= 1:
+            return [self.run(call) for call in calls]
+        with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+            return list(executor.map(self.run, calls))
+
+
+tool_registry = ToolRegistry()
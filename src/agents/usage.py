@@ -0,0 +1,69 @@
+import threading
+from dataclasses import dataclass, asdict
+
+
+@dataclass
+class ModelCacheUsage:
+    requests: int = 0
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    # Requests where at least part of the prompt was served from the cache
+    cache_hits: int = 0
+
+    @property
+    def cached_ratio(self) -> float:
+        return self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+
+
+class PromptCacheStats:
+    """
+    Per-model accounting of provider-side prompt caching, from the `usage` of each response.
+    """
+
+    def __init__(self):
+        self._models: dict[str, ModelCacheUsage] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, usage) -> int:
+        """
+        Record the usage of one response.
+
+        Args:
+            model (str): The model the request was sent to.
+            usage: The `usage` object of a Responses API response.
+
+        Returns:
+            int: The number of cached input tokens of the response.
+        """
+        if usage is None:
+            return 0
+        input_tokens = getattr(usage, "input_tokens", 0) or 0
+        details = getattr(usage, "input_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+
+        with self._lock:
+            stats = self._models.setdefault(model, ModelCacheUsage())
+            stats.requests += 1
+            stats.input_tokens += input_tokens
+            stats.cached_tokens += cached_tokens
+            if cached_tokens:
+                stats.cache_hits += 1
+        return cached_tokens
+
+    def get_ratio(self, model: str) -> float:
+        """
+        Get the share of input tokens served from the prompt cache for a model.
+        """
+        with self._lock:
+            stats = self._models.get(model)
+            return stats.cached_ratio if stats else 0.0
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {
+                model: {**asdict(stats), "cached_ratio": round(stats.cached_ratio, 4)}
+                for model, stats in self._models.items()
+            }
+
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,134 @@
+import asyncio
+from dataclasses import dataclass, field
+from operator import attrgetter
+from typing import Any, Awaitable, Callable, Hashable
+
+from src.settings import COALESCE_QUIET_PERIOD, COALESCE_MAX_WAIT
+
+
+@dataclass
+class _Batch:
+    future: asyncio.Future
+    started_at: float
+    handler: Callable[[list], Awaitable] | None = None
+    items: list = field(default_factory=list)
+    timer: asyncio.TimerHandle | None = None
+
+
+class MessageCoalescer:
+    """
+    Merges the messages a user sends in a quick burst.
+
+    Messages submitted under the same key are collected until no new message
+    arrives for `quiet_period` seconds, or `max_wait` seconds after the first one,
+    and are then handled together by a single handler call. Messages can be handed
+    off out of order, e.g. by concurrent ingest workers, so the items of a batch are
+    passed to the handler sorted by `sort_key`.
+    """
+
+    def __init__(
+            self,
+            quiet_period: float = COALESCE_QUIET_PERIOD,
+            max_wait: float = COALESCE_MAX_WAIT,
+            sort_key: Callable[[Any], Any] | None = None,
+        ):
+        """
+        Args:
+            quiet_period (float): Seconds without a new message that close a batch, 0 to disable coalescing.
+            max_wait (float): Maximum seconds a batch stays open after its first message.
+            sort_key (Callable[[Any], Any], optional): Orders the items of a batch, e.g. by platform timestamp.
+        """
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self.sort_key = sort_key
+        self._batches: dict[Hashable, _Batch] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+        self.messages = 0
+        self.batches = 0
+
+    async def submit(self, key: Hashable, item: Any, handler: Callable[[list], Awaitable]) -> Any:
+        """
+        Add a message to the open batch of a key and wait until the batch is handled.
+
+        Args:
+            key (Hashable): Batch key, e.g. the platform and user id.
+            item (Any): The message.
+            handler (Callable[[list], Awaitable]): Handles the items of the batch. The
+                handler of the latest message is used, so it can carry the latest context.
+
+        Returns:
+            Any: The result of the handler, shared by all messages of the batch.
+        """
+        # One waiter being cancelled must not cancel the batch of the others.
+        return await asyncio.shield(self.add(key, item, handler))
+
+    def add(self, key: Hashable, item: Any, handler: Callable[[list], Awaitable]) -> asyncio.Future:
+        """
+        Add a message to the open batch of a key without waiting for it.
+        Must be called from the event loop.
+
+        Returns:
+            asyncio.Future: Resolves to the result of the handler, shared by all messages of the batch.
+        """
+        self.messages += 1
+        loop = asyncio.get_running_loop()
+        if self.quiet_period <= 0:
+            batch = _Batch(future=loop.create_future(), started_at=loop.time(), handler=handler, items=[item])
+            self._close(None, batch)
+            return batch.future
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = _Batch(future=loop.create_future(), started_at=loop.time())
+            self._batches[key] = batch
+        batch.items.append(item)
+        batch.handler = handler
+
+        if batch.timer is not None:
+            batch.timer.cancel()
+        remaining = batch.started_at + self.max_wait - loop.time()
+        batch.timer = loop.call_later(max(0, min(self.quiet_period, remaining)), self._close, key, batch)
+        return batch.future
+
+    def _close(self, key: Hashable, batch: _Batch):
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+        self.batches += 1
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _Batch):
+        try:
+            items = sorted(batch.items, key=self.sort_key) if self.sort_key else list(batch.items)
+            batch.future.set_result(await batch.handler(items))
+        except Exception as e:
+            batch.future.set_exception(e)
+
+    def flush(self):
+        """Close every open batch now instead of waiting for its quiet period"""
+        for key, batch in list(self._batches.items()):
+            if batch.timer is not None:
+                batch.timer.cancel()
+            self._close(key, batch)
+
+    async def drain(self, timeout: float = 30):
+        """
+        Close the open batches and wait for the running ones to be handled,
+        e.g. before shutting down. Batches still running after the timeout are left running.
+        """
+        self.flush()
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+
+    def stats(self) -> dict:
+        return {
+            "open_batches": len(self._batches),
+            "messages": self.messages,
+            "batches": self.batches,
+        }
+
+
+# Items are IncomingMessage, ordered by their platform timestamp.
+message_coalescer = MessageCoalescer(sort_key=attrgetter("sort_key"))
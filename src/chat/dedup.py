@@ -0,0 +1,193 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from src.gcp.sql import AsyncWebhookEventTable
+from src.utils.cache import TTLCache
+from src.settings import (
+    WEBHOOK_DEDUP_TTL,
+    WEBHOOK_DEDUP_MAX_ENTRIES,
+    WEBHOOK_DEDUP_RETENTION_DAYS,
+)
+
+logger = getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class EventProgress:
+    """What an earlier attempt at a webhook event already did"""
+    replied: bool = False
+    persisted: bool = False
+
+
+NEW_EVENT = EventProgress()
+
+
+class WebhookDeduplicator:
+    """
+    Drops webhook events that were already received.
+
+    The webhook only checks event ids against an in-memory TTL set, and records new
+    ids in the `webhookevent` table in the background, so that acknowledging a
+    webhook never waits for the database. The worker then confirms each event
+    against that record, whose primary key makes the check safe across instances.
+    Jobs are processed by the instance that queued them, so the record of an event
+    is always started by the same process that confirms it.
+
+    The record also keeps the progress of the event. A webhook job is retried until
+    its messages are answered and persisted, and a retry reads which of them an
+    earlier attempt already replied to or persisted, so that it does not repeat it.
+    """
+
+    def __init__(
+            self,
+            ttl: float = WEBHOOK_DEDUP_TTL,
+            max_entries: int = WEBHOOK_DEDUP_MAX_ENTRIES,
+            retention_days: int = WEBHOOK_DEDUP_RETENTION_DAYS,
+            table: AsyncWebhookEventTable = None,
+        ):
+        self.seen = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.retention_days = retention_days
+        self.table = table or AsyncWebhookEventTable()
+        # Records started by `claim` and not confirmed yet.
+        self._records: dict[tuple[str, str], asyncio.Task] = {}
+        self.duplicates = 0
+
+    async def _record(self, platform: str, event_id: str) -> bool:
+        try:
+            return await self.table.claim(platform, event_id)
+        except Exception as e:
+            # The in-memory set still catches redeliveries to this instance.
+            logger.error(f"Could not record webhook event {platform}:{event_id}: {e}")
+            return True
+
+    def claim(self, platform: str, event_id: str | None) -> bool:
+        """
+        Claim a webhook event when it is received. Only the in-memory set is checked,
+        the id is recorded in the database in the background. Must be called from the event loop.
+
+        Args:
+            platform (str): The platform of the event.
+            event_id (str | None): Messenger message mid or LINE webhookEventId.
+
+        Returns:
+            bool: False if the event was already received by this instance.
+        """
+        if not event_id:
+            return True
+        key = (platform, event_id)
+        if key in self.seen:
+            self.duplicates += 1
+            print(f"Dropping duplicate {platform} event {event_id}")
+            return False
+        self.seen.set(key, True)
+        self._records[key] = asyncio.create_task(self._record(platform, event_id))
+        return True
+
+    async def confirm(self, platform: str, event_id: str | None) -> bool:
+        """
+        Check a claimed event against the database before processing it.
+
+        Returns:
+            bool: True if the event should be processed, False if another instance
+                received it first.
+        """
+        if not event_id:
+            return True
+        record = self._records.pop((platform, event_id), None)
+        if record is None:
+            # Claimed by an earlier process, e.g. a job replayed after a restart.
+            return True
+        if not await record:
+            self.duplicates += 1
+            print(f"Dropping duplicate {platform} event {event_id}")
+            return False
+        return True
+
+    async def confirm_events(self, platform: str, event_ids: list[str | None]) -> dict[str, EventProgress]:
+        """
+        Confirm the events of a webhook job and read the progress of the ones an
+        earlier attempt or process already claimed.
+
+        Returns:
+            dict[str, EventProgress]: The events to process and their progress. Events
+                without an id are always processed.
+        """
+        event_ids = list(dict.fromkeys(event_ids))
+        # Events without a pending record were claimed before, e.g. by a failed attempt.
+        replayed = [
+            event_id for event_id in event_ids
+            if event_id and (platform, event_id) not in self._records
+        ]
+        confirmed = await asyncio.gather(*(self.confirm(platform, event_id) for event_id in event_ids))
+        progress = {event_id: NEW_EVENT for event_id, is_new in zip(event_ids, confirmed) if is_new}
+        if replayed:
+            try:
+                rows = await self.table.get_progress(platform, replayed)
+            except Exception as e:
+                # Nothing is known to be done, the events are processed again.
+                logger.error(f"Could not read the progress of {platform} events {replayed}: {e}")
+                rows = []
+            for row in rows:
+                progress[row.event_id] = EventProgress(
+                    replied=row.replied_at is not None,
+                    persisted=row.persisted_at is not None,
+                )
+        return progress
+
+    async def _set_progress(self, platform: str, event_ids: list[str | None], **progress):
+        event_ids = [event_id for event_id in event_ids if event_id]
+        if not event_ids:
+            return
+        try:
+            await self.table.set_progress(platform, event_ids, **progress)
+        except Exception as e:
+            # A retry may then repeat the step, failing the reply here would repeat it for sure.
+            logger.error(f"Could not record {progress} for {platform} events {event_ids}: {e}")
+
+    async def mark_replied(self, platform: str, event_ids: list[str | None]):
+        """Record that the events were answered"""
+        await self._set_progress(platform, event_ids, replied=True)
+
+    async def mark_persisted(self, platform: str, event_ids: list[str | None]):
+        """Record that the events and their answer are in the chat history spool"""
+        await self._set_progress(platform, event_ids, persisted=True)
+
+    async def release(self, platform: str, event_id: str | None):
+        """
+        Forget a claimed event whose processing could not be scheduled, so that
+        its redelivery is processed.
+        """
+        if not event_id:
+            return
+        self.seen.delete((platform, event_id))
+        record = self._records.pop((platform, event_id), None)
+        if record is not None:
+            await asyncio.gather(record, return_exceptions=True)
+        try:
+            await self.table.delete(platform, event_id)
+        except Exception as e:
+            logger.error(f"Could not release webhook event {platform}:{event_id}: {e}")
+
+    async def start(self):
+        """Delete the event ids older than the retention period"""
+        try:
+            purged = await self.table.purge(datetime.utcnow() - timedelta(days=self.retention_days))
+            logger.info(f"Purged {purged} old webhook event ids.")
+        except Exception as e:
+            logger.error(f"Could not purge old webhook event ids: {e}")
+
+    async def stop(self):
+        if self._records:
+            await asyncio.gather(*self._records.values(), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "remembered": len(self.seen),
+            "unconfirmed": len(self._records),
+            "duplicates": self.duplicates,
+        }
+
+
+webhook_deduplicator = WebhookDeduplicator()
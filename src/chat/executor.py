@@ -0,0 +1,130 @@
+import asyncio
+import zlib
+from logging import getLogger
+from typing import Any, Awaitable, Callable
+
+from src.settings import CONVERSATION_LANES, CONVERSATION_LANE_MAX_QUEUE
+
+logger = getLogger(__name__)
+
+
+class LaneFullError(RuntimeError):
+    """Raised when the lane of a conversation has too much queued work"""
+
+
+class ConversationExecutor:
+    """
+    Runs conversation work in order per user and concurrently across users.
+
+    Users are hashed onto a fixed number of lanes. Each lane runs its work one
+    item at a time, so the messages of a user are processed strictly in order,
+    while users on different lanes are processed in parallel.
+    """
+
+    def __init__(self, lanes: int = CONVERSATION_LANES, max_queue: int = CONVERSATION_LANE_MAX_QUEUE):
+        """
+        Args:
+            lanes (int): Number of lanes.
+            max_queue (int): Maximum work items waiting in a lane.
+        """
+        self.lanes = lanes
+        self.max_queue = max_queue
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        self.processed = 0
+        self.rejected = 0
+
+    def get_lane(self, key: str) -> int:
+        """Get the lane of a conversation key, stable across processes"""
+        return zlib.crc32(key.encode("utf-8")) % self.lanes
+
+    async def run(self, key: str, func: Callable[[], Awaitable]) -> Any:
+        """
+        Run work on the lane of a conversation and wait for its result.
+
+        Args:
+            key (str): Conversation key, e.g. the platform and user id.
+            func (Callable[[], Awaitable]): Creates the coroutine to run.
+
+        Raises:
+            LaneFullError: If the lane already has `max_queue` items waiting.
+        """
+        if not self._tasks:
+            # Not started, e.g. outside the app, run in the caller.
+            return await func()
+
+        queue = self._queues[self.get_lane(key)]
+        if queue.full():
+            self.rejected += 1
+            raise LaneFullError(f"Conversation lane {self.get_lane(key)} is full")
+        future = asyncio.get_running_loop().create_future()
+        queue.put_nowait((func, future))
+        return await future
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            func, future = await queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                try:
+                    result = await func()
+                except asyncio.CancelledError:
+                    # The lane is stopped, the caller must not wait forever.
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    if not future.cancelled():
+                        future.set_result(result)
+                self.processed += 1
+            finally:
+                queue.task_done()
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.max_queue) for _ in range(self.lanes)]
+        self._tasks = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+        logger.info(f"Started conversation executor with {self.lanes} lanes.")
+
+    async def drain(self, timeout: float = 30) -> bool:
+        """
+        Wait until the lanes have run all their queued work, e.g. before shutting down.
+
+        Returns:
+            bool: False if work was still queued or running after the timeout.
+        """
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Conversation lanes not drained after {timeout} seconds, {self.stats()['queued']} items queued.")
+            return False
+        return True
+
+    async def stop(self):
+        """Stop the lanes, work still queued is cancelled. Call `drain` first to finish it."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for queue in self._queues:
+            while not queue.empty():
+                _, future = queue.get_nowait()
+                future.cancel()
+        self._tasks = []
+        self._queues = []
+
+    def stats(self) -> dict:
+        depths = [queue.qsize() for queue in self._queues]
+        return {
+            "lanes": len(self._queues),
+            "queued": sum(depths),
+            "max_lane_depth": max(depths, default=0),
+            "processed": self.processed,
+            "rejected": self.rejected,
+        }
+
+
+conversation_executor = ConversationExecutor()
@@ -0,0 +1,74 @@
+import importlib.util
+from logging import getLogger
+
+import httpx
+
+from src.settings import (
+    HTTP2_ENABLED,
+    HTTP_TIMEOUT,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+)
+
+logger = getLogger(__name__)
+
+GRAPH_API_BASE_URL = "https://graph.facebook.com"
+LINE_API_BASE_URL = "https://api.line.me"
+
+# Long-lived clients shared by all requests, one per upstream.
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def create_http_client(base_url: str) -> httpx.AsyncClient:
+    """
+    Create a keep-alive client for an upstream. HTTP/2 is used when enabled and
+    the `h2` package is installed.
+    """
+    http2 = HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+    if HTTP2_ENABLED and not http2:
+        logger.warning("The h2 package is not installed, falling back to HTTP/1.1.")
+    return httpx.AsyncClient(
+        base_url=base_url,
+        http2=http2,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_http_client(base_url: str) -> httpx.AsyncClient:
+    """
+    Get the shared client of an upstream, created on first use.
+    """
+    client = _clients.get(base_url)
+    if client is None or client.is_closed:
+        client = _clients[base_url] = create_http_client(base_url)
+    return client
+
+
+def get_graph_client() -> httpx.AsyncClient:
+    """Shared client for the Facebook Graph API"""
+    return get_http_client(GRAPH_API_BASE_URL)
+
+
+def get_line_client() -> httpx.AsyncClient:
+    """Shared client for the LINE Messaging API"""
+    return get_http_client(LINE_API_BASE_URL)
+
+
+def init_http_clients():
+    """Create the shared clients, called on application startup"""
+    get_graph_client()
+    get_line_client()
+
+
+async def close_http_clients():
+    """Close the shared clients, called on application shutdown"""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
@@ -0,0 +1,360 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from src.settings import (
+    INGEST_QUEUE_PATH,
+    INGEST_WORKERS,
+    INGEST_VISIBILITY_TIMEOUT,
+    INGEST_MAX_ATTEMPTS,
+    INGEST_RETRY_DELAY,
+    INGEST_POLL_INTERVAL,
+    INGEST_PROCESSING_TIMEOUT,
+)
+
+logger = getLogger(__name__)
+
+QUEUED = "queued"
+DEAD = "dead"
+
+
+@dataclass
+class IngestJob:
+    id: int
+    platform: str
+    payload: dict
+    attempts: int
+
+
+class WebhookQueue:
+    """
+    Durable local queue of webhook payloads, stored in SQLite in WAL mode.
+
+    A claimed job is hidden from other workers for `visibility_timeout` seconds.
+    It is deleted when acknowledged, made visible again with a delay when it
+    fails, and kept as dead once it has failed `max_attempts` times.
+    """
+
+    def __init__(
+            self,
+            path: str | Path = INGEST_QUEUE_PATH,
+            visibility_timeout: float = INGEST_VISIBILITY_TIMEOUT,
+            max_attempts: int = INGEST_MAX_ATTEMPTS,
+            retry_delay: float = INGEST_RETRY_DELAY,
+        ):
+        self.path = Path(path)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    platform TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    locked_until REAL,
+                    created_at REAL NOT NULL,
+                    last_error TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status_available ON jobs (status, available_at)")
+            self._conn = conn
+        return self._conn
+
+    def enqueue(self, platform: str, payload: dict) -> int:
+        """
+        Store a webhook payload.
+
+        Returns:
+            int: The job id.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                "INSERT INTO jobs (platform, payload, status, available_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (platform, json.dumps(payload, ensure_ascii=False), QUEUED, now, now),
+            )
+            return cursor.lastrowid
+
+    def claim(self, limit: int = 1) -> list[IngestJob]:
+        """
+        Claim the oldest visible jobs and hide them for the visibility timeout.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    """
+                    SELECT id, platform, payload, attempts FROM jobs
+                    WHERE status = ? AND available_at <= ? AND (locked_until IS NULL OR locked_until <= ?)
+                    ORDER BY id LIMIT ?
+                    """,
+                    (QUEUED, now, now, limit),
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE jobs SET locked_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(now + self.visibility_timeout, row[0]) for row in rows],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return [
+            IngestJob(id=row[0], platform=row[1], payload=json.loads(row[2]), attempts=row[3] + 1)
+            for row in rows
+        ]
+
+    def extend(self, job_ids: list[int]):
+        """Keep jobs that are still being processed hidden for another visibility timeout"""
+        locked_until = time.time() + self.visibility_timeout
+        with self._lock:
+            self._connect().executemany(
+                "UPDATE jobs SET locked_until = ? WHERE id = ?",
+                [(locked_until, job_id) for job_id in job_ids],
+            )
+
+    def ack(self, job_id: int):
+        """Delete a processed job"""
+        with self._lock:
+            self._connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def nack(self, job: IngestJob, error: str):
+        """Make a failed job visible again after a backoff, or mark it as dead"""
+        with self._lock:
+            conn = self._connect()
+            if job.attempts >= self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, locked_until = NULL, last_error = ? WHERE id = ?",
+                    (DEAD, error, job.id),
+                )
+            else:
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                conn.execute(
+                    "UPDATE jobs SET available_at = ?, locked_until = NULL, last_error = ? WHERE id = ?",
+                    (time.time() + delay, error, job.id),
+                )
+
+    def depth(self) -> dict:
+        """
+        Get the queue depth.
+
+        Returns:
+            dict: Number of queued, in-flight and dead jobs, and the age of the oldest queued job in seconds.
+        """
+        now = time.time()
+        with self._lock:
+            queued, in_flight, oldest = self._connect().execute(
+                """
+                SELECT
+                    COUNT(*),
+                    COALESCE(SUM(locked_until IS NOT NULL AND locked_until > ?), 0),
+                    MIN(created_at)
+                FROM jobs WHERE status = ?
+                """,
+                (now, QUEUED),
+            ).fetchone()
+            dead = self._connect().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (DEAD,)).fetchone()[0]
+        return {
+            "queued": queued - in_flight,
+            "in_flight": in_flight,
+            "dead": dead,
+            "oldest_age": round(now - oldest, 3) if oldest else 0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class IngestWorkerPool:
+    """
+    Pool of async workers processing the webhook queue.
+
+    Handlers are registered per platform. A handler parses its payload, hands the
+    messages off to the conversation pipeline and returns the futures of that work,
+    without waiting for it, so workers are not held by replies and messages of
+    several jobs can be coalesced. The job stays claimed until its futures resolve:
+    its lock is extended while the replies run, it is acknowledged once they are
+    answered and persisted, and retried if any of them fails. A retry skips what an
+    earlier attempt already did, see `WebhookDeduplicator.confirm_events`.
+    """
+
+    def __init__(
+            self,
+            queue: WebhookQueue = None,
+            workers: int = INGEST_WORKERS,
+            poll_interval: float = INGEST_POLL_INTERVAL,
+            processing_timeout: float = INGEST_PROCESSING_TIMEOUT,
+        ):
+        """
+        Args:
+            queue (WebhookQueue, optional): The queue to process.
+            workers (int): Number of workers claiming jobs.
+            poll_interval (float): Seconds between polls of an empty queue.
+            processing_timeout (float): Seconds a job waits for its handed-off work before it is retried.
+        """
+        self.queue = queue or WebhookQueue()
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.processing_timeout = processing_timeout
+        self._handlers: dict[str, Callable[[dict], Awaitable[list[asyncio.Future] | None]]] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+        # Jobs whose handed-off work is still running, by id.
+        self._held: dict[int, IngestJob] = {}
+        self._settling: set[asyncio.Task] = set()
+        self._heartbeat: asyncio.Task | None = None
+
+        self.processed = 0
+        self.failed = 0
+
+    def register_handler(self, platform: str, handler: Callable[[dict], Awaitable[list[asyncio.Future] | None]]):
+        self._handlers[platform] = handler
+
+    async def enqueue(self, platform: str, payload: dict) -> int:
+        """
+        Store a webhook payload and wake a worker.
+
+        Returns:
+            int: The job id.
+        """
+        job_id = await asyncio.to_thread(self.queue.enqueue, platform, payload)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def _fail(self, job: IngestJob, error: Exception):
+        error = str(error) or type(error).__name__
+        logger.error(f"Ingest job {job.id} ({job.platform}) attempt {job.attempts} failed: {error}")
+        self.failed += 1
+        await asyncio.to_thread(self.queue.nack, job, error)
+
+    async def _process(self, job: IngestJob):
+        handler = self._handlers.get(job.platform)
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for platform '{job.platform}'")
+            # Stop before the job becomes visible to another worker.
+            futures = await asyncio.wait_for(handler(job.payload), timeout=self.queue.visibility_timeout)
+        except Exception as e:
+            await self._fail(job, e)
+            return
+        self._held[job.id] = job
+        task = asyncio.create_task(self._settle(job, futures or []))
+        self._settling.add(task)
+        task.add_done_callback(self._settling.discard)
+
+    async def _settle(self, job: IngestJob, futures: list[asyncio.Future]):
+        """Acknowledge a job once its handed-off work is done, or retry it"""
+        try:
+            # Messages coalesced into one batch share its future. The work is shielded,
+            # a timeout only gives up waiting for it.
+            unique = {id(future): future for future in futures}.values()
+            results = await asyncio.wait_for(
+                asyncio.gather(*(asyncio.shield(future) for future in unique), return_exceptions=True),
+                timeout=self.processing_timeout,
+            )
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                await self._fail(job, errors[0])
+                return
+            self.processed += 1
+            await asyncio.to_thread(self.queue.ack, job.id)
+        except asyncio.TimeoutError as e:
+            await self._fail(job, e)
+        finally:
+            # A cancelled job is neither acked nor retried here, it becomes visible after its timeout.
+            self._held.pop(job.id, None)
+
+    async def _extend_held(self):
+        """Extend the locks of the jobs whose work is still running"""
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 3)
+            if not self._held:
+                continue
+            try:
+                await asyncio.to_thread(self.queue.extend, list(self._held))
+            except Exception as e:
+                logger.error(f"Could not extend the locks of ingest jobs {list(self._held)}: {e}")
+
+    async def _run(self):
+        while True:
+            jobs = await asyncio.to_thread(self.queue.claim, 1)
+            if not jobs:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            for job in jobs:
+                await self._process(job)
+
+    async def start(self):
+        """Start the workers, jobs left by a previous process are picked up again"""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        self._heartbeat = asyncio.create_task(self._extend_held())
+        logger.info(f"Started {self.workers} ingest workers, queue: {self.queue.depth()}")
+
+    async def stop_workers(self):
+        """Stop claiming new jobs, the work of the jobs already claimed keeps running"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def stop(self, timeout: float = 30):
+        """
+        Stop the workers and wait for the work of the claimed jobs. Jobs still
+        running after the timeout become visible again after their lock expires.
+        """
+        await self.stop_workers()
+        if self._settling:
+            logger.info(f"Waiting for {len(self._settling)} ingest jobs.")
+            _, pending = await asyncio.wait(list(self._settling), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        self.queue.close()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "processed": self.processed,
+            "failed": self.failed,
+            "in_progress": len(self._held),
+            **self.queue.depth(),
+        }
+
+
+ingest_workers = IngestWorkerPool()
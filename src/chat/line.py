@@ -1,25 +1,21 @@
-import httpx
+import asyncio
 import time
-from linebot import LineBotApi
 import uuid
 
 from src.settings import LINE_CHANNEL_ACCESS_TOKEN, LINE_CHANNEL_SECRET
-from src.gcp.sql import ChatHistoryTable, UserTable, CloudSqlManager
-from src.gcp.gsheet import ClientTagSheet, ConfigSheet
-from src.agents.customer_service import get_operator_agent
-from src._types import Message, Platform
-from linebot.v3.messaging import (
-    ApiClient, 
-    MessagingApi, 
-    Configuration, 
-    ReplyMessageRequest, 
-    TextMessage, 
-    # FlexMessage, 
-    # Emoji,
-)
+from src.gcp.sql import AsyncChatHistoryTable
+from src.gcp.write_behind import chat_write_behind
+from src.gcp.gsheet import client_tag_index, config_store
+from src.agents.customer_service import aget_operator_agent
+from src.agents.summarizer import conversation_summarizer
+from src.chat.coalescer import message_coalescer
+from src.chat.dedup import webhook_deduplicator
+from src.chat.executor import conversation_executor
+from src._types import IncomingMessage, Message, Platform
 from src.agents.functions import add_contact_info
 from src.chat import BaseChatApp
-from concurrent.futures import ThreadPoolExecutor
+from src.chat.http_clients import get_line_client
+from src.chat.profiles import profile_cache
 
 
 
@@ -30,8 +26,7 @@ class LineApp(BaseChatApp):
             channel_secret: str=LINE_CHANNEL_SECRET):
         self.channel_access_token = access_token
         self.channel_secret = channel_secret
-        self.line_bot_api = LineBotApi(self.channel_access_token)
-        self.configuration = Configuration(access_token=self.channel_access_token)
+        self.headers = {"Authorization": f"Bearer {self.channel_access_token}"}
 
     async def send_follow_up_message(
         self,
@@ -51,7 +46,7 @@ class LineApp(BaseChatApp):
         Returns:
             dict: JSON response from LINE API
         """
-        url = "https://api.line.me/v2/bot/message/push"
+        url = "/v2/bot/message/push"
     
         # Generate UUID for retry key if not provided
         if retry_key is None:
@@ -68,139 +63,209 @@ class LineApp(BaseChatApp):
             "messages": [{"type": "text", "text": messages}]
         }
     
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=headers)
-        
-            # Print detailed response info (equivalent to curl -v)
-            print(f"Status Code: {response.status_code}")
-            print(f"Headers: {dict(response.headers)}")
-            print(f"Response: {response.text}")
-        
-            response.raise_for_status()
-        
-            # LINE API returns empty response body on success
-            if response.text:
-                return response.json()
-            else:
-                return {"status": "success", "message": "Push message sent"}
-
-    def get_bot_response(self, messages, api_client: ApiClient = None, reply_token: str = None):
-        operator_agent = get_operator_agent()
-        line_bot_api = MessagingApi(api_client)        
-        response = operator_agent.invoke_with_function_calling(
+        response = await get_line_client().post(url, json=payload, headers=headers)
+    
+        # Print detailed response info (equivalent to curl -v)
+        print(f"Status Code: {response.status_code}")
+        print(f"Headers: {dict(response.headers)}")
+        print(f"Response: {response.text}")
+    
+        response.raise_for_status()
+    
+        # LINE API returns empty response body on success
+        if response.text:
+            return response.json()
+        else:
+            return {"status": "success", "message": "Push message sent"}
+
+    async def get_profile(self, user_id: str) -> dict:
+        """
+        Get the LINE profile of a user.
+
+        Returns:
+            dict: The profile, with `displayName`, `userId` and `pictureUrl`.
+        """
+        response = await get_line_client().get(f"/v2/bot/profile/{user_id}", headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_display_name(self, user_id: str) -> str | None:
+        """
+        Get the display name of a user from the profile cache, None if the profile is not available.
+        """
+        async def fetch() -> str | None:
+            return (await self.get_profile(user_id)).get("displayName")
+
+        return await profile_cache.get_name(Platform.LINE, user_id, fetch)
+
+    async def send_reply(self, reply_token: str, text: str):
+        """
+        Reply to a message with a text message.
+        """
+        response = await get_line_client().post(
+            "/v2/bot/message/reply",
+            json={"replyToken": reply_token, "messages": [{"type": "text", "text": text}]},
+            headers=self.headers
+        )
+        response.raise_for_status()
+
+    async def get_bot_response(self, messages, reply_token: str = None):
+        operator_agent = await aget_operator_agent()
+        response = await operator_agent.ainvoke_with_function_calling(
             messages,
             functions=add_contact_info
         )
 
-        reply_message = TextMessage(text=response)
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=reply_token,
-                messages=[reply_message]
-            )
-        )
+        await self.send_reply(reply_token=reply_token, text=response)
         return response
 
 
-    def save_to_gsheet(
+    async def save_to_gsheet(
             self, 
             user_id: str, 
-            display_name: str
+            display_name: str | None
             ):
-        client_tag_sheet = ClientTagSheet()
-        if not client_tag_sheet.has_profle(display_name):
-            client_tag_sheet.add_new_profile(
-                profile_name=display_name,
-                user_id=user_id,
-                platform=Platform.LINE
-            )
+        await client_tag_index.save_profile(
+            profile_name=display_name,
+            user_id=user_id,
+            platform=Platform.LINE
+        )
 
-        else:
-            client_tag_sheet.update_timestamp(
-                profile_name=display_name
+    def queue_message(
+            self,
+            user_id: str,
+            message: str,
+            reply_token: str,
+            timestamp: str | None = None,
+            event_id: str | None = None,
+            replied: bool = False,
+        ) -> asyncio.Future:
+        """
+        Hands a message off to be answered, without waiting for the reply.
+        Messages sent in a quick burst are answered together, with the reply token of the latest one.
+
+        Args:
+            user_id (str): The LINE user ID.
+            message (str): The message to send.
+            reply_token (str): The token to reply to the user.
+            timestamp (str, optional): The LINE event timestamp in milliseconds, defaults to now.
+            event_id (str, optional): The LINE webhookEventId of the message.
+            replied (bool): Whether an earlier attempt already answered the message.
+
+        Returns:
+            asyncio.Future: Resolves once the batch of the message is answered and persisted.
+        """
+        if timestamp is None:
+            timestamp = str(int(time.time() * 1000))
+        item = IncomingMessage(text=message, timestamp=timestamp, event_id=event_id, replied=replied)
+        return message_coalescer.add(
+            (Platform.LINE, user_id),
+            item,
+            # A batch runs on the lane of its user, after any earlier batch of the same user.
+            lambda items: conversation_executor.run(
+                f"{Platform.LINE}:{user_id}",
+                lambda: self.reply_messages(user_id, items, reply_token)
             )
+        )
 
-    def reply_message(self, user_id: str, message: str, reply_token: str):
+    async def reply_message(self, user_id: str, message: str, reply_token: str):
         """
         Sends a reply message to the user.
+        Messages sent in a quick burst are answered together, with the reply token of the latest one.
         
         Args:
             user_id (str): The LINE user ID.
             message (str): The message to send.
             reply_token (str): The token to reply to the user.
         """
+        return await asyncio.shield(self.queue_message(user_id, message, reply_token))
 
-        def get_chat_history():
-            chat_history = ChatHistoryTable()
-            return {
-                "table": chat_history, 
-                "chat_history": chat_history.get_chat_history(user_id)
-                }
-        def get_user_table():
-            user_table = UserTable()
-            return user_table
-        
-        config_sheet = ConfigSheet()
-        is_working_hour = config_sheet.is_working_hour()
-
-        if is_working_hour:
-
-            with ThreadPoolExecutor(max_workers=2) as executor:
-                start_time = time.time()
-                f_chat_history_result = executor.submit(get_chat_history)
-                f_user_table = executor.submit(get_user_table)
-                chat_history_result = f_chat_history_result.result()
-                user_table = f_user_table.result()
-                chat_history = chat_history_result["table"]
-                messages_history = chat_history_result["chat_history"]
-                end_time = time.time()
-                print(f"Chat history fetched in {end_time - start_time:.2f} seconds")
-            
-        else:
-            print("Outside working hours, skipping chat history retrieval.")
-            messages_history = []
-            user_table = UserTable()
-
-        timestamp = str(int(time.time()))
-        user_profile = self.line_bot_api.get_profile(user_id)
-
-        with ApiClient(self.configuration) as api_client:
-            if is_working_hour:
-                messages = messages_history + [Message(role="user", content=message)]
-
-                response = self.get_bot_response(
-                    messages=messages,
-                    api_client=api_client,
-                    reply_token=reply_token
-                )
-            else:
-                print("Outside working hours skip bot response generation.")
-
-            self.save_to_gsheet(
-                user_id=user_id,
-                display_name=user_profile.display_name
+    async def reply_messages(self, user_id: str, messages: list[IncomingMessage], reply_token: str):
+        """
+        Answers one or more messages of a user with a single reply.
+        Messages an earlier attempt already answered are only persisted.
+
+        Args:
+            user_id (str): The LINE user ID.
+            messages (list[IncomingMessage]): The messages, oldest first.
+            reply_token (str): The token to reply to the user.
+        """
+
+        is_working_hour = config_store.is_working_hour()
+
+        chat_history = AsyncChatHistoryTable()
+
+        async def read_history() -> list[Message]:
+            if not is_working_hour:
+                print("Outside working hours, skipping chat history retrieval.")
+                return []
+            start_time = time.time()
+            messages_history = await chat_history.get_chat_history(user_id)
+            end_time = time.time()
+            print(f"Chat history fetched in {end_time - start_time:.2f} seconds")
+            return messages_history
+
+        # The profile is looked up while the history is read.
+        messages_history, display_name = await asyncio.gather(
+            read_history(),
+            self.get_display_name(user_id)
+        )
+
+        timestamp = messages[-1].timestamp
+        unanswered = [message for message in messages if not message.replied]
+        response = None
+
+        if is_working_hour and unanswered:
+            # Older turns are replaced by the conversation summary.
+            prompt_messages = await conversation_summarizer.get_prompt_messages(user_id, messages_history)
+            # A burst of messages is a single user turn.
+            user_turn = "\n".join(message.text for message in unanswered)
+            prompt_messages = prompt_messages + [Message(role="user", content=user_turn)]
+
+            response = await self.get_bot_response(
+                messages=prompt_messages,
+                reply_token=reply_token
             )
+            await webhook_deduplicator.mark_replied(Platform.LINE, [message.event_id for message in unanswered])
+        elif not is_working_hour:
+            print("Outside working hours skip bot response generation.")
 
-            user_table.insert(
+        await self.save_to_gsheet(
+            user_id=user_id,
+            display_name=display_name
+        )
+
+        chat_write_behind.add_user(
+            user_uuid=user_id,
+            name=display_name,
+            metadata="{}"
+        )
+
+        # Every raw message is stored, not the merged turn.
+        for message in messages:
+            chat_write_behind.add_chat_message(
                 user_uuid=user_id,
-                name=user_profile.display_name,
-                metadata="{}"
+                role="user",
+                content=message.text,
+                messenger_timestamp=message.timestamp
             )
 
-            chat_history.insert(
+        if response is not None:
+            chat_write_behind.add_chat_message(
                 user_uuid=user_id,
-                role="user",
-                content=message,
+                role="assistant",
+                content=response,
                 messenger_timestamp=timestamp
             )
 
-            if is_working_hour:
-                chat_history.insert(
-                    user_uuid=user_id,
-                    role="assistant",
-                    content=response,
-                    messenger_timestamp=timestamp
-                )
+        # The batch is done once its records survive a crash.
+        await chat_write_behind.sync()
+        await webhook_deduplicator.mark_persisted(Platform.LINE, [message.event_id for message in messages])
+
+        if response is not None:
+            conversation_summarizer.schedule(
+                user_id, await chat_history.get_chat_history(user_id)
+            )
 
 if __name__ == "__main__":
     import asyncio
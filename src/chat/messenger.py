@@ -2,15 +2,22 @@ from fastapi import FastAPI, Request, Response
 from pydantic import BaseModel
 from typing import List
 import uvicorn
-import httpx
+import asyncio
 import os
-from src._types import Message, MessengerWebhookData, Platform
-from src.gcp.sql import ChatHistoryTable, UserTable
-from src.agents.customer_service import get_operator_agent
+from src._types import IncomingMessage, Message, MessengerWebhookData, Platform
+from src.gcp.sql import AsyncChatHistoryTable
+from src.gcp.write_behind import chat_write_behind
+from src.agents.customer_service import aget_operator_agent
+from src.agents.summarizer import conversation_summarizer
+from src.chat.coalescer import message_coalescer
+from src.chat.dedup import NEW_EVENT, EventProgress, webhook_deduplicator
+from src.chat.executor import conversation_executor
 from src.settings import MESSENGER_VERIFY_TOKEN
-from src.gcp.gsheet import ClientTagSheet, ConfigSheet
+from src.gcp.gsheet import client_tag_index, config_store
 from src.agents.functions import add_contact_info
 from src.chat import BaseChatApp
+from src.chat.http_clients import get_graph_client
+from src.chat.profiles import profile_cache
 
 
 class Messenger(BaseChatApp):
@@ -44,8 +51,8 @@ class Messenger(BaseChatApp):
         """
         page_access_token = self.page_access_token
 
-        response = httpx.post(
-            "https://graph.facebook.com/v23.0/me/messages",
+        response = await get_graph_client().post(
+            "/v23.0/me/messages",
             params={"access_token": page_access_token},
             headers={
                 "Content-Type": "application/json"
@@ -60,48 +67,39 @@ class Messenger(BaseChatApp):
         response.raise_for_status()
 
 
-    def get_user_profile(self, user_id: str):
+    async def get_user_profile(self, user_id: str):
         """
         Get user profile information by user ID.
         """
-        response = httpx.get(
-            f"https://graph.facebook.com/v2.6/{user_id}",
+        response = await get_graph_client().get(
+            f"/v2.6/{user_id}",
             params={"access_token": self.page_access_token, "fields": "name, picture"},
         )
         response.raise_for_status()
         return response.json()
 
 
-    def get_user_info_messenger(self, psid):
-        url = f"https://graph.facebook.com/{psid}"
+    async def get_display_name(self, user_id: str) -> str | None:
+        """
+        Get the name of a user from the profile cache, None if the profile is not available.
+        """
+        async def fetch() -> str | None:
+            return (await self.get_user_profile(user_id)).get("name")
+
+        return await profile_cache.get_name(Platform.MESSENGER, user_id, fetch)
+
+
+    async def get_user_info_messenger(self, psid):
+        url = f"/{psid}"
         params = {
             "fields": "first_name,last_name,profile_pic",
             "access_token": self.page_access_token
         }
     
-        with httpx.Client() as client:
-            response = client.get(url, params=params)
-            response.raise_for_status()  # Raises an exception for bad status codes
-            return response.json()
-
-
-    async def is_getting_same_message(
-            self, 
-            chat_history: list[Message],
-            timestamp: str = None
-            ) -> bool:
-    
-
-            if chat_history:
-                last_message = chat_history[-1]
-                print(f"Last message timestamp: {last_message.messenger_timestamp}, Current timestamp: {timestamp}")
+        response = await get_graph_client().get(url, params=params)
+        response.raise_for_status()  # Raises an exception for bad status codes
+        return response.json()
 
-                if str(last_message.messenger_timestamp).strip() == str(timestamp).strip():
-                    print("No new messages to process.")
-                    return True
-            else:
-                print("No previous messages found for this user.")
-                return False
 
     async def get_bot_response(
             self,
@@ -116,8 +114,8 @@ class Messenger(BaseChatApp):
         Returns:
             str: Response message.
         """
-        operator_agent = get_operator_agent()
-        response = operator_agent.invoke_with_function_calling(
+        operator_agent = await aget_operator_agent()
+        response = await operator_agent.ainvoke_with_function_calling(
             messages,
             functions=add_contact_info
         )
@@ -132,96 +130,182 @@ class Messenger(BaseChatApp):
 
     async def save_to_gsheet(
             self,
-            name: str,
+            name: str | None,
             sender_id: str,
     ):
         """
         Save user information to Google Sheets.
         
         Args:
-            name (str): The name of the user.
+            name (str | None): The name of the user, None if the profile is not available.
             sender_id (str): The ID of the sender.
         """
-        client_tag_sheet = ClientTagSheet()
-        if not client_tag_sheet.has_profle(name):
-            client_tag_sheet.add_new_profile(
-                profile_name=name,
-                user_id=sender_id,
-                platform=Platform.MESSENGER
+        await client_tag_index.save_profile(
+            profile_name=name,
+            user_id=sender_id,
+            platform=Platform.MESSENGER
+        )
+
+
+    async def send_message_to_messenger(self, data: MessengerWebhookData):
+        """
+        Answer the messages of a webhook. The messages of each sender are handled
+        separately, with their own history, and senders run concurrently.
+        """
+        if not data.object == "page":
+            return Response(status_code=200, content="Data object is not 'page'")
+
+        await asyncio.gather(*(asyncio.shield(future) for future in self.queue_messages(data)))
+
+    def queue_messages(
+            self,
+            data: MessengerWebhookData,
+            progress: dict[str, EventProgress] | None = None,
+        ) -> list[asyncio.Future]:
+        """
+        Hand the messages of a webhook off to be answered, without waiting for the replies.
+        Must be called from the event loop.
+
+        Args:
+            data (MessengerWebhookData): The webhook.
+            progress (dict[str, EventProgress], optional): What an earlier attempt did, by message mid.
+
+        Returns:
+            list[asyncio.Future]: One future per message, resolved once its batch is answered and persisted.
+        """
+        if not data.object == "page":
+            return []
+
+        # Duplicate deliveries were dropped by the webhook deduplicator.
+        # Queued in order, so that the messages of a sender are coalesced into one turn.
+        futures = []
+        for entry in data.entry:
+            for event in entry.get("messaging", []):
+                if not event.get("message", {}).get("text"):
+                    continue
+                mid = event["message"].get("mid")
+                futures.append(self.queue_message(
+                    sender_id=event["sender"]["id"],
+                    message=event["message"]["text"],
+                    timestamp=str(event.get("timestamp", "")),
+                    event_id=mid,
+                    replied=(progress or {}).get(mid, NEW_EVENT).replied
+                ))
+        return futures
+
+    def queue_message(
+            self,
+            sender_id: str,
+            message: str,
+            timestamp: str,
+            event_id: str | None = None,
+            replied: bool = False,
+        ) -> asyncio.Future:
+        """
+        Hand a message off to be answered. Messages sent in a quick burst are answered together.
+
+        Args:
+            sender_id (str): The ID of the sender.
+            message (str): The message text.
+            timestamp (str): The Messenger timestamp of the message.
+            event_id (str, optional): The Messenger mid of the message.
+            replied (bool): Whether an earlier attempt already answered the message.
+
+        Returns:
+            asyncio.Future: Resolves once the batch of the message is answered and persisted.
+        """
+        return message_coalescer.add(
+            (Platform.MESSENGER, sender_id),
+            IncomingMessage(text=message, timestamp=timestamp, event_id=event_id, replied=replied),
+            # A batch runs on the lane of its user, after any earlier batch of the same user.
+            lambda items: conversation_executor.run(
+                f"{Platform.MESSENGER}:{sender_id}",
+                lambda: self.reply_messages(sender_id, items)
             )
-        else:
-            client_tag_sheet.update_timestamp(
-                profile_name=name
+        )
+
+    async def reply_message(self, sender_id: str, message: str, timestamp: str):
+        """
+        Answer a message. Messages sent in a quick burst are answered together.
+
+        Args:
+            sender_id (str): The ID of the sender.
+            message (str): The message text.
+            timestamp (str): The Messenger timestamp of the message.
+        """
+        return await asyncio.shield(self.queue_message(sender_id, message, timestamp))
+
+    async def reply_messages(self, sender_id: str, messages: list[IncomingMessage]):
+        """
+        Answer one or more messages of a sender with a single reply.
+        Messages an earlier attempt already answered are only persisted.
+
+        Args:
+            sender_id (str): The ID of the sender.
+            messages (list[IncomingMessage]): The messages, oldest first.
+        """
+        chat_history = AsyncChatHistoryTable()
+        # The profile is looked up while the history is read.
+        messages_history, profile_name = await asyncio.gather(
+            chat_history.get_chat_history(sender_id),
+            self.get_display_name(sender_id)
+        )
+
+        # Older turns are replaced by the conversation summary.
+        prompt_messages = await conversation_summarizer.get_prompt_messages(sender_id, messages_history)
+
+        is_working_hour = config_store.is_working_hour()
+        timestamp = messages[-1].timestamp
+        unanswered = [message for message in messages if not message.replied]
+        response = None
+
+        if is_working_hour and unanswered:
+            # A burst of messages is a single user turn.
+            user_turn = "\n".join(message.text for message in unanswered)
+            prompt_messages.append(Message(role="user", content=user_turn))
+
+            response = await self.get_bot_response(
+                messages=prompt_messages,
+                sender_id=sender_id
             )
+            await webhook_deduplicator.mark_replied(Platform.MESSENGER, [message.event_id for message in unanswered])
+        elif not is_working_hour:
+            print("Out of working hours. No response will be sent.")
 
+        await self.save_to_gsheet(
+            name=profile_name,
+            sender_id=sender_id
+        )
 
-    async def send_message_to_messenger(self, data: MessengerWebhookData):
+        chat_write_behind.add_user(
+            user_uuid=sender_id,
+            name=profile_name,
+            metadata="{}"
+        )
+        # Every raw message is stored, not the merged turn.
+        for message in messages:
+            chat_write_behind.add_chat_message(
+                user_uuid=sender_id,
+                role="user",
+                content=message.text,
+                messenger_timestamp=message.timestamp
+            )
+
+        if response is not None:
+            chat_write_behind.add_chat_message(
+                user_uuid=sender_id,
+                role="assistant",
+                content=response,
+                messenger_timestamp=timestamp
+            )
 
-            if not data.object == "page":
-                return Response(status_code=200, content="Data object is not 'page'")
-            timestamp = data.get_message_timestamp
-            sender_id = data.get_sender_id
-
-            chat_history = ChatHistoryTable()
-            messages = chat_history.get_chat_history(sender_id)
-
-            if await self.is_getting_same_message(chat_history=messages, timestamp=timestamp):
-                return Response(status_code=200, content="No new messages to process.")
-
-            config_sheet = ConfigSheet()
-            is_working_hour = config_sheet.is_working_hour()
-
-            user_table = UserTable()
-
-            for entry in data.entry:
-                messaging_events = [
-                    event for event in entry.get("messaging", []) if event.get("message")
-                ]
-
-                for event in messaging_events:
-                    message = event.get("message")
-                    sender_id = event["sender"]["id"]
-                    profile_name = self.get_user_profile(sender_id)
-
-                    if not messages:
-                        messages = []
-                    
-                    if is_working_hour:
-                        messages.append(Message(role="user", content=message["text"]))
-
-                        response = await self.get_bot_response(
-                            messages=messages,
-                            sender_id=sender_id
-                        )
-                    else:
-                        print("Out of working hours. No response will be sent.")
-
-                    await self.save_to_gsheet(
-                        name=profile_name['name'],
-                        sender_id=sender_id
-                    )
-
-                    user_table.insert(
-                        user_uuid=sender_id,
-                        name=sender_id,  # Assuming a mock name for now
-                        metadata="{}"
-                    )
-                    chat_history.insert(
-                        user_uuid=sender_id,
-                        role="user",
-                        content=message["text"],
-                        messenger_timestamp=timestamp
-                    )
-
-
-                    if is_working_hour:
-                        chat_history.insert(
-                            user_uuid=sender_id,
-                            role="assistant",
-                            content=response,
-                            messenger_timestamp=timestamp
-                        )
+        # The batch is done once its records survive a crash.
+        await chat_write_behind.sync()
+        await webhook_deduplicator.mark_persisted(Platform.MESSENGER, [message.event_id for message in messages])
 
+        conversation_summarizer.schedule(
+            sender_id, await chat_history.get_chat_history(sender_id)
+        )
 
     async def send_follow_up_message(self, to, messages):
         """
@@ -235,7 +319,7 @@ class Messenger(BaseChatApp):
         Returns:
             dict: JSON response from Facebook Graph API
         """
-        url = "https://graph.facebook.com/v23.0/me/messages"
+        url = "/v23.0/me/messages"
     
         # Form data as in the original cURL command
         data = {
@@ -245,10 +329,8 @@ class Messenger(BaseChatApp):
             "access_token": self.page_access_token
         }
     
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, data=data)
-        
-            response.raise_for_status()
-            return response.json()
+        response = await get_graph_client().post(url, data=data)
+        response.raise_for_status()
+        return response.json()
 
         
@@ -0,0 +1,122 @@
+import asyncio
+from logging import getLogger
+from typing import Awaitable, Callable
+
+from src.gcp.sql import AsyncUserTable
+from src.utils.cache import TTLCache
+from src.settings import (
+    PROFILE_CACHE_MAX_ENTRIES,
+    PROFILE_CACHE_TTL,
+    PROFILE_CACHE_NEGATIVE_TTL,
+    PROFILE_CACHE_SEED_FROM_DB,
+)
+
+logger = getLogger(__name__)
+
+# Cached for users whose profile could not be fetched
+_NOT_FOUND = object()
+_MISSING = object()
+
+
+class ProfileCache:
+    """
+    Cache of the display names of LINE and Messenger users.
+
+    Names are keyed by platform and user id. On a miss the name stored in the
+    `user` table is used when there is one, otherwise the profile is fetched from
+    the platform. Failed lookups are cached for a shorter time so that blocked or
+    deleted users do not cost an upstream call per message.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = PROFILE_CACHE_MAX_ENTRIES,
+            ttl: float = PROFILE_CACHE_TTL,
+            negative_ttl: float = PROFILE_CACHE_NEGATIVE_TTL,
+            seed_from_db: bool = PROFILE_CACHE_SEED_FROM_DB,
+            user_table: AsyncUserTable = None,
+        ):
+        """
+        Args:
+            max_entries (int): Maximum number of cached users.
+            ttl (float): Seconds a name stays cached.
+            negative_ttl (float): Seconds a failed lookup stays cached.
+            seed_from_db (bool): Look up the `user` table before the platform on a miss.
+            user_table (AsyncUserTable, optional): The user table to seed from.
+        """
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.negative_ttl = negative_ttl
+        self.seed_from_db = seed_from_db
+        self.user_table = user_table or AsyncUserTable()
+        self._in_flight: dict[tuple[str, str], asyncio.Future] = {}
+        self.fetches = 0
+        self.seeded = 0
+
+    async def _read_stored_name(self, user_id: str) -> str | None:
+        try:
+            user = await self.user_table.read(user_id)
+        except Exception as e:
+            logger.error(f"Could not read the stored name of user {user_id}: {e}")
+            return None
+        # Messenger users used to be stored with their id as name.
+        if user is None or not user.user_name or user.user_name == user_id:
+            return None
+        return user.user_name
+
+    async def _load(self, key: tuple[str, str], fetch: Callable[[], Awaitable[str | None]]) -> str | None:
+        _, user_id = key
+        name = await self._read_stored_name(user_id) if self.seed_from_db else None
+        if name is not None:
+            self.seeded += 1
+            self.cache.set(key, name)
+            return name
+
+        self.fetches += 1
+        try:
+            name = await fetch()
+        except Exception as e:
+            logger.warning(f"Could not fetch the profile of {key[0]} user {user_id}: {e}")
+            name = None
+        if name:
+            self.cache.set(key, name)
+        else:
+            self.cache.set(key, _NOT_FOUND, ttl=self.negative_ttl)
+        return name or None
+
+    async def get_name(self, platform: str, user_id: str, fetch: Callable[[], Awaitable[str | None]]) -> str | None:
+        """
+        Get the display name of a user.
+
+        Args:
+            platform (str): The platform of the user.
+            user_id (str): The platform user id.
+            fetch (Callable[[], Awaitable[str | None]]): Fetches the name from the platform.
+
+        Returns:
+            str | None: The display name, or None if the profile is not available.
+        """
+        key = (platform, user_id)
+        name = self.cache.get(key, _MISSING)
+        if name is _NOT_FOUND:
+            return None
+        if name is not _MISSING:
+            return name
+
+        # Concurrent lookups of the same user share one fetch.
+        future = self._in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(self._load(key, fetch))
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {
+            **self.cache.stats(),
+            "fetches": self.fetches,
+            "seeded": self.seeded,
+        }
+
+
+profile_cache = ProfileCache()
@@ -1,4 +1,4 @@
-from sqlalchemy import Table, Column, String, DateTime, ForeignKey, MetaData, create_engine, Integer
+from sqlalchemy import Table, Column, String, DateTime, ForeignKey, MetaData, create_engine, Integer, Index
 from datetime import datetime
 import os
 from dotenv import load_dotenv
@@ -26,7 +26,53 @@ chat_history_table = Table(
     Column('role', String(50), nullable=False),
     Column('content', String, nullable=False),
     Column('timestamp', DateTime, default=datetime.utcnow, nullable=False),
-    Column('messenger_timestamp', String, nullable=True)
+    Column('messenger_timestamp', String, nullable=True),
+    # Serves the per-user history window (latest N rows by id)
+    Index('ix_chathistory_user_uuid_id', 'user_uuid', 'id')
+)
+
+# Rolling summary of the older part of each conversation
+conversation_summary_table = Table(
+    'conversationsummary',
+    metadata,
+    Column('user_uuid', String(36), ForeignKey('user.user_uuid'), primary_key=True),
+    Column('summary', String, nullable=False),
+    # Id of the last chat history row folded into the summary
+    Column('last_message_id', Integer, nullable=False),
+    # Timestamp of that row, matches messages that are not stored yet
+    Column('last_message_at', DateTime, nullable=True),
+    Column('updated_at', DateTime, default=datetime.utcnow, nullable=False)
+)
+
+# Outcome of the tool side effects run in the background
+tool_job_table = Table(
+    'tooljob',
+    metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('tool_name', String(100), nullable=False),
+    # JSON encoded keyword arguments of the tool
+    Column('arguments', String, nullable=False),
+    # running, succeeded or failed
+    Column('status', String(20), nullable=False),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('last_error', String, nullable=True),
+    Column('created_at', DateTime, default=datetime.utcnow, nullable=False),
+    Column('updated_at', DateTime, default=datetime.utcnow, nullable=False),
+    Index('ix_tooljob_status_id', 'status', 'id')
+)
+
+# Ids of the webhook events already received, to drop redeliveries
+webhook_event_table = Table(
+    'webhookevent',
+    metadata,
+    Column('platform', String(20), primary_key=True),
+    # Messenger message mid or LINE webhookEventId
+    Column('event_id', String(255), primary_key=True),
+    Column('received_at', DateTime, default=datetime.utcnow, nullable=False),
+    # Progress of the event, so that a retried webhook job does not repeat it
+    Column('replied_at', DateTime, nullable=True),
+    Column('persisted_at', DateTime, nullable=True),
+    Index('ix_webhookevent_received_at', 'received_at')
 )
 
 all_tables_names = metadata.tables.keys()
\ No newline at end of file
@@ -1,17 +1,55 @@
 
+import asyncio
 import pandas as pd
 import gspread
 import json
+import threading
+import time as time_module
+from dataclasses import dataclass
 from oauth2client.service_account import ServiceAccountCredentials
 from pprint import pprint
-from src.settings import GOOGLE_API_CRED
+from src.settings import (
+    GOOGLE_API_CRED,
+    CONFIG_REFRESH_INTERVAL,
+    CONFIG_DEFAULT_START_TIME,
+    CONFIG_DEFAULT_END_TIME,
+    CONFIG_DEFAULT_FOLLOW_UP_DAYS,
+    CONFIG_DEFAULT_FOLLOW_UP_MESSAGE,
+    CLIENT_TAG_RECONCILE_INTERVAL,
+)
 from src._types import ClientStatus, Platform
 from src.utils.common import ConfigUtils
 from src.utils.datetime_utils import day_diff, get_thai_time
+from src.gcp.sheet_buffer import SheetWriteBuffer, sheet_write_buffer
 from datetime import time
 
 from pydantic import BaseModel
 
+def parse_time(time_str: str) -> time:
+    """
+    Parse a time string in HH:MM format.
+    """
+    hour, minute = map(int, str(time_str).split(':')[:2])
+    return time(hour, minute)
+
+
+def is_within_hours(start_time: time, end_time: time, current_time: time) -> bool:
+    """
+    Check if a time is within a range of hours, including overnight ranges.
+    """
+    # Handle overnight time ranges (e.g., 22:00 to 06:00)
+    if start_time <= end_time:
+        # Same day range (e.g., 09:00 to 17:00)
+        return start_time <= current_time <= end_time
+    else:
+        # Overnight range (e.g., 22:00 to 06:00)
+        return current_time >= start_time or current_time <= end_time
+
+
+def get_current_thai_time() -> time:
+    return parse_time(get_thai_time())
+
+
 class ClientInfo(BaseModel):
     name: str
     email: str
@@ -61,7 +99,21 @@ class Sheet:
         Add content to the Google Sheet at specified row and column.
         """
         sheet = self.get_sheet()
-        sheet.append_row(content)
+        return sheet.append_row(content)
+
+    def has_row(self, content: list[str]) -> bool:
+        """
+        Check whether a row with the same values is already in the Google Sheet.
+        Surrounding spaces and trailing empty cells are ignored.
+        """
+        def normalize(row) -> list[str]:
+            values = [str(value).strip() for value in row]
+            while values and not values[-1]:
+                values.pop()
+            return values
+
+        target = normalize(content)
+        return any(normalize(row) == target for row in self.get_sheet().get_all_values())
 
     def get_all_content(self) -> list[dict[str, any]]:
         """
@@ -97,17 +149,21 @@ class ClientTagSheet(Sheet):
 
         return profile_name in recorded_profile
         
-    def add_new_profile(self, profile_name: str, user_id: str, platform: Platform) -> bool:
+    @staticmethod
+    def build_profile_row(profile_name: str, user_id: str, platform: Platform) -> list[str]:
         today = pd.Timestamp.now().strftime('%Y-%m-%d')
-        self.add_content(
-                [
-                    profile_name, 
-                    ClientStatus.IN_PROGRESS, 
-                    today, 
-                    user_id,
-                    platform
-                ]
-            )
+        return [
+            profile_name, 
+            ClientStatus.IN_PROGRESS, 
+            today, 
+            user_id,
+            platform
+        ]
+
+    def add_new_profile(self, profile_name: str, user_id: str, platform: Platform) -> dict:
+        return self.add_content(
+            self.build_profile_row(profile_name, user_id, platform)
+        )
 
     def update_timestamp(self, profile_name: str) -> bool:
         today = pd.Timestamp.now().strftime('%Y-%m-%d')
@@ -152,7 +208,7 @@ class ClientTagSheet(Sheet):
         """
         df = self.get_content_as_dataframe()
         in_progress_df = df[df['tag'] == ClientStatus.IN_PROGRESS]
-        date_diff_thresh = ConfigSheet().get_follow_up_threshold()
+        date_diff_thresh = config_store.get().follow_up_threshold
         in_progress_df['date_diff'] = in_progress_df['last message timestamp'].apply(
             lambda x: day_diff(x) if isinstance(x, str) else day_diff(pd.Timestamp(x).strftime('%Y-%m-%d'))
         )
@@ -173,19 +229,27 @@ class ConfigSheet(Sheet):
         self.transposed_df = self.transposed_df[1:]  # Remove the first row which is now the header
         print("Config Sheet Columns: ", self.transposed_df)
 
-    def get_start_time(self) -> str:
+    def get_value(self, key: str):
         """
+        Get a setting, whether its name ended up as a column or as a row of the transposed sheet.
+
+        Raises:
+            KeyError: If the setting is not in the sheet.
         """
         transposed_df = self.transposed_df
-        start_time = transposed_df['start time'].values[0]
-        return start_time
+        if key in transposed_df.columns:
+            return transposed_df[key].values[0]
+        return transposed_df.loc[key].values[0]
+
+    def get_start_time(self) -> str:
+        """
+        """
+        return self.get_value('start time')
     
     def get_end_time(self) -> str:
         """
         """
-        transposed_df = self.transposed_df
-        end_time = transposed_df['end time'].values[0]
-        return end_time
+        return self.get_value('end time')
     
 
     def is_working_hour(self) -> bool:
@@ -195,30 +259,11 @@ class ConfigSheet(Sheet):
         Returns:
             bool: True if within working hours, False otherwise.
         """
-        start_time_str = self.get_start_time()
-        end_time_str = self.get_end_time()
-
-        # Parse the time strings
-        start_hour, start_minute = map(int, start_time_str.split(':'))
-        end_hour, end_minute = map(int, end_time_str.split(':'))
-        
-        # Create time objects
-        start_time = time(start_hour, start_minute)
-        end_time = time(end_hour, end_minute)
-        
-        # Get current time
-        current_time = get_thai_time()
-        current_hour, current_minute = map(int, current_time.split(':'))
-        current_time = time(current_hour, current_minute)
-        
-        # Handle overnight time ranges (e.g., 22:00 to 06:00)
-        if start_time <= end_time:
-            # Same day range (e.g., 09:00 to 17:00)
-            return start_time <= current_time <= end_time
-        else:
-            # Overnight range (e.g., 22:00 to 06:00)
-            return current_time >= start_time or current_time <= end_time
-        
+        return is_within_hours(
+            parse_time(self.get_start_time()),
+            parse_time(self.get_end_time()),
+            get_current_thai_time()
+        )
 
 
     def get_follow_up_threshold(self) -> int:
@@ -228,8 +273,7 @@ class ConfigSheet(Sheet):
         Returns:
             int: Follow-up threshold in days.
         """
-        transposed_df = self.transposed_df
-        follow_up_threshold = transposed_df.loc['follow up within (day)'].values[0]
+        follow_up_threshold = self.get_value('follow up within (day)')
         return int(follow_up_threshold)
 
 
@@ -240,11 +284,381 @@ class ConfigSheet(Sheet):
         Returns:
             str: Follow-up message.
         """
-        transposed_df = self.transposed_df
-        follow_up_message = transposed_df.loc['follow up message'].values[0]
+        follow_up_message = self.get_value('follow up message')
         return follow_up_message
 
 
+def parse_follow_up_message(value) -> str:
+    if pd.isna(value) or not str(value).strip():
+        raise ValueError("the follow-up message is empty")
+    return str(value)
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    Typed, immutable copy of the Config sheet.
+    """
+    start_time: time
+    end_time: time
+    follow_up_threshold: int
+    follow_up_message: str
+    loaded_at: float
+    # Fields that could not be read, they keep their previous or default value
+    invalid_fields: tuple[str, ...] = ()
+
+    @classmethod
+    def from_sheet(cls, config_sheet: ConfigSheet, fallback: "ConfigSnapshot" = None) -> "ConfigSnapshot":
+        """
+        Read each field on its own, a missing or malformed field keeps its value
+        from `fallback`, or its default.
+        """
+        fallback = fallback or DEFAULT_CONFIG
+        fields = {
+            "start_time": lambda: parse_time(config_sheet.get_start_time()),
+            "end_time": lambda: parse_time(config_sheet.get_end_time()),
+            "follow_up_threshold": config_sheet.get_follow_up_threshold,
+            "follow_up_message": lambda: parse_follow_up_message(config_sheet.get_follow_up_message()),
+        }
+        values, invalid_fields = {}, []
+        for name, read in fields.items():
+            try:
+                values[name] = read()
+            except Exception as e:
+                values[name] = getattr(fallback, name)
+                invalid_fields.append(name)
+                print(f"Invalid '{name}' in the Config sheet, keeping {values[name]!r}: {e}")
+        return cls(**values, loaded_at=time_module.time(), invalid_fields=tuple(invalid_fields))
+
+    def is_working_hour(self) -> bool:
+        """
+        Check if the current time is within working hours.
+
+        Returns:
+            bool: True if within working hours, False otherwise.
+        """
+        return is_within_hours(self.start_time, self.end_time, get_current_thai_time())
+
+
+DEFAULT_CONFIG = ConfigSnapshot(
+    start_time=parse_time(CONFIG_DEFAULT_START_TIME),
+    end_time=parse_time(CONFIG_DEFAULT_END_TIME),
+    follow_up_threshold=CONFIG_DEFAULT_FOLLOW_UP_DAYS,
+    follow_up_message=CONFIG_DEFAULT_FOLLOW_UP_MESSAGE,
+    loaded_at=0,
+)
+
+
+class ConfigStore:
+    """
+    Process-wide snapshot of the Config sheet.
+
+    The snapshot is loaded at startup and refreshed by a background task every
+    `refresh_interval` seconds, or every `retry_interval` seconds until a first
+    load succeeds. Reads never touch the network. When a refresh fails, the last
+    good snapshot keeps being served, and before any load the defaults are.
+    """
+
+    def __init__(self, refresh_interval: float = CONFIG_REFRESH_INTERVAL, retry_interval: float = 30):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self._snapshot: ConfigSnapshot | None = None
+        self._task: asyncio.Task | None = None
+        self.last_error: str | None = None
+
+    def load(self) -> ConfigSnapshot | None:
+        """
+        Load a new snapshot from Google Sheets. Blocking, run it in a thread from async code.
+
+        Returns:
+            ConfigSnapshot | None: The current snapshot, which is the previous one if loading failed.
+        """
+        try:
+            snapshot = ConfigSnapshot.from_sheet(ConfigSheet(), fallback=self._snapshot)
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Failed to load Config sheet, keeping the last snapshot: {e}")
+            return self._snapshot
+
+        self._snapshot = snapshot
+        self.last_error = (
+            f"Invalid fields: {', '.join(snapshot.invalid_fields)}" if snapshot.invalid_fields else None
+        )
+        return snapshot
+
+    def get(self) -> ConfigSnapshot:
+        """
+        Get the current snapshot, or the defaults if the Config sheet has never been loaded.
+        """
+        return self._snapshot or DEFAULT_CONFIG
+
+    def is_working_hour(self) -> bool:
+        return self.get().is_working_hour()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval if self._snapshot is not None else self.retry_interval)
+            await asyncio.to_thread(self.load)
+
+    async def start(self):
+        """Load the first snapshot and start the background refresh"""
+        if self._task is not None:
+            return
+        await asyncio.to_thread(self.load)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+config_store = ConfigStore()
+
+
+@dataclass
+class ClientTagRow:
+    row: int | None
+    profile_name: str
+    tag: str
+    last_contact: str
+    user_id: str
+    platform: str
+    # Monotonic time of our last change to the row, 0 if it was only read from the sheet
+    changed_at: float = 0
+
+
+class ClientTagIndex:
+    """
+    In-process index of the Client tag sheet.
+
+    Maps profile names and user IDs to their row, tag and last contact date.
+    The index is built from one bulk read, kept in sync on our own writes and
+    rebuilt every `reconcile_interval` seconds to pick up manual edits. The sheet
+    is only read in a thread, and the changes we make while a rebuild reads it
+    are carried into the rebuilt index.
+    """
+
+    # 1-based columns of the Client tag sheet
+    NAME_COL, TAG_COL, DATE_COL, USER_ID_COL, PLATFORM_COL = 1, 2, 3, 4, 5
+
+    def __init__(
+            self,
+            sheet: ClientTagSheet = None,
+            reconcile_interval: float = CLIENT_TAG_RECONCILE_INTERVAL,
+            write_buffer: SheetWriteBuffer = sheet_write_buffer,
+        ):
+        self._sheet = sheet
+        self.write_buffer = write_buffer
+        self.reconcile_interval = reconcile_interval
+        self._by_name: dict[str, ClientTagRow] = {}
+        self._by_user_id: dict[str, ClientTagRow] = {}
+        self._loaded_at: float | None = None
+        self._is_built = False
+        self._lock = threading.RLock()
+        self._task: asyncio.Task | None = None
+        self._rebuild_task: asyncio.Task | None = None
+
+    def get_sheet(self) -> ClientTagSheet:
+        if self._sheet is None:
+            self._sheet = ClientTagSheet()
+        return self._sheet
+
+    @staticmethod
+    def _index_row(row: ClientTagRow, by_name: dict, by_user_id: dict):
+        # Keep the first occurrence, like a sheet lookup would.
+        by_name.setdefault(row.profile_name, row)
+        if row.user_id:
+            by_user_id.setdefault(row.user_id, row)
+
+    def rebuild(self):
+        """Rebuild the index from one read of the whole sheet. Blocking, run it in a thread."""
+        started_at = time_module.monotonic()
+        values = self.get_sheet().get_sheet().get_all_values()
+        by_name, by_user_id = {}, {}
+        # The first row holds the headers.
+        for row_number, values_row in enumerate(values[1:], start=2):
+            values_row = values_row + [""] * (self.PLATFORM_COL - len(values_row))
+            if not values_row[self.NAME_COL - 1]:
+                continue
+            self._index_row(
+                ClientTagRow(
+                    row=row_number,
+                    profile_name=values_row[self.NAME_COL - 1],
+                    tag=values_row[self.TAG_COL - 1],
+                    last_contact=values_row[self.DATE_COL - 1],
+                    user_id=values_row[self.USER_ID_COL - 1],
+                    platform=values_row[self.PLATFORM_COL - 1],
+                ),
+                by_name,
+                by_user_id,
+            )
+        with self._lock:
+            for row in self._by_name.values():
+                if row.profile_name not in by_name and (row.row is None or row.changed_at >= started_at):
+                    # Still waiting in the write buffer, or appended after the rows were read.
+                    self._index_row(row, by_name, by_user_id)
+                elif row.changed_at >= started_at and row.profile_name in by_name:
+                    # Updated while the sheet was read, the read may predate our write.
+                    by_name[row.profile_name].last_contact = row.last_contact
+                    by_name[row.profile_name].changed_at = row.changed_at
+            self._by_name, self._by_user_id = by_name, by_user_id
+            self._loaded_at = time_module.monotonic()
+            self._is_built = True
+
+    async def ensure_loaded(self) -> bool:
+        """
+        Build the index in a thread if it was never built, or start a rebuild in the
+        background if it was invalidated. The previous index is served meanwhile.
+
+        Returns:
+            bool: False if the index has never been built and building it failed.
+        """
+        if self._loaded_at is not None:
+            return True
+        if self._rebuild_task is None:
+            self._rebuild_task = asyncio.create_task(asyncio.to_thread(self.rebuild))
+            self._rebuild_task.add_done_callback(self._on_rebuilt)
+        if self._is_built:
+            return True
+        try:
+            await asyncio.shield(self._rebuild_task)
+        except Exception:
+            return False
+        return True
+
+    def _on_rebuilt(self, task: asyncio.Task):
+        self._rebuild_task = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Failed to build Client tag index: {task.exception()}")
+
+    def invalidate(self):
+        """Rebuild the index on the next save"""
+        with self._lock:
+            self._loaded_at = None
+
+    def get_profile(self, profile_name: str) -> ClientTagRow | None:
+        with self._lock:
+            return self._by_name.get(profile_name)
+
+    def get_by_user_id(self, user_id: str) -> ClientTagRow | None:
+        with self._lock:
+            return self._by_user_id.get(user_id)
+
+    def has_profile(self, profile_name: str) -> bool:
+        return self.get_profile(profile_name) is not None
+
+    def add_new_profile(self, profile_name: str, user_id: str, platform: Platform):
+        values = ClientTagSheet.build_profile_row(profile_name, user_id, platform)
+        row = ClientTagRow(
+            row=None,
+            profile_name=profile_name,
+            tag=values[self.TAG_COL - 1],
+            last_contact=values[self.DATE_COL - 1],
+            user_id=user_id,
+            platform=platform,
+            changed_at=time_module.monotonic(),
+        )
+        with self._lock:
+            self._index_row(row, self._by_name, self._by_user_id)
+
+        def on_written(row_number: int | None):
+            with self._lock:
+                row.row = row_number
+                row.changed_at = time_module.monotonic()
+            if row_number is None:
+                # We cannot update the row later without knowing where it is.
+                self.invalidate()
+
+        self.write_buffer.append_row(self.get_sheet(), values, on_written=on_written)
+
+    def update_timestamp(self, profile_name: str) -> bool:
+        today = pd.Timestamp.now().strftime('%Y-%m-%d')
+        with self._lock:
+            row = self._by_name.get(profile_name)
+            if row is None:
+                return False
+
+            # check if date cell is already updated
+            if row.last_contact == today:
+                print(f"Timestamp for {profile_name} is already updated to {today}.")
+                return False
+
+            if row.tag == ClientStatus.DONE:
+                print(f"Profile {profile_name} is already marked as DONE. No need to update timestamp.")
+                return False
+
+            if row.row is None:
+                # Still waiting in the write buffer.
+                return False
+
+            row.last_contact = today
+            row.changed_at = time_module.monotonic()
+            row_number = row.row
+        self.write_buffer.update_cell(self.get_sheet(), row_number, self.DATE_COL, today)
+        return True
+
+    async def save_profile(self, profile_name: str | None, user_id: str, platform: Platform):
+        """
+        Add a new profile, or refresh the last contact date of a known one.
+        Without a profile name, e.g. when the profile could not be fetched, only a
+        row already known by its user id is refreshed, keeping its name.
+        """
+        if not await self.ensure_loaded():
+            print(f"Client tag index is not available, skipping the profile of user {user_id}.")
+            return
+
+        if not profile_name:
+            row = self.get_by_user_id(user_id)
+            if row is None:
+                print(f"No profile name for user {user_id}, the Client tag row is added once it is known.")
+                return
+            profile_name = row.profile_name
+
+        if not self.has_profile(profile_name):
+            self.add_new_profile(
+                profile_name=profile_name,
+                user_id=user_id,
+                platform=platform
+            )
+        else:
+            self.update_timestamp(profile_name=profile_name)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await asyncio.to_thread(self.rebuild)
+            except Exception as e:
+                print(f"Failed to reconcile Client tag index: {e}")
+
+    async def start(self):
+        """Build the index and start the periodic reconciliation"""
+        if self._task is not None:
+            return
+        try:
+            await asyncio.to_thread(self.rebuild)
+        except Exception as e:
+            print(f"Failed to build Client tag index, it will be built on first use: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+client_tag_index = ClientTagIndex()
+
+
 if __name__ == "__main__":
 
 
@@ -255,4 +669,5 @@ if __name__ == "__main__":
 
     config_sheet = ConfigSheet()
     is_working_hour = config_sheet.is_working_hour()
-    print(f"Is working hour: {is_working_hour}")
\ No newline at end of file
+    print(f"Is working hour: {is_working_hour}")
+    print(f"Snapshot: {config_store.load()}")
\ No newline at end of file
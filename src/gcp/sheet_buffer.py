@@ -0,0 +1,248 @@
+import asyncio
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Any, Callable
+
+from gspread.utils import rowcol_to_a1
+
+from src.settings import SHEET_FLUSH_INTERVAL, SHEET_FLUSH_MAX_PENDING
+
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class PendingAppend:
+    values: list
+    # Called with the row number the values were written to, None if unknown.
+    on_written: Callable[[int | None], None] | None = None
+
+
+@dataclass
+class WorksheetBuffer:
+    sheet: Any
+    appends: list[PendingAppend] = field(default_factory=list)
+    # (row, col) -> value, the last write to a cell wins.
+    cells: dict[tuple[int, int], Any] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.appends) + len(self.cells)
+
+
+def get_first_appended_row(append_response: dict) -> int | None:
+    """
+    Get the first row number written by an append call from its response,
+    e.g. "'Client tag'!A12:E14" -> 12.
+    """
+    try:
+        updated_range = append_response["updates"]["updatedRange"]
+    except (KeyError, TypeError):
+        return None
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
+
+
+class SheetWriteBuffer:
+    """
+    Coalesces Google Sheets writes per worksheet.
+
+    Row appends and cell updates are collected in memory and flushed as one
+    `append_rows` call and one `batch_update` call per worksheet, every
+    `flush_interval` seconds or once `max_pending` writes are waiting.
+    Updates to the same cell are de-duplicated.
+    """
+
+    def __init__(self, flush_interval: float = SHEET_FLUSH_INTERVAL, max_pending: int = SHEET_FLUSH_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._buffers: dict[tuple[str, str], WorksheetBuffer] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+        self.flush_count = 0
+        self.written_appends = 0
+        self.written_cells = 0
+        self.deduplicated_cells = 0
+        self.failed_flushes = 0
+        self.last_flush_at: float | None = None
+        self.last_error: str | None = None
+
+    def _get_buffer(self, sheet) -> WorksheetBuffer:
+        key = (sheet.speadsheet_name, sheet.sheet_name)
+        if key not in self._buffers:
+            self._buffers[key] = WorksheetBuffer(sheet=sheet)
+        return self._buffers[key]
+
+    def _pending_count(self) -> int:
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def _after_add(self, is_full: bool):
+        if self._task is None:
+            # Not running inside the app, write through.
+            self.flush()
+        elif is_full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def append_row(self, sheet, values: list, on_written: Callable[[int | None], None] = None):
+        """
+        Queue a row append.
+
+        Args:
+            sheet (Sheet): The sheet to append to.
+            values (list): The row values.
+            on_written (Callable[[int | None], None]): Called with the row number once written.
+        """
+        with self._lock:
+            self._get_buffer(sheet).appends.append(PendingAppend(values=values, on_written=on_written))
+            is_full = self._pending_count() >= self.max_pending
+        self._after_add(is_full)
+
+    def update_cell(self, sheet, row: int, col: int, value: Any):
+        """
+        Queue a cell update. A later update to the same cell replaces this one.
+        """
+        with self._lock:
+            cells = self._get_buffer(sheet).cells
+            if (row, col) in cells:
+                self.deduplicated_cells += 1
+            cells[(row, col)] = value
+            is_full = self._pending_count() >= self.max_pending
+        self._after_add(is_full)
+
+    def _flush_worksheet(self, buffer: WorksheetBuffer) -> int:
+        """
+        Write the mutations of a worksheet. Written mutations are removed from
+        the buffer, so that a failure leaves only the unwritten ones in it.
+
+        Returns:
+            int: Number of mutations written.
+        """
+        written = 0
+        worksheet = buffer.sheet.get_sheet()
+        if buffer.appends:
+            appends, buffer.appends = buffer.appends, []
+            try:
+                response = worksheet.append_rows([append.values for append in appends])
+            except Exception:
+                buffer.appends = appends
+                raise
+            self.written_appends += len(appends)
+            written += len(appends)
+            first_row = get_first_appended_row(response)
+            for i, append in enumerate(appends):
+                if append.on_written:
+                    try:
+                        append.on_written(first_row + i if first_row is not None else None)
+                    except Exception as e:
+                        logger.error(f"Sheet append callback failed: {e}")
+        if buffer.cells:
+            worksheet.batch_update([
+                {"range": rowcol_to_a1(row, col), "values": [[value]]}
+                for (row, col), value in buffer.cells.items()
+            ])
+            self.written_cells += len(buffer.cells)
+            written += len(buffer.cells)
+            buffer.cells = {}
+        return written
+
+    def _requeue(self, buffer: WorksheetBuffer):
+        with self._lock:
+            current = self._get_buffer(buffer.sheet)
+            current.appends = buffer.appends + current.appends
+            # Newer updates of the same cell win over the failed ones.
+            current.cells = {**buffer.cells, **current.cells}
+
+    def flush(self) -> int:
+        """
+        Write all pending mutations.
+
+        Returns:
+            int: Number of mutations written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                buffers = [buffer for buffer in self._buffers.values() if len(buffer)]
+                self._buffers = {}
+
+            written = 0
+            error = None
+            for buffer in buffers:
+                try:
+                    written += self._flush_worksheet(buffer)
+                except Exception as e:
+                    error = e
+                    self.last_error = str(e)
+                    logger.error(f"Failed to flush sheet writes to '{buffer.sheet.sheet_name}': {e}")
+                    # Only what was not written goes back, appends are not repeated.
+                    self._requeue(buffer)
+
+            if buffers:
+                self.flush_count += 1
+                self.last_flush_at = time.time()
+            if error is not None:
+                self.failed_flushes += 1
+                raise error
+            return written
+
+    async def _run(self):
+        backoff = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+                backoff = self.flush_interval
+            except Exception:
+                # Back off to stay clear of the write quota.
+                backoff = min(backoff * 2, 60)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write everything still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.to_thread(self.flush)
+        except Exception:
+            logger.error("Final sheet flush failed, pending writes are lost.")
+
+    def status(self) -> dict:
+        with self._lock:
+            pending = {
+                f"{spreadsheet}/{sheet}": {"appends": len(buffer.appends), "cells": len(buffer.cells)}
+                for (spreadsheet, sheet), buffer in self._buffers.items()
+                if len(buffer)
+            }
+        return {
+            "pending": pending,
+            "flush_count": self.flush_count,
+            "written_appends": self.written_appends,
+            "written_cells": self.written_cells,
+            "deduplicated_cells": self.deduplicated_cells,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_at": self.last_flush_at,
+            "last_error": self.last_error,
+        }
+
+
+sheet_write_buffer = SheetWriteBuffer()
@@ -1,14 +1,18 @@
 import os
 from pathlib import Path
 import sys
+import threading
 
-from google.cloud.sql.connector import Connector, IPTypes
+import asyncio
+from google.cloud.sql.connector import Connector, IPTypes, create_async_connector
 from oauth2client.service_account import ServiceAccountCredentials
 
 import sqlalchemy
 import pg8000
 from logging import getLogger
 from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from datetime import datetime
 
 
 sys.path.append(str(Path(__file__).parents[2]))
@@ -18,19 +22,107 @@ from src.settings import (
     DB_USER,
     DB_PASSWORD,
     DB_NAME,
-    GOOGLE_API_CRED
+    GOOGLE_API_CRED,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    CHAT_HISTORY_WINDOW,
+    CONVERSATION_CACHE_MAX_USERS,
+    CONVERSATION_CACHE_TTL,
+    CONVERSATION_CACHE_MAX_BYTES,
+)
+from src.db import (
+    metadata,
+    chat_history_table,
+    user_table,
+    conversation_summary_table,
+    tool_job_table,
+    webhook_event_table,
+    all_tables_names,
 )
-from src.db import metadata, chat_history_table, user_table, all_tables_names
 from src._types import Message
+from src.utils.cache import ConversationCache
 
 
 logger = getLogger(__name__)
 
+# Process-wide connector and engine, see init_engine().
+_connector: Connector | None = None
+_engine: sqlalchemy.Engine | None = None
+_engine_lock = threading.Lock()
+
+# Process-wide async connector and engine, see init_async_engine().
+_async_connector: Connector | None = None
+_async_engine: AsyncEngine | None = None
+_async_engine_lock = asyncio.Lock()
+
+# Roles replayed to the agent as conversation history
+HISTORY_ROLES = ("user", "assistant")
+
+# Recent conversation window per user, written through on insert.
+conversation_cache = ConversationCache(
+    window=CHAT_HISTORY_WINDOW,
+    max_users=CONVERSATION_CACHE_MAX_USERS,
+    ttl=CONVERSATION_CACHE_TTL,
+    max_bytes=CONVERSATION_CACHE_MAX_BYTES,
+)
+
+
+def build_history_query(
+        user_uuid: str,
+        limit: int | None = CHAT_HISTORY_WINDOW,
+        since: datetime | None = None,
+        roles: tuple[str, ...] = HISTORY_ROLES,
+    ) -> sqlalchemy.Select:
+    """
+    Build the query for the latest chat messages of a user, newest first.
+    Served by the (user_uuid, id) index on the chat history table.
+
+    Args:
+        user_uuid (str): The user UUID.
+        limit (int | None): Maximum number of messages, None for no limit.
+        since (datetime | None): Only return messages stored at or after this time.
+        roles (tuple[str, ...]): Only return messages with these roles.
+    """
+    query = chat_history_table.select().where(chat_history_table.c.user_uuid == user_uuid)
+    if roles:
+        query = query.where(chat_history_table.c.role.in_(roles))
+    if since is not None:
+        query = query.where(chat_history_table.c.timestamp >= since)
+    query = query.order_by(chat_history_table.c.id.desc())
+    if limit:
+        query = query.limit(limit)
+    return query
+
+
+def rows_to_messages(rows: list) -> list[Message]:
+    """Convert chat history rows fetched newest first into messages in chronological order"""
+    return [
+        Message(
+            role=row.role,
+            content=row.content,
+            messenger_timestamp=row.messenger_timestamp,
+            id=row.id,
+            timestamp=row.timestamp,
+        )
+        for row in reversed(rows)
+    ]
+
+
+def get_connector() -> Connector:
+    """Get the process-wide Cloud SQL connector, creating it on first use"""
+    global _connector
+    with _engine_lock:
+        if _connector is None:
+            _connector = Connector()
+        return _connector
+
 
 class CloudSql():
     def __init__(self):
-        """Initialize the Cloud SQL connector with environment variables"""
-        self._connector = Connector()
+        """Initialize the Cloud SQL settings from environment variables"""
         self._instance_connection_name = INSTANCE_CONNECTION_NAME
         self._db_user = DB_USER
         self._db_password = DB_PASSWORD
@@ -39,7 +131,7 @@ class CloudSql():
         self._tables = all_tables_names
 
     def get_conn(self):
-        conn = self._connector.connect(
+        conn = get_connector().connect(
             self._instance_connection_name,
             self._driver,
             user=self._db_user,
@@ -49,16 +141,119 @@ class CloudSql():
         return conn
 
     def get_engine(self):
-        """Create a SQLAlchemy engine for the Cloud SQL instance"""
+        """Create a pooled SQLAlchemy engine for the Cloud SQL instance"""
         return sqlalchemy.create_engine(
             "postgresql+pg8000://",
             creator=self.get_conn,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
         )
 
-class CloudSqlManager(CloudSql):
+
+def init_engine() -> sqlalchemy.Engine:
+    """
+    Create the process-wide engine if it does not exist yet.
+    Called from the application lifespan, but safe to call lazily.
+    """
+    global _engine
+    if _engine is None:
+        get_connector()
+        with _engine_lock:
+            if _engine is None:
+                _engine = CloudSql().get_engine()
+                logger.info("Cloud SQL engine created.")
+    return _engine
+
+
+def get_shared_engine() -> sqlalchemy.Engine:
+    """Get the process-wide engine"""
+    return init_engine()
+
+
+def dispose_engine():
+    """Close all pooled connections and the Cloud SQL connector"""
+    global _engine, _connector
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+        if _connector is not None:
+            _connector.close()
+            _connector = None
+    logger.info("Cloud SQL engine disposed.")
+
+
+class AsyncCloudSql(CloudSql):
     def __init__(self):
+        """Initialize the Cloud SQL settings for the asyncpg driver"""
+        super().__init__()
+        self._driver = "asyncpg"
+
+    async def get_conn(self):
+        conn = await _async_connector.connect_async(
+            self._instance_connection_name,
+            self._driver,
+            user=self._db_user,
+            password=self._db_password,
+            db=self._db_name,
+        )
+        return conn
+
+    def get_engine(self) -> AsyncEngine:
+        """Create a pooled async SQLAlchemy engine for the Cloud SQL instance"""
+        return create_async_engine(
+            "postgresql+asyncpg://",
+            async_creator=self.get_conn,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+
+
+async def init_async_engine() -> AsyncEngine:
+    """
+    Create the process-wide async engine if it does not exist yet.
+    The connector is bound to the running event loop, so this must be
+    awaited from the application loop (the lifespan hook does this).
+    """
+    global _async_engine, _async_connector
+    async with _async_engine_lock:
+        if _async_engine is None:
+            _async_connector = await create_async_connector()
+            _async_engine = AsyncCloudSql().get_engine()
+            logger.info("Async Cloud SQL engine created.")
+    return _async_engine
+
+
+async def get_shared_async_engine() -> AsyncEngine:
+    """Get the process-wide async engine"""
+    if _async_engine is not None:
+        return _async_engine
+    return await init_async_engine()
+
+
+async def dispose_async_engine():
+    """Close all pooled async connections and the async Cloud SQL connector"""
+    global _async_engine, _async_connector
+    async with _async_engine_lock:
+        if _async_engine is not None:
+            await _async_engine.dispose()
+            _async_engine = None
+        if _async_connector is not None:
+            await _async_connector.close_async()
+            _async_connector = None
+    logger.info("Async Cloud SQL engine disposed.")
+
+
+class CloudSqlManager(CloudSql):
+    def __init__(self, engine: sqlalchemy.Engine = None):
         super().__init__()
-        self.engine = self.get_engine()
+        self.engine = engine if engine else get_shared_engine()
 
     def has_table(self, table_name: str) -> bool:
         print("self.engine", self.engine, "table name", table_name)
@@ -72,10 +267,18 @@ class CloudSqlManager(CloudSql):
                 return False
         return True
 
+    def create_indexes(self):
+        """Create the indexes of all tables if they do not exist"""
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
+
     def create_table(self):
         """Create the chat history table if it does not exist"""
         if self.validate_tables():
             logger.info("All required tables already exist.")
+            # Tables created before an index was added do not have it yet.
+            self.create_indexes()
             return
         
         try:
@@ -94,71 +297,95 @@ class CloudSqlManager(CloudSql):
         except Exception as e:
             print(f"Error recreating tables: {e}")
             raise e
-        
-    def get_engine(self):
-        return super().get_engine()
+
+
+def is_default_window(limit: int | None, since: datetime | None) -> bool:
+    """Check if a history read asks for the window held by the conversation cache"""
+    return limit == CHAT_HISTORY_WINDOW and since is None
 
 
 class ChatHistoryTable(CloudSql):
-    def __init__(self, engine=None):
+    def __init__(self, engine: sqlalchemy.Engine = None, cache: ConversationCache = conversation_cache):
         super().__init__()
-        self.engine = engine if engine else self.get_engine()
-        self._conn = self.engine.connect()
+        self.engine = engine if engine else get_shared_engine()
+        self.cache = cache
 
 
     def insert(self, user_uuid: str, role: str, content: str, messenger_timestamp: str = None):
         """Insert a new chat message into the database"""
-        self._conn.execute(
-            chat_history_table.insert().values(
-                user_uuid=user_uuid,
-                role=role,
-                content=content,
-                messenger_timestamp=messenger_timestamp if messenger_timestamp else ""
+        timestamp = datetime.utcnow()
+        with self.engine.begin() as conn:
+            conn.execute(
+                chat_history_table.insert().values(
+                    user_uuid=user_uuid,
+                    role=role,
+                    content=content,
+                    timestamp=timestamp,
+                    messenger_timestamp=messenger_timestamp if messenger_timestamp else ""
+                )
+            )
+        if self.cache is not None and role in HISTORY_ROLES:
+            self.cache.append(
+                user_uuid,
+                Message(role=role, content=content, messenger_timestamp=messenger_timestamp or "", timestamp=timestamp)
             )
-        )
-        self._conn.commit()
     
-    def read(self, user_uuid: str) -> list:
-        """Read chat history for a specific user"""
-        result = self._conn.execute(
-            chat_history_table.select().where(chat_history_table.c.user_uuid == user_uuid)
-        ).fetchall()
+    def read(
+            self,
+            user_uuid: str,
+            limit: int | None = CHAT_HISTORY_WINDOW,
+            since: datetime | None = None,
+            roles: tuple[str, ...] = HISTORY_ROLES,
+        ) -> list:
+        """Read the latest chat history rows for a specific user, newest first"""
+        with self.engine.connect() as conn:
+            result = conn.execute(
+                build_history_query(user_uuid, limit=limit, since=since, roles=roles)
+            ).fetchall()
         return result
     
-    def get_chat_history(self, user_uuid: str) -> list[Message]:
-        """Get chat history for a specific user"""
-        messages = self.read(user_uuid)
-        return [
-            Message(role=msg.role, content=msg.content, messenger_timestamp=msg.messenger_timestamp) for msg in messages 
-            if msg.role in ["user", "assistant"]
-        ]
+    def get_chat_history(
+            self,
+            user_uuid: str,
+            limit: int | None = CHAT_HISTORY_WINDOW,
+            since: datetime | None = None,
+        ) -> list[Message]:
+        """Get the last `limit` user/assistant messages of a user in chronological order"""
+        use_cache = self.cache is not None and is_default_window(limit, since)
+        if use_cache:
+            messages = self.cache.get_messages(user_uuid)
+            if messages is not None:
+                return messages
+
+        messages = rows_to_messages(self.read(user_uuid, limit=limit, since=since))
+        if use_cache:
+            self.cache.set_messages(user_uuid, messages)
+        return messages
 
 
 class UserTable(CloudSql):
-    def __init__(self, engine=None):
+    def __init__(self, engine: sqlalchemy.Engine = None):
         super().__init__()
-        self.engine = self.get_engine() if engine is None else engine
-        self._conn = self.engine.connect()
+        self.engine = engine if engine else get_shared_engine()
 
 
     def insert(self, user_uuid: str, name: str = None, metadata: str = None):
         """Insert a new user into the database"""
         try:
-            self._conn.execute(
-                insert(user_table).values(
-                    user_uuid=user_uuid,
-                    user_name=name if name else "",
-                    user_metadata=metadata if metadata else ""
-                ).on_conflict_do_update(
-                    index_elements=['user_uuid'],
-                    set_=dict(
+            with self.engine.begin() as conn:
+                conn.execute(
+                    insert(user_table).values(
+                        user_uuid=user_uuid,
                         user_name=name if name else "",
                         user_metadata=metadata if metadata else ""
+                    ).on_conflict_do_update(
+                        index_elements=['user_uuid'],
+                        set_=dict(
+                            user_name=name if name else "",
+                            user_metadata=metadata if metadata else ""
+                        )
                     )
                 )
-            )
-
-            self._conn.commit()
         except sqlalchemy.exc.DatabaseError as e:
             if "duplicate key value violates unique constraint" in str(e):
                 logger.warning(f"User with UUID {user_uuid} already exists. Skipping insert.")
@@ -168,20 +395,315 @@ class UserTable(CloudSql):
 
     def read(self, user_uuid: str):
         """Read user information from the database"""
-        result = self._conn.execute(
-            user_table.select().where(user_table.c.user_uuid == user_uuid)
-        ).fetchone()
+        with self.engine.connect() as conn:
+            result = conn.execute(
+                user_table.select().where(user_table.c.user_uuid == user_uuid)
+            ).fetchone()
         return result
     
 
     def get_all_users(self) -> list:
         """Get all users from the database"""
         query = """SELECT * FROM user;"""
-        result = self._conn.execute(
-            sqlalchemy.text(query)
-            ).fetchall()
+        with self.engine.connect() as conn:
+            result = conn.execute(
+                sqlalchemy.text(query)
+                ).fetchall()
         return result
 
 
+class AsyncChatHistoryTable(AsyncCloudSql):
+    def __init__(self, engine: AsyncEngine = None, cache: ConversationCache = conversation_cache):
+        super().__init__()
+        self._engine = engine
+        self.cache = cache
+
+    async def get_engine(self) -> AsyncEngine:
+        return self._engine if self._engine else await get_shared_async_engine()
+
+    async def insert(self, user_uuid: str, role: str, content: str, messenger_timestamp: str = None):
+        """Insert a new chat message into the database"""
+        timestamp = datetime.utcnow()
+        engine = await self.get_engine()
+        async with engine.begin() as conn:
+            await conn.execute(
+                chat_history_table.insert().values(
+                    user_uuid=user_uuid,
+                    role=role,
+                    content=content,
+                    timestamp=timestamp,
+                    messenger_timestamp=messenger_timestamp if messenger_timestamp else ""
+                )
+            )
+        if self.cache is not None and role in HISTORY_ROLES:
+            self.cache.append(
+                user_uuid,
+                Message(role=role, content=content, messenger_timestamp=messenger_timestamp or "", timestamp=timestamp)
+            )
+
+    async def read(
+            self,
+            user_uuid: str,
+            limit: int | None = CHAT_HISTORY_WINDOW,
+            since: datetime | None = None,
+            roles: tuple[str, ...] = HISTORY_ROLES,
+        ) -> list:
+        """Read the latest chat history rows for a specific user, newest first"""
+        engine = await self.get_engine()
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                build_history_query(user_uuid, limit=limit, since=since, roles=roles)
+            )
+            return result.fetchall()
+
+    async def get_chat_history(
+            self,
+            user_uuid: str,
+            limit: int | None = CHAT_HISTORY_WINDOW,
+            since: datetime | None = None,
+        ) -> list[Message]:
+        """Get the last `limit` user/assistant messages of a user in chronological order"""
+        use_cache = self.cache is not None and is_default_window(limit, since)
+        if use_cache:
+            messages = self.cache.get_messages(user_uuid)
+            if messages is not None:
+                return messages
+
+        messages = rows_to_messages(await self.read(user_uuid, limit=limit, since=since))
+        if use_cache:
+            self.cache.set_messages(user_uuid, messages)
+        return messages
+
+    async def read_after(
+            self,
+            user_uuid: str,
+            after_id: int,
+            limit: int | None = None,
+            roles: tuple[str, ...] = HISTORY_ROLES,
+        ) -> list:
+        """Read the chat history rows of a user stored after a row id, oldest first"""
+        query = chat_history_table.select().where(
+            chat_history_table.c.user_uuid == user_uuid,
+            chat_history_table.c.id > after_id,
+            chat_history_table.c.role.in_(roles),
+        ).order_by(chat_history_table.c.id.asc())
+        if limit:
+            query = query.limit(limit)
+        engine = await self.get_engine()
+        async with engine.connect() as conn:
+            result = await conn.execute(query)
+            return result.fetchall()
+
+
+class AsyncUserTable(AsyncCloudSql):
+    def __init__(self, engine: AsyncEngine = None):
+        super().__init__()
+        self._engine = engine
+
+    async def get_engine(self) -> AsyncEngine:
+        return self._engine if self._engine else await get_shared_async_engine()
+
+    async def insert(self, user_uuid: str, name: str = None, metadata: str = None):
+        """Insert a new user into the database. Without a name, the stored name of the user is kept."""
+        engine = await self.get_engine()
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    insert(user_table).values(
+                        user_uuid=user_uuid,
+                        user_name=name if name else "",
+                        user_metadata=metadata if metadata else ""
+                    ).on_conflict_do_update(
+                        index_elements=['user_uuid'],
+                        set_=dict(
+                            user_name=name if name else user_table.c.user_name,
+                            user_metadata=metadata if metadata else ""
+                        )
+                    )
+                )
+        except sqlalchemy.exc.DatabaseError as e:
+            logger.error(f"Error inserting user: {e}")
+
+    async def read(self, user_uuid: str):
+        """Read user information from the database"""
+        engine = await self.get_engine()
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                user_table.select().where(user_table.c.user_uuid == user_uuid)
+            )
+            return result.fetchone()
+
+    async def get_all_users(self) -> list:
+        """Get all users from the database"""
+        engine = await self.get_engine()
+        async with engine.connect() as conn:
+            result = await conn.execute(user_table.select())
+            return result.fetchall()
+
+
+class AsyncConversationSummaryTable(AsyncCloudSql):
+    def __init__(self, engine: AsyncEngine = None):
+        super().__init__()
+        self._engine = engine
+
+    async def get_engine(self) -> AsyncEngine:
+        return self._engine if self._engine else await get_shared_async_engine()
+
+    async def read(self, user_uuid: str):
+        """Read the conversation summary of a user"""
+        engine = await self.get_engine()
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                conversation_summary_table.select().where(conversation_summary_table.c.user_uuid == user_uuid)
+            )
+            return result.fetchone()
+
+    async def upsert(self, user_uuid: str, summary: str, last_message_id: int, last_message_at: datetime = None):
+        """Insert or replace the conversation summary of a user"""
+        engine = await self.get_engine()
+        values = dict(
+            summary=summary,
+            last_message_id=last_message_id,
+            last_message_at=last_message_at,
+            updated_at=datetime.utcnow(),
+        )
+        async with engine.begin() as conn:
+            await conn.execute(
+                insert(conversation_summary_table).values(user_uuid=user_uuid, **values).on_conflict_do_update(
+                    index_elements=['user_uuid'],
+                    set_=values
+                )
+            )
+
+
+class AsyncToolJobTable(AsyncCloudSql):
+    def __init__(self, engine: AsyncEngine = None):
+        super().__init__()
+        self._engine = engine
+
+    async def get_engine(self) -> AsyncEngine:
+        return self._engine if self._engine else await get_shared_async_engine()
+
+    async def insert(self, tool_name: str, arguments: str, status: str = "running") -> int:
+        """Insert a tool job and return its id"""
+        engine = await self.get_engine()
+        now = datetime.utcnow()
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                tool_job_table.insert().values(
+                    tool_name=tool_name,
+                    arguments=arguments,
+                    status=status,
+                    attempts=0,
+                    created_at=now,
+                    updated_at=now,
+                ).returning(tool_job_table.c.id)
+            )
+            return result.scalar_one()
+
+    async def update(self, job_id: int, status: str, attempts: int, last_error: str = None):
+        """Record the outcome of a tool job"""
+        engine = await self.get_engine()
+        async with engine.begin() as conn:
+            await conn.execute(
+                tool_job_table.update().where(tool_job_table.c.id == job_id).values(
+                    status=status,
+                    attempts=attempts,
+                    last_error=last_error,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+
+    async def read(self, job_id: int):
+        """Read a tool job by id"""
+        engine = await self.get_engine()
+        async with engine.connect() as conn:
+            result = await conn.execute(tool_job_table.select().where(tool_job_table.c.id == job_id))
+            return result.fetchone()
+
+    async def get_jobs(self, status: str = None, limit: int = 100) -> list:
+        """Read the latest tool jobs, optionally only those with a given status"""
+        engine = await self.get_engine()
+        query = tool_job_table.select()
+        if status:
+            query = query.where(tool_job_table.c.status == status)
+        async with engine.connect() as conn:
+            result = await conn.execute(query.order_by(tool_job_table.c.id.desc()).limit(limit))
+            return result.fetchall()
 
 
+class AsyncWebhookEventTable(AsyncCloudSql):
+    def __init__(self, engine: AsyncEngine = None):
+        super().__init__()
+        self._engine = engine
+
+    async def get_engine(self) -> AsyncEngine:
+        return self._engine if self._engine else await get_shared_async_engine()
+
+    async def claim(self, platform: str, event_id: str) -> bool:
+        """
+        Record a webhook event id.
+
+        Returns:
+            bool: True if the id was new, False if it was already recorded.
+        """
+        engine = await self.get_engine()
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                insert(webhook_event_table).values(
+                    platform=platform,
+                    event_id=event_id,
+                    received_at=datetime.utcnow(),
+                ).on_conflict_do_nothing().returning(webhook_event_table.c.event_id)
+            )
+            return result.first() is not None
+
+    async def get_progress(self, platform: str, event_ids: list[str]) -> list:
+        """Read the progress of webhook events, one row per recorded id"""
+        engine = await self.get_engine()
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                sqlalchemy.select(
+                    webhook_event_table.c.event_id,
+                    webhook_event_table.c.replied_at,
+                    webhook_event_table.c.persisted_at,
+                ).where(
+                    (webhook_event_table.c.platform == platform) & (webhook_event_table.c.event_id.in_(event_ids))
+                )
+            )
+            return result.fetchall()
+
+    async def set_progress(self, platform: str, event_ids: list[str], replied: bool = False, persisted: bool = False):
+        """Record that webhook events were replied to or persisted"""
+        now = datetime.utcnow()
+        values = {}
+        if replied:
+            values["replied_at"] = now
+        if persisted:
+            values["persisted_at"] = now
+        engine = await self.get_engine()
+        async with engine.begin() as conn:
+            await conn.execute(
+                webhook_event_table.update().where(
+                    (webhook_event_table.c.platform == platform) & (webhook_event_table.c.event_id.in_(event_ids))
+                ).values(**values)
+            )
+
+    async def delete(self, platform: str, event_id: str):
+        """Forget a webhook event id"""
+        engine = await self.get_engine()
+        async with engine.begin() as conn:
+            await conn.execute(
+                webhook_event_table.delete().where(
+                    (webhook_event_table.c.platform == platform) & (webhook_event_table.c.event_id == event_id)
+                )
+            )
+
+    async def purge(self, before: datetime) -> int:
+        """Delete the event ids received before a date"""
+        engine = await self.get_engine()
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                webhook_event_table.delete().where(webhook_event_table.c.received_at < before)
+            )
+            return result.rowcount
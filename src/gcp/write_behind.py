@@ -0,0 +1,364 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.settings import (
+    WRITE_BEHIND_SPOOL_PATH,
+    WRITE_BEHIND_FLUSH_INTERVAL_MS,
+    WRITE_BEHIND_MAX_BATCH,
+    WRITE_BEHIND_MAX_ATTEMPTS,
+    WRITE_BEHIND_DEAD_LETTER_PATH,
+)
+from src.db import chat_history_table, user_table
+from src.gcp.sql import HISTORY_ROLES, conversation_cache, get_shared_async_engine
+from src.utils.cache import ConversationCache
+from src._types import Message
+
+
+logger = getLogger(__name__)
+
+# Errors that say nothing about the records, the batch is retried as it is.
+CONNECTION_ERRORS = (OperationalError, InterfaceError, ConnectionError, OSError, TimeoutError)
+
+
+class ChatWriteBehind:
+    """
+    Write-behind queue for user upserts and chat history inserts.
+
+    Writes are buffered in memory and appended to a local spool file by a single
+    spool thread, which syncs all the records added since its last write at once.
+    They are flushed to Cloud SQL in a single transaction every `flush_interval_ms`
+    milliseconds or as soon as `max_batch` records are pending. Records left in
+    the spool by a crashed process are replayed on start.
+
+    A batch that fails `max_attempts` flushes in a row is written record by record,
+    and the records the database rejects are moved to the dead-letter file, so that
+    they do not hold back the records after them.
+    """
+
+    def __init__(
+            self,
+            engine: AsyncEngine = None,
+            spool_path: str | Path = WRITE_BEHIND_SPOOL_PATH,
+            flush_interval_ms: int = WRITE_BEHIND_FLUSH_INTERVAL_MS,
+            max_batch: int = WRITE_BEHIND_MAX_BATCH,
+            max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS,
+            dead_letter_path: str | Path = WRITE_BEHIND_DEAD_LETTER_PATH,
+            cache: ConversationCache = conversation_cache,
+        ):
+        self._engine = engine
+        self.spool_path = Path(spool_path)
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.dead_letter_path = Path(dead_letter_path)
+        self.cache = cache
+
+        self._pending: list[dict] = []
+        # Pending records not written to the spool yet.
+        self._unspooled: list[dict] = []
+        self._spool_scheduled = False
+        self._lock = threading.Lock()
+        # Serializes the spool file writes and rewrites.
+        self._spool_lock = threading.Lock()
+        self._spool_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-behind-spool")
+        self._spool_file = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self._failed_attempts = 0
+
+        self.flushed_records = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.dead_records = 0
+        self.last_error: str | None = None
+
+    async def get_engine(self) -> AsyncEngine:
+        return self._engine if self._engine else await get_shared_async_engine()
+
+    # Spool
+
+    def _open_spool(self):
+        self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+        self._spool_file = open(self.spool_path, 'a', encoding='utf-8')
+
+    def _load_spool(self) -> list[dict]:
+        if not self.spool_path.exists():
+            return []
+        records = []
+        with open(self.spool_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn last line from a crash mid-write.
+                    logger.warning(f"Skipping corrupted spool record: {line[:100]}")
+        return records
+
+    def _write_unspooled(self):
+        """Append the records added since the last call to the spool with a single fsync. Runs on the spool thread."""
+        with self._spool_lock:
+            with self._lock:
+                records, self._unspooled = self._unspooled, []
+                self._spool_scheduled = False
+            if not records:
+                return
+            if self._spool_file is None:
+                self._open_spool()
+            self._spool_file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            self._spool_file.flush()
+            os.fsync(self._spool_file.fileno())
+
+    def _compact_spool(self, written: int, dead: list[dict] = None):
+        """
+        Drop the first `written` pending records, set the dead ones aside and rewrite
+        the spool with the pending records only.
+        """
+        if dead:
+            self.dead_letter_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as file:
+                file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in dead))
+                file.flush()
+                os.fsync(file.fileno())
+
+        with self._spool_lock:
+            with self._lock:
+                # Records added during the write stay pending, the rewrite covers the unspooled ones too.
+                self._pending = self._pending[written:]
+                self._unspooled = []
+                records = list(self._pending)
+            if self._spool_file is not None:
+                self._spool_file.close()
+            tmp_path = self.spool_path.with_suffix(".tmp")
+            self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.spool_path)
+            self._open_spool()
+
+    # Producers
+
+    def _add(self, record: dict):
+        with self._lock:
+            self._pending.append(record)
+            self._unspooled.append(record)
+            is_full = len(self._pending) >= self.max_batch
+            schedule_spool = not self._spool_scheduled
+            self._spool_scheduled = True
+
+        # File writes never run on the event loop, records added meanwhile share the next fsync.
+        if schedule_spool:
+            self._spool_executor.submit(self._write_unspooled)
+        if is_full and self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def add_user(self, user_uuid: str, name: str = None, metadata: str = None):
+        """Queue an upsert of a user. Without a name, the stored name of the user is kept."""
+        self._add({
+            "kind": "user",
+            "user_uuid": user_uuid,
+            "user_name": name if name else "",
+            "user_metadata": metadata if metadata else "",
+        })
+
+    def add_chat_message(self, user_uuid: str, role: str, content: str, messenger_timestamp: str = None):
+        """Queue an insert of a chat message and append it to the conversation cache"""
+        timestamp = datetime.utcnow()
+        self._add({
+            "kind": "chat",
+            "user_uuid": user_uuid,
+            "role": role,
+            "content": content,
+            "messenger_timestamp": messenger_timestamp if messenger_timestamp else "",
+            "timestamp": timestamp.isoformat(),
+        })
+        if self.cache is not None and role in HISTORY_ROLES:
+            # The row id is unknown until the flush, the timestamp is the one the row gets.
+            self.cache.append(
+                user_uuid,
+                Message(role=role, content=content, messenger_timestamp=messenger_timestamp or "", timestamp=timestamp)
+            )
+
+    async def sync(self):
+        """
+        Wait until the records added so far are in the spool file, so they survive a crash.
+        The spool thread runs its writes in order, so this write follows any scheduled one.
+        """
+        await asyncio.get_running_loop().run_in_executor(self._spool_executor, self._write_unspooled)
+
+    # Flushing
+
+    async def _write_batch(self, records: list[dict]):
+        users = {}
+        chats = []
+        for record in records:
+            if record["kind"] == "user":
+                # ON CONFLICT cannot touch the same row twice in one statement, keep the last upsert.
+                previous = users.get(record["user_uuid"])
+                users[record["user_uuid"]] = {
+                    "user_uuid": record["user_uuid"],
+                    "user_name": record["user_name"] or (previous["user_name"] if previous else ""),
+                    "user_metadata": record["user_metadata"],
+                }
+            elif record["kind"] == "chat":
+                chats.append({
+                    "user_uuid": record["user_uuid"],
+                    "role": record["role"],
+                    "content": record["content"],
+                    "messenger_timestamp": record["messenger_timestamp"],
+                    "timestamp": datetime.fromisoformat(record["timestamp"]),
+                })
+
+        engine = await self.get_engine()
+        async with engine.begin() as conn:
+            # Users go first so that chat rows satisfy the foreign key.
+            if users:
+                statement = insert(user_table).values(list(users.values()))
+                await conn.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=['user_uuid'],
+                        set_=dict(
+                            # An empty name means the profile was not available, keep the stored one.
+                            user_name=func.coalesce(func.nullif(statement.excluded.user_name, ""), user_table.c.user_name),
+                            user_metadata=statement.excluded.user_metadata,
+                        )
+                    )
+                )
+            if chats:
+                await conn.execute(chat_history_table.insert(), chats)
+
+    async def _write_each(self, records: list[dict]) -> tuple[int, list[dict]]:
+        """
+        Write records one at a time, collecting the ones the database rejects.
+
+        Returns:
+            tuple[int, list[dict]]: Number of records processed, and the rejected records.
+        """
+        dead = []
+        for i, record in enumerate(records):
+            try:
+                await self._write_batch([record])
+            except CONNECTION_ERRORS as e:
+                # Only the records before this one are done.
+                logger.error(f"Write-behind record by record flush stopped: {e}")
+                return i, dead
+            except Exception as e:
+                logger.error(f"Moving write-behind record to the dead-letter file: {e}")
+                dead.append({**record, "error": str(e)})
+        return len(records), dead
+
+    async def flush(self) -> int:
+        """
+        Write all pending records in one transaction.
+
+        Returns:
+            int: Number of records written.
+        """
+        async with self._flush_lock:
+            with self._lock:
+                records = list(self._pending)
+            if not records:
+                return 0
+
+            dead = []
+            try:
+                await self._write_batch(records)
+                processed = len(records)
+            except Exception as e:
+                self.failed_flushes += 1
+                self.last_error = str(e)
+                logger.error(f"Write-behind flush of {len(records)} records failed: {e}")
+                self._failed_attempts += 1
+                if self._failed_attempts < self.max_attempts or isinstance(e, CONNECTION_ERRORS):
+                    raise
+                processed, dead = await self._write_each(records)
+                if not processed:
+                    raise
+
+            self._failed_attempts = 0
+            await asyncio.to_thread(self._compact_spool, processed, dead)
+
+            written = processed - len(dead)
+            self.flushed_records += written
+            self.dead_records += len(dead)
+            self.flush_count += 1
+            return written
+
+    async def _run(self):
+        backoff = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                backoff = self.flush_interval
+            except Exception:
+                backoff = min(max(backoff * 2, 0.5), 30)
+
+    async def start(self):
+        """Replay the spool left by a previous process and start the flush loop"""
+        if self._task is not None:
+            return
+        spooled = await asyncio.to_thread(self._load_spool)
+        with self._lock:
+            self._pending = spooled + self._pending
+        if spooled:
+            logger.info(f"Replaying {len(spooled)} spooled records.")
+        await asyncio.to_thread(self._compact_spool, 0)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write everything still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.error("Final write-behind flush failed, records are kept in the spool.")
+        await asyncio.to_thread(self._write_unspooled)
+        with self._spool_lock:
+            if self._spool_file is not None:
+                self._spool_file.close()
+                self._spool_file = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "flushed_records": self.flushed_records,
+            "flush_count": self.flush_count,
+            "failed_flushes": self.failed_flushes,
+            "dead_records": self.dead_records,
+            "last_error": self.last_error,
+        }
+
+
+chat_write_behind = ChatWriteBehind()
@@ -1,12 +1,14 @@
+import asyncio
 import os
 import uvicorn
 import time
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, Request, HTTPException, Header, Response, BackgroundTasks
+from fastapi import FastAPI, Request, HTTPException, Header, Response
 
-from linebot.v3 import WebhookHandler
+from linebot.v3 import WebhookParser
 from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
 
@@ -24,18 +26,79 @@ import logging
 from pprint import pprint
 
 from src._types import Message, MessengerWebhookData, Platform
-from src.agents.customer_service import get_operator_agent
+from src.agents.customer_service import operator_agent_registry
+from src.agents.base_agent import close_async_openai_clients
+from src.agents.context import preload_config_encodings
+from src.agents.usage import prompt_cache_stats
 from src.chat.messenger import Messenger
 from src.chat.line import LineApp
-from src.gcp.sql import ChatHistoryTable, UserTable ,CloudSqlManager
-from src.gcp.gsheet import ClientTagSheet, ConfigSheet
+from src.chat.ingest import ingest_workers
+from src.chat.coalescer import message_coalescer
+from src.chat.executor import conversation_executor
+from src.chat.dedup import webhook_deduplicator
+from src.chat.http_clients import init_http_clients, close_http_clients
+from src.chat.profiles import profile_cache
+from src.gcp.sql import ChatHistoryTable, UserTable ,CloudSqlManager, init_engine, dispose_engine
+from src.gcp.sql import init_async_engine, dispose_async_engine, AsyncToolJobTable
+from src.gcp.write_behind import chat_write_behind
+from src.gcp.sheet_buffer import sheet_write_buffer
+from src.gcp.gsheet import ClientTagSheet, ConfigSheet, config_store, client_tag_index
 from src.agents.functions import add_contact_info
+from src.agents.tools import tool_registry
 # from src.db import ChatHistory, User
-from src.settings import MESSENGER_VERIFY_TOKEN
+from src.settings import MESSENGER_VERIFY_TOKEN, SHUTDOWN_DRAIN_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Parse and validate the tool schemas once, failing fast on a broken schema file.
+    tool_registry.load()
+    # Load the tokenizer before the first request, tiktoken downloads it on first use.
+    await asyncio.to_thread(preload_config_encodings)
+    # Build the operator agent before the first message, off the event loop.
+    await operator_agent_registry.start()
+    # Share one pooled Cloud SQL engine between all requests.
+    app.state.db_engine = init_engine()
+    app.state.async_db_engine = await init_async_engine()
+    # Keep-alive clients for the LINE and Graph APIs, shared by both adapters.
+    init_http_clients()
+    await chat_write_behind.start()
+    await config_store.start()
+    await client_tag_index.start()
+    await sheet_write_buffer.start()
+    await tool_registry.deferred.start()
+    await webhook_deduplicator.start()
+    await conversation_executor.start()
+    ingest_workers.register_handler(Platform.LINE, process_line_webhook)
+    ingest_workers.register_handler(Platform.MESSENGER, process_messenger_webhook)
+    await ingest_workers.start()
+    yield
+    # Finish the conversations already handed off before anything they use goes away:
+    # stop claiming webhooks, close the open batches, run what the lanes hold, then
+    # acknowledge the webhook jobs that were answered.
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_TIMEOUT
+    remaining = lambda: max(0, deadline - time.monotonic())
+    await ingest_workers.stop_workers()
+    await message_coalescer.drain(timeout=remaining())
+    await conversation_executor.drain(timeout=remaining())
+    await ingest_workers.stop(timeout=remaining())
+    await conversation_executor.stop()
+    await webhook_deduplicator.stop()
+    await tool_registry.deferred.stop()
+    await sheet_write_buffer.stop()
+    await client_tag_index.stop()
+    await config_store.stop()
+    # Flush queued chat history before the engines go away.
+    await chat_write_behind.stop()
+    await dispose_async_engine()
+    dispose_engine()
+    await close_async_openai_clients()
+    await close_http_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 
 load_dotenv(override=True)
 
@@ -44,7 +107,7 @@ get_access_token = os.getenv('LINE_CHANNEL_ACCESS_TOKEN').replace('"', '')
 get_channel_secret = os.getenv('LINE_CHANNEL_SECRET').replace('"', '')
 
 configuration = Configuration(access_token=get_access_token)
-handler = WebhookHandler(channel_secret=get_channel_secret)
+parser = WebhookParser(channel_secret=get_channel_secret)
 
 class MessageHistory:
     history = []
@@ -60,7 +123,8 @@ async def callback(request: Request):
     body_str = body.decode('utf-8')
     
     try:
-        handler.handle(body_str, x_line_signature)
+        # Only verified payloads are queued, the worker parses them again.
+        events = parser.parse(body_str, x_line_signature)
     except InvalidSignatureError as e:
         print(f"Invalid signature error: {str(e)}")
         # Log the error for debugging
@@ -71,9 +135,46 @@ async def callback(request: Request):
         print("Invalid signature. Please check your channel access token/channel secret.")
         raise HTTPException(status_code=400, detail="Invalid signature.")
 
+    # Redelivered events are dropped before they reach the queue.
+    event_ids = [
+        event.webhook_event_id for event in events
+        if webhook_deduplicator.claim(Platform.LINE, event.webhook_event_id)
+    ]
+    if not event_ids:
+        return 'OK'
+
+    try:
+        await ingest_workers.enqueue(
+            Platform.LINE,
+            {"body": body_str, "signature": x_line_signature, "event_ids": event_ids}
+        )
+    except Exception:
+        for event_id in event_ids:
+            await webhook_deduplicator.release(Platform.LINE, event_id)
+        raise
     return 'OK'
 
 
+async def process_line_webhook(payload: dict) -> list[asyncio.Future]:
+    """
+    Process a queued LINE webhook. The messages are handed off to be answered,
+    the returned futures resolve once they are.
+    """
+    events = parser.parse(payload["body"], payload["signature"])
+    # Only the events that were not duplicates when the webhook was received,
+    # nor received by another instance.
+    event_ids = payload.get("event_ids") or [event.webhook_event_id for event in events]
+    progress = await webhook_deduplicator.confirm_events(Platform.LINE, event_ids)
+    # Queued in order so that messages of one user in this webhook are coalesced.
+    # Messages a failed attempt already persisted are done.
+    futures = [
+        queue_message(event, progress[event.webhook_event_id].replied) for event in events
+        if event.webhook_event_id in progress and not progress[event.webhook_event_id].persisted
+        and isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent)
+    ]
+    return [future for future in futures if future is not None]
+
+
 @app.get("/messenger_callback")
 def init_messenger(request: Request):
 	# FB sends the verify token as hub.verify_token
@@ -102,24 +203,39 @@ def get_message_timestamp(data: MessengerWebhookData) -> str:
 
 
 @app.post("/messenger_callback", status_code=200)
-async def webhook(data: MessengerWebhookData, background_tasks: BackgroundTasks):
+async def webhook(data: MessengerWebhookData):
     """
-    Messages handler.
+    Messages handler. The webhook is queued and acknowledged at once.
     """
     print("Get webhook data")
     start_time = time.time()
     print(f"Start time: {start_time}")
-    async def send_message_task(data: MessengerWebhookData):
-        """
-        Background task to send message to Messenger.
-        """
-        print("Processing Messenger webhook data...") 
-        messenger = Messenger(
-            page_access_token=MESSENGER_VERIFY_TOKEN
-        )
-        await messenger.send_message_to_messenger(data)
-
-    background_tasks.add_task(send_message_task, data)
+    # Keep only the messages not received before, keyed on their mid.
+    mids = []
+    for entry in data.entry:
+        messaging_events = []
+        for event in entry.get("messaging", []):
+            if not event.get("message"):
+                continue
+            mid = event["message"].get("mid")
+            if webhook_deduplicator.claim(Platform.MESSENGER, mid):
+                messaging_events.append(event)
+                mids.append(mid)
+        entry["messaging"] = messaging_events
+
+    # One job per sender, so that senders are processed and retried independently.
+    enqueued = set()
+    try:
+        for sender_data in data.split_by_sender():
+            await ingest_workers.enqueue(Platform.MESSENGER, sender_data.model_dump())
+            enqueued.update(
+                event["message"].get("mid") for entry in sender_data.entry for event in entry["messaging"]
+            )
+    except Exception:
+        for mid in mids:
+            if mid not in enqueued:
+                await webhook_deduplicator.release(Platform.MESSENGER, mid)
+        raise
     processing_time = time.time() - start_time
     print(f"Processing time: {processing_time} seconds")
     
@@ -130,8 +246,33 @@ async def webhook(data: MessengerWebhookData, background_tasks: BackgroundTasks)
 
 
 
-@handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event: MessageEvent):
+async def process_messenger_webhook(payload: dict) -> list[asyncio.Future]:
+    """
+    Process a queued Messenger webhook. The messages are handed off to be answered,
+    the returned futures resolve once they are.
+    """
+    print("Processing Messenger webhook data...")
+    data = MessengerWebhookData.model_validate(payload)
+    # Drop the messages another instance received first, and those a failed attempt already persisted.
+    mids = [
+        event.get("message", {}).get("mid")
+        for entry in data.entry for event in entry.get("messaging", [])
+    ]
+    progress = await webhook_deduplicator.confirm_events(Platform.MESSENGER, mids)
+    for entry in data.entry:
+        entry["messaging"] = [
+            event for event in entry.get("messaging", [])
+            if event.get("message", {}).get("mid") in progress
+            and not progress[event["message"]["mid"]].persisted
+        ]
+
+    messenger = Messenger(
+        page_access_token=MESSENGER_VERIFY_TOKEN
+    )
+    return messenger.queue_messages(data, progress)
+
+
+def queue_message(event: MessageEvent, replied: bool = False) -> asyncio.Future | None:
 
     if not event.message.text:
         print("Received an empty message.")
@@ -145,10 +286,14 @@ def handle_message(event: MessageEvent):
     reply_token = event.reply_token
     message = event.message.text
     print(f"Received message from user {user_id}: {message}")
-    line_app.reply_message(
+    return line_app.queue_message(
         user_id=user_id,
         message=message,
-        reply_token=reply_token
+        reply_token=reply_token,
+        # The event time, not the hand-off time, orders the messages of a burst.
+        timestamp=str(event.timestamp),
+        event_id=event.webhook_event_id,
+        replied=replied
     )
 
 
@@ -162,6 +307,50 @@ def read_root(request: Request):
 
 
 
+@app.get("/status")
+def status():
+    """
+    Status of the in-process buffers and caches, and the prompt cache hit ratio per model.
+    """
+    operator_agent = operator_agent_registry.get_cached_agent()
+    return {
+        "sheet_write_buffer": sheet_write_buffer.status(),
+        "chat_write_behind": chat_write_behind.stats(),
+        "prompt_cache": prompt_cache_stats.snapshot(),
+        "deferred_tools": tool_registry.deferred.stats(),
+        "ingest": ingest_workers.stats(),
+        "coalescer": message_coalescer.stats(),
+        "conversation_executor": conversation_executor.stats(),
+        "webhook_dedup": webhook_deduplicator.stats(),
+        "profile_cache": profile_cache.stats(),
+        "answer_cache": (
+            operator_agent.answer_cache.stats()
+            if operator_agent is not None and operator_agent.answer_cache is not None else None
+        ),
+    }
+
+
+@app.get("/tool_jobs")
+async def get_tool_jobs(status: str = None, limit: int = 100):
+    """
+    List the latest background tool runs, e.g. `?status=failed`.
+    """
+    jobs = await AsyncToolJobTable().get_jobs(status=status, limit=limit)
+    return [dict(job._mapping) for job in jobs]
+
+
+@app.post("/tool_jobs/{job_id}/replay")
+async def replay_tool_job(job_id: int):
+    """
+    Run a recorded tool job again.
+    """
+    try:
+        succeeded = await tool_registry.deferred.replay(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"job_id": job_id, "status": "succeeded" if succeeded else "failed"}
+
+
 @app.get("/follow_up")
 async def follow_up(request: Request):
 
@@ -9,18 +9,133 @@ ROOT_DIR = Path(__file__).parent
 CONFIG_FILE = "src/config.yml"
 PRICE_SHEET_PATH = ROOT_DIR / "data" / "dental_prices.pdf"
 OPERATOR_PROMPT_PATH = ROOT_DIR / "prompts" / "operator_agent_prompt.txt"
+MARKDOWN_CACHE_DIR = Path(os.getenv("MARKDOWN_CACHE_DIR", ROOT_DIR / ".cache" / "markdown"))
+TIKTOKEN_CACHE_DIR = Path(os.getenv("TIKTOKEN_CACHE_DIR", ROOT_DIR / ".cache" / "tiktoken"))
 
 INSTANCE_CONNECTION_NAME = os.getenv("INSTANCE_CONNECTION_NAME", "your-project-id:your-region:your-instance")
 DB_USER = os.getenv("DB_USER", "your-username")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "your-password")
 DB_NAME = os.getenv("DB_NAME", "your-database")
 GOOGLE_API_CRED = os.getenv('GOOGLE_API_CRED')
+# Seconds between refreshes of the Config sheet snapshot
+CONFIG_REFRESH_INTERVAL = int(os.getenv("CONFIG_REFRESH_INTERVAL", 300))
+# Used for the Config sheet fields that are missing or malformed, until a good value is read
+CONFIG_DEFAULT_START_TIME = os.getenv("CONFIG_DEFAULT_START_TIME", "08:00")
+CONFIG_DEFAULT_END_TIME = os.getenv("CONFIG_DEFAULT_END_TIME", "20:00")
+CONFIG_DEFAULT_FOLLOW_UP_DAYS = int(os.getenv("CONFIG_DEFAULT_FOLLOW_UP_DAYS", 7))
+CONFIG_DEFAULT_FOLLOW_UP_MESSAGE = os.getenv("CONFIG_DEFAULT_FOLLOW_UP_MESSAGE", "This is a follow-up message.")
+# Seconds between full re-reads of the Client tag sheet index
+CLIENT_TAG_RECONCILE_INTERVAL = int(os.getenv("CLIENT_TAG_RECONCILE_INTERVAL", 600))
+# Buffered Google Sheets writes are flushed every interval (seconds) or once this many are pending
+SHEET_FLUSH_INTERVAL = float(os.getenv("SHEET_FLUSH_INTERVAL", 5))
+SHEET_FLUSH_MAX_PENDING = int(os.getenv("SHEET_FLUSH_MAX_PENDING", 50))
+
+# Connection pool for the shared Cloud SQL engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# Number of most recent chat messages loaded as conversation history
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", 20))
+# Older turns are summarized once this many messages are not covered by the summary,
+# keeping the most recent SUMMARY_KEEP_RECENT messages verbatim
+SUMMARY_THRESHOLD = int(os.getenv("SUMMARY_THRESHOLD", 16))
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", 8))
+# At most this many messages are folded into the summary per LLM call
+SUMMARY_FOLD_CHUNK = int(os.getenv("SUMMARY_FOLD_CHUNK", 100))
+SUMMARY_PROMPT_PATH = ROOT_DIR / "prompts" / "summary_prompt.txt"
+
+# In-memory cache of recent conversation windows
+CONVERSATION_CACHE_MAX_USERS = int(os.getenv("CONVERSATION_CACHE_MAX_USERS", 1000))
+CONVERSATION_CACHE_TTL = int(os.getenv("CONVERSATION_CACHE_TTL", 900))
+CONVERSATION_CACHE_MAX_BYTES = int(os.getenv("CONVERSATION_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+# Cache of the answers to first-turn questions, cleared whenever the operator agent is rebuilt
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+# Minimum character trigram similarity for a near-duplicate question to reuse an answer
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.8))
+
+# Price sheet rows are only retrieved with a BM25 score of at least RETRIEVAL_MIN_SCORE
+# and of at least RETRIEVAL_MIN_RELATIVE_SCORE times the best score of the question
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", 5))
+RETRIEVAL_MIN_RELATIVE_SCORE = float(os.getenv("RETRIEVAL_MIN_RELATIVE_SCORE", 0.5))
+
+# Write-behind queue for chat history and user upserts
+WRITE_BEHIND_SPOOL_PATH = Path(os.getenv("WRITE_BEHIND_SPOOL_PATH", ROOT_DIR / ".cache" / "write_behind.jsonl"))
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", 50))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", 100))
+# A batch failing this many flushes in a row is written record by record, and the
+# records the database rejects are moved to the dead-letter file
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", 5))
+WRITE_BEHIND_DEAD_LETTER_PATH = Path(
+    os.getenv("WRITE_BEHIND_DEAD_LETTER_PATH", ROOT_DIR / ".cache" / "write_behind.dead.jsonl")
+)
+
+# Durable local queue of incoming webhooks and the workers processing it
+INGEST_QUEUE_PATH = Path(os.getenv("INGEST_QUEUE_PATH", ROOT_DIR / ".cache" / "ingest.db"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))
+# Seconds a claimed webhook stays hidden from other workers, extended while its messages
+# are answered, and the time limit to hand it off
+INGEST_VISIBILITY_TIMEOUT = float(os.getenv("INGEST_VISIBILITY_TIMEOUT", 120))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", 3))
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", 2))
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", 1))
+# Seconds a claimed webhook waits for its messages to be answered and persisted before it is retried
+INGEST_PROCESSING_TIMEOUT = float(os.getenv("INGEST_PROCESSING_TIMEOUT", 600))
+
+# Messages a user sends within the quiet period (seconds) are answered with one agent call,
+# a burst is answered at the latest COALESCE_MAX_WAIT seconds after its first message
+COALESCE_QUIET_PERIOD = float(os.getenv("COALESCE_QUIET_PERIOD", 1.5))
+COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT", 5))
+
+# Conversations are hashed onto lanes, each lane processes its users' messages in order
+CONVERSATION_LANES = int(os.getenv("CONVERSATION_LANES", 16))
+CONVERSATION_LANE_MAX_QUEUE = int(os.getenv("CONVERSATION_LANE_MAX_QUEUE", 100))
+# Seconds shutdown waits for the conversations already handed off to be answered
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 25))
+
+# Webhook event ids are remembered in memory for WEBHOOK_DEDUP_TTL seconds
+# and in the database for WEBHOOK_DEDUP_RETENTION_DAYS days
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", 3600))
+WEBHOOK_DEDUP_MAX_ENTRIES = int(os.getenv("WEBHOOK_DEDUP_MAX_ENTRIES", 100000))
+WEBHOOK_DEDUP_RETENTION_DAYS = int(os.getenv("WEBHOOK_DEDUP_RETENTION_DAYS", 7))
+
+# Cache of LINE and Messenger display names, failed lookups are cached for PROFILE_CACHE_NEGATIVE_TTL seconds
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", 10000))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", 86400))
+PROFILE_CACHE_NEGATIVE_TTL = int(os.getenv("PROFILE_CACHE_NEGATIVE_TTL", 300))
+PROFILE_CACHE_SEED_FROM_DB = os.getenv("PROFILE_CACHE_SEED_FROM_DB", "true").lower() == "true"
 
 GCP_CREDENTIALS = ROOT_DIR / "creads.json"
+
+# Shared AsyncOpenAI client
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+# Shared HTTP clients for the LINE and Graph APIs
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
 FUNCTION_CALLINGS_FILE = ROOT_DIR / "prompts/functions.json"
+# Rounds of tool calls per request before the model must answer in text
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", 3))
+# Background execution of deferrable tools
+DEFERRED_TOOL_MAX_ATTEMPTS = int(os.getenv("DEFERRED_TOOL_MAX_ATTEMPTS", 5))
+DEFERRED_TOOL_RETRY_DELAY = float(os.getenv("DEFERRED_TOOL_RETRY_DELAY", 1))
+DEFERRED_TOOL_CONCURRENCY = int(os.getenv("DEFERRED_TOOL_CONCURRENCY", 4))
 
-LINE_CHANNEL_ACCESS_TOKEN=os.getenv('LINE_CHANNEL_ACCESS_TOKEN').replace('"','')
-LINE_CHANNEL_SECRET=os.getenv('LINE_CHANNEL_SECRET').replace('"', '')
+LINE_CHANNEL_ACCESS_TOKEN=os.getenv('LINE_CHANNEL_ACCESS_TOKEN', '').replace('"','')
+LINE_CHANNEL_SECRET=os.getenv('LINE_CHANNEL_SECRET', '').replace('"', '')
 
-MESSENGER_VERIFY_TOKEN = os.getenv('MESSENGER_WEBHOOK_TOKEN').replace('"', '')
+MESSENGER_VERIFY_TOKEN = os.getenv('MESSENGER_WEBHOOK_TOKEN', '').replace('"', '')
 
@@ -0,0 +1,205 @@
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any
+
+from src.utils.cache import TTLCache
+
+THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+# Everything except Latin letters, digits and Thai letters, vowels, tone marks and mai yamok
+NON_TEXT_PATTERN = re.compile(r"[^a-z0-9\u0e01-\u0e2e\u0e30-\u0e4e]+")
+# Letters stretched for emphasis, e.g. "ค่าาาา"; digits are left alone since they carry prices
+REPEATED_PATTERN = re.compile(r"([^0-9])\1{2,}")
+NUMBER_PATTERN = re.compile(r"[0-9]+")
+# Polite particles that end a question without changing its meaning
+POLITE_PARTICLES = ("ครับผม", "ครับ", "คับ", "ค่ะ", "คะ", "ค่า", "จ้า", "จ้ะ", "นะ", "ฮะ")
+
+
+def normalize_question(text: str) -> str:
+    """
+    Fold a question into a cache key.
+
+    Case, Thai digits, whitespace, punctuation, stretched letters and trailing
+    polite particles are folded so that trivially different wordings share a key.
+    """
+    text = unicodedata.normalize("NFC", text).lower().translate(THAI_DIGITS)
+    text = NON_TEXT_PATTERN.sub("", text)
+    text = REPEATED_PATTERN.sub(r"\1", text)
+    stripped = True
+    while stripped:
+        stripped = False
+        for particle in POLITE_PARTICLES:
+            if text.endswith(particle) and len(text) > len(particle):
+                text = text[:-len(particle)]
+                stripped = True
+                break
+    return text
+
+
+def get_ngrams(text: str, n: int = 3) -> frozenset[str]:
+    if len(text) <= n:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    question: str
+    answer: str
+    ngrams: frozenset[str]
+    numbers: tuple[str, ...]
+
+
+def answer_size(entry: CachedAnswer) -> int:
+    """Approximate memory size of a cached answer in bytes"""
+    return len(entry.answer.encode("utf-8")) + 4 * len(entry.question.encode("utf-8")) + 200
+
+
+class AnswerCache:
+    """
+    Cache of the agent answers to context-free questions.
+
+    Questions are matched on their normalized text first, then against the
+    cached questions with a character n-gram Jaccard similarity. Questions that
+    mention different numbers never match, so a price asked for one amount is
+    not answered with another.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 1000,
+            ttl: float | None = 3600,
+            max_bytes: int | None = None,
+            threshold: float = 0.8,
+            ngram: int = 3,
+            max_question_chars: int = 200,
+        ):
+        """
+        Args:
+            max_entries (int): Maximum number of cached answers.
+            ttl (float | None): Seconds an answer stays valid.
+            max_bytes (int | None): Maximum total size of the cached answers.
+            threshold (float): Minimum similarity for a near-duplicate match.
+            ngram (int): Length of the character n-grams compared.
+            max_question_chars (int): Longer questions are not cached.
+        """
+        self.entries = TTLCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes, sizeof=answer_size)
+        self.threshold = threshold
+        self.ngram = ngram
+        self.max_question_chars = max_question_chars
+        # n-gram -> normalized questions containing it
+        self._index: dict[str, set[str]] = defaultdict(set)
+        self._indexed: set[str] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def get_key(self, question: str) -> str | None:
+        """
+        Get the cache key of a question, or None if it should not be cached.
+        """
+        key = normalize_question(question)
+        if not key or len(key) > self.max_question_chars:
+            return None
+        return key
+
+    def _unindex(self, key: str):
+        for gram in get_ngrams(key, self.ngram):
+            keys = self._index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[gram]
+        self._indexed.discard(key)
+
+    def _prune(self):
+        """Drop index entries of questions evicted from the cache"""
+        live = set(self.entries.keys())
+        for key in self._indexed - live:
+            self._unindex(key)
+
+    def _find_similar(self, key: str) -> CachedAnswer | None:
+        ngrams = get_ngrams(key, self.ngram)
+        numbers = tuple(NUMBER_PATTERN.findall(key))
+        overlaps: dict[str, int] = defaultdict(int)
+        for gram in ngrams:
+            for candidate in self._index.get(gram, ()):
+                overlaps[candidate] += 1
+
+        best, best_score = None, self.threshold
+        for candidate, overlap in sorted(overlaps.items(), key=lambda item: item[1], reverse=True):
+            entry = self.entries.get(candidate)
+            if entry is None:
+                self._unindex(candidate)
+                continue
+            if entry.numbers != numbers:
+                continue
+            score = overlap / (len(ngrams) + len(entry.ngrams) - overlap)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def get(self, question: str) -> str | None:
+        """
+        Get the cached answer of a question or of a near-duplicate.
+
+        Returns:
+            str | None: The answer, or None on a miss.
+        """
+        key = self.get_key(question)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry.answer
+            entry = self._find_similar(key)
+            if entry is not None:
+                self.near_hits += 1
+                return entry.answer
+            self.misses += 1
+            return None
+
+    def set(self, question: str, answer: str):
+        """
+        Cache the answer to a question.
+        """
+        key = self.get_key(question)
+        if key is None or not answer:
+            return
+        ngrams = get_ngrams(key, self.ngram)
+        entry = CachedAnswer(
+            question=key,
+            answer=answer,
+            ngrams=ngrams,
+            numbers=tuple(NUMBER_PATTERN.findall(key)),
+        )
+        with self._lock:
+            self.entries.set(key, entry)
+            if key not in self._indexed:
+                for gram in ngrams:
+                    self._index[gram].add(key)
+                self._indexed.add(key)
+            if len(self._indexed) > 2 * self.entries.max_entries:
+                self._prune()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._index.clear()
+            self._indexed.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            entries = self.entries.stats()
+            return {
+                "entries": entries["entries"],
+                "bytes": entries["bytes"],
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+            }
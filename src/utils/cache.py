@@ -0,0 +1,198 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from src._types import Message
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a per-entry time-to-live.
+
+    Entries are evicted least recently used first when the cache holds more than
+    `max_entries` entries or, when `sizeof` is given, more than `max_bytes` bytes.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 1024,
+            ttl: float | None = 300,
+            max_bytes: int | None = None,
+            sizeof: Callable[[Any], int] | None = None,
+        ):
+        """
+        Args:
+            max_entries (int): Maximum number of entries.
+            ttl (float | None): Seconds an entry stays valid after it is set, None for no expiry.
+            max_bytes (int | None): Maximum total size of the values, None for no limit.
+            sizeof (Callable[[Any], int] | None): Function returning the approximate size of a value.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or sys.getsizeof
+        self._data: OrderedDict[Hashable, tuple[Any, float | None, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expires_at(self, ttl: float | None) -> float | None:
+        ttl = self.ttl if ttl is None else ttl
+        return time.monotonic() + ttl if ttl is not None else None
+
+    def _pop(self, key: Hashable):
+        _, _, size = self._data.pop(key)
+        self._size -= size
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self._size > self.max_bytes)
+        ):
+            self._pop(next(iter(self._data)))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a value and mark it as recently used.
+
+        Returns:
+            Any: The cached value, or `default` if missing or expired.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        """
+        Set a value, replacing any previous one.
+
+        Args:
+            key (Hashable): Cache key.
+            value (Any): Value to store.
+            ttl (float | None): Override of the default time-to-live for this entry.
+        """
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            size = self.sizeof(value) if self.max_bytes is not None else 0
+            self._data[key] = (value, self._expires_at(ttl), size)
+            self._size += size
+            self._evict()
+
+    def update(self, key: Hashable, func: Callable[[Any], Any]) -> bool:
+        """
+        Replace a cached value by `func(value)` while keeping its expiry.
+
+        Returns:
+            bool: True if the key was cached and updated, False otherwise.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                return False
+            value = func(value)
+            new_size = self.sizeof(value) if self.max_bytes is not None else 0
+            self._data[key] = (value, expires_at, new_size)
+            self._data.move_to_end(key)
+            self._size += new_size - size
+            self._evict()
+            return True
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def keys(self) -> list[Hashable]:
+        """
+        Get the cached keys, least recently used first. Expired entries may be included.
+        """
+        with self._lock:
+            return list(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get cache statistics.
+
+        Returns:
+            dict[str, Any]: Number of entries, size in bytes, hits and misses.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def messages_size(messages: list[Message]) -> int:
+    """Approximate memory size of a list of messages in bytes"""
+    return sum(len(msg.content.encode('utf-8')) + 200 for msg in messages)
+
+
+class ConversationCache(TTLCache):
+    """
+    Per-user cache of the recent conversation window.
+
+    Holds the same window `ChatHistoryTable.get_chat_history` returns, and is kept
+    up to date by appending messages as they are written to the database.
+    """
+
+    def __init__(self, window: int, max_users: int = 1024, ttl: float | None = 900, max_bytes: int | None = None):
+        super().__init__(max_entries=max_users, ttl=ttl, max_bytes=max_bytes, sizeof=messages_size)
+        self.window = window
+
+    def get_messages(self, user_uuid: str) -> list[Message] | None:
+        """
+        Get a copy of the cached window of a user, or None on a miss.
+        """
+        messages = self.get(user_uuid)
+        return list(messages) if messages is not None else None
+
+    def set_messages(self, user_uuid: str, messages: list[Message]):
+        self.set(user_uuid, list(messages[-self.window:]) if self.window else list(messages))
+
+    def append(self, user_uuid: str, message: Message) -> bool:
+        """
+        Append a message to a cached window. Users that are not cached are left
+        alone, since a partial window would hide older messages on the next read.
+
+        Returns:
+            bool: True if the user was cached and the message appended.
+        """
+        def _append(messages: list[Message]) -> list[Message]:
+            messages = messages + [message]
+            return messages[-self.window:] if self.window else messages
+
+        return self.update(user_uuid, _append)
@@ -3,22 +3,23 @@ from src.settings import FUNCTION_CALLINGS_FILE
 
 class FunctionCallingUtils:
     @staticmethod
-    def load_schema(func_name: str) -> dict:
+    def load_schemas(file_path=FUNCTION_CALLINGS_FILE) -> dict[str, dict]:
         """
-        Load functions calling configuration from a JSON file.
+        Load all function calling schemas from a JSON file, keyed by function name.
         """
         try:
-            with open(FUNCTION_CALLINGS_FILE, 'r') as file:
-                functions_calling = json.load(file)
-                return functions_calling.get(func_name, {})
+            with open(file_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
         except FileNotFoundError:
             print("functions_calling.json file not found.")
             return {}
         except json.JSONDecodeError:
             print("Error decoding JSON from functions_calling.json.")
             return {}
-        
 
-FunctionCallingUtils.load_schema(
-    "add_contact_info"
-)
\ No newline at end of file
+    @staticmethod
+    def load_schema(func_name: str) -> dict:
+        """
+        Load functions calling configuration from a JSON file.
+        """
+        return FunctionCallingUtils.load_schemas().get(func_name, {})
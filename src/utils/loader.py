@@ -1,15 +1,118 @@
+import argparse
+import hashlib
+import os
+from importlib import metadata
+from pathlib import Path
+
 import pymupdf4llm
 
+from src.settings import MARKDOWN_CACHE_DIR, ROOT_DIR
+
+
+def get_converter_version() -> str:
+    """
+    Get the version of the PDF to Markdown converter.
+
+    Returns:
+        str: The installed pymupdf4llm version.
+    """
+    try:
+        return metadata.version("pymupdf4llm")
+    except metadata.PackageNotFoundError:
+        return getattr(pymupdf4llm, "__version__", "unknown")
+
 
 class PdfFile:
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, cache_dir: str | Path = MARKDOWN_CACHE_DIR):
         self.file_path = file_path
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+
+    def get_content_hash(self) -> str:
+        """
+        Compute the SHA-256 hash of the PDF file content.
+
+        Returns:
+            str: The hex digest of the file content.
+        """
+        digest = hashlib.sha256()
+        with open(self.file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_cache_path(self) -> Path:
+        """
+        Get the cache file path for the current content of the PDF file.
+        The key combines the content hash and the converter version.
+
+        Returns:
+            Path: Path of the cached Markdown file.
+        """
+        key = f"{self.get_content_hash()}-{get_converter_version()}"
+        return self.cache_dir / f"{key}.md"
+
+    def convert(self) -> str:
+        """
+        Convert the PDF file to Markdown without using the cache.
+
+        Returns:
+            str: The extracted text in Markdown format.
+        """
+        return pymupdf4llm.to_markdown(str(self.file_path))
 
     def get_markdown(self) -> str:
         """
         Extracts the text from the PDF file and converts it to Markdown format.
-        
+        The result is cached on disk, so a file with the same content is only
+        converted once per converter version.
+
         Returns:
             str: The extracted text in Markdown format.
         """
-        return pymupdf4llm.to_markdown(self.file_path)
\ No newline at end of file
+        if not self.cache_dir:
+            return self.convert()
+
+        cache_path = self.get_cache_path()
+        if cache_path.exists():
+            return cache_path.read_text(encoding='utf-8')
+
+        markdown = self.convert()
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial file.
+            tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(markdown, encoding='utf-8')
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Could not write Markdown cache {cache_path}: {e}")
+        return markdown
+
+
+def preconvert_folder(folder_path: str | Path, cache_dir: str | Path = MARKDOWN_CACHE_DIR) -> list[Path]:
+    """
+    Convert every PDF file in a folder and store the results in the Markdown cache.
+
+    Args:
+        folder_path (str | Path): Folder containing the PDF files.
+        cache_dir (str | Path): Markdown cache directory.
+
+    Returns:
+        list[Path]: The cache files that were written or already present.
+    """
+    cache_paths = []
+    for pdf_path in sorted(Path(folder_path).glob("*.pdf")):
+        pdf_file = PdfFile(file_path=pdf_path, cache_dir=cache_dir)
+        pdf_file.get_markdown()
+        cache_path = pdf_file.get_cache_path()
+        print(f"Converted {pdf_path} -> {cache_path}")
+        cache_paths.append(cache_path)
+    return cache_paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-convert PDF files to cached Markdown.")
+    parser.add_argument("folder", nargs="?", default=str(ROOT_DIR / "data"), help="Folder containing PDF files")
+    parser.add_argument("--cache-dir", default=str(MARKDOWN_CACHE_DIR), help="Markdown cache directory")
+    args = parser.parse_args()
+
+    preconvert_folder(args.folder, cache_dir=args.cache_dir)
@@ -0,0 +1,288 @@
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from operator import attrgetter
+from typing import Any, Callable
+
+from src._types import Message
+from src.settings import RETRIEVAL_MIN_SCORE, RETRIEVAL_MIN_RELATIVE_SCORE
+
+THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+TOKEN_PATTERN = re.compile(r"[\u0e00-\u0e4f\u0e5a-\u0e7f]+|[a-z0-9]+(?:[.,][0-9]+)*")
+THAI_PATTERN = re.compile(r"[\u0e00-\u0e7f]")
+TABLE_SEPARATOR_PATTERN = re.compile(r"^\|?\s*:?-{2,}")
+DIGIT_PATTERN = re.compile(r"[0-9\u0e50-\u0e59]")
+ITEM_NUMBER_PATTERN = re.compile(r"^(?:\*\*)?[0-9]+\.")
+# Question and polite words that carry no treatment, removed from queries.
+# Without them a question like "ถอนฟันราคาเท่าไหร่" matches rows on "ราคา" and "เท".
+QUERY_STOPWORDS = (
+    "สวัสดี", "ขอบคุณ", "สอบถาม", "หน่อย", "ราคา", "เท่าไหร่", "เท่าไร", "กี่บาท",
+    "ครับ", "ค่ะ", "คะ",
+)
+QUERY_STOPWORDS_PATTERN = re.compile("|".join(QUERY_STOPWORDS))
+# Table pipes, bold and underline markers and line breaks
+MARKUP_PATTERN = re.compile(r"\||\*\*|</?u>|<br>")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split a text into search tokens.
+
+    Thai is written without spaces between words, so Thai runs are split into
+    character bigrams. Latin words and numbers are kept whole.
+    """
+    text = unicodedata.normalize("NFC", text).lower().translate(THAI_DIGITS)
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text):
+        if THAI_PATTERN.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def split_table_row(line: str) -> list[str]:
+    line = line.strip()
+    # Only the outer pipes are dropped, a leading empty cell is kept.
+    line = line[1:] if line.startswith("|") else line
+    line = line[:-1] if line.endswith("|") else line
+    return [cell.strip() for cell in line.split("|")]
+
+
+def has_price(cells: list[str]) -> bool:
+    """Check if a table row has a price, i.e. a number in a cell after the item name"""
+    return any(DIGIT_PATTERN.search(cell) for cell in cells[2:])
+
+
+def get_index_text(line: str) -> str:
+    """Get the searchable text of a Markdown line, without table pipes and formatting"""
+    return MARKUP_PATTERN.sub(" ", line).strip()
+
+
+@dataclass(frozen=True)
+class PriceChunk:
+    """
+    A priced row of the price sheet, or a paragraph outside its tables.
+
+    Only `text` is indexed. The table header is shared by all the rows of a table,
+    it is kept in `header` and rendered once per table. The header of a paragraph
+    is its section heading.
+    """
+    # Indexed text: the row with the names of its category and item
+    text: str
+    # Table header and separator lines, or the section heading of a paragraph
+    header: str
+    # Category and item rows the row belongs to
+    parents: tuple[str, ...]
+    # The row itself, or the paragraph
+    body: str
+
+
+def chunk_price_sheet(markdown: str) -> list[PriceChunk]:
+    """
+    Split the price sheet Markdown into one chunk per treatment.
+
+    Every priced table row becomes a chunk. Rows without prices are parents: a
+    numbered category (`|**4**|**ทันตกรรมหัตถการ**||||`) or an item with priced
+    sub-rows (`||2.อุดฟันด้วยวัสดุสีเหมือนฟัน||||` then `||2 ด้าน|800|...`). A row is
+    indexed with the names of its parents, so that it can be found on its own, but
+    not with the table header, which every row of the table shares and whose words
+    ("ราคา", "ค่าบริการ", "รายการ") would match almost any question.
+    Text outside tables is split into paragraphs, repeated paragraphs are kept once.
+    """
+    chunks = []
+    heading = ""
+    table_header = None
+    category = None
+    item = None
+    paragraph: list[str] = []
+    paragraphs: set[str] = set()
+
+    def flush_paragraph():
+        body = "\n".join(paragraph)
+        # Every page repeats the contact lines, they are kept once.
+        if body and body not in paragraphs:
+            paragraphs.add(body)
+            chunks.append(PriceChunk(text=get_index_text(body), header=heading, parents=(), body=body))
+        paragraph.clear()
+
+    for line in markdown.splitlines():
+        line = line.strip()
+        if not line:
+            flush_paragraph()
+            table_header = category = item = None
+            continue
+        if line.startswith("#"):
+            flush_paragraph()
+            heading = line
+            table_header = category = item = None
+            continue
+        if line.startswith("|"):
+            flush_paragraph()
+            if TABLE_SEPARATOR_PATTERN.match(line):
+                continue
+            if table_header is None:
+                table_header = line
+                continue
+            cells = split_table_row(line)
+            is_category = bool(cells[0])
+            if not has_price(cells):
+                if is_category:
+                    category, item = line, None
+                else:
+                    item = line
+                continue
+            if is_category:
+                # A priced category has no sub-rows.
+                category = item = None
+            elif ITEM_NUMBER_PATTERN.match(cells[1] if len(cells) > 1 else ""):
+                # A numbered item ends the sub-rows of the previous item.
+                item = None
+            parents = tuple(filter(None, [category, item]))
+            separator = "|" + "---|" * len(split_table_row(table_header))
+            chunks.append(PriceChunk(
+                text=" ".join(get_index_text(row) for row in [*parents, line]),
+                header=f"{table_header}\n{separator}",
+                parents=parents,
+                body=line,
+            ))
+            continue
+        paragraph.append(line)
+    flush_paragraph()
+    return chunks
+
+
+def render_chunks(chunks: list[PriceChunk]) -> str:
+    """
+    Render chunks in sheet order. The header of a table is written once, followed
+    by its rows, and a parent row once before the first of its rows.
+    """
+    blocks: dict[str, list[str]] = {}
+    rendered_parents: dict[str, set[str]] = defaultdict(set)
+    for chunk in chunks:
+        block = blocks.setdefault(chunk.header, [chunk.header] if chunk.header else [])
+        for parent in chunk.parents:
+            if parent not in rendered_parents[chunk.header]:
+                rendered_parents[chunk.header].add(parent)
+                block.append(parent)
+        block.append(chunk.body)
+    return "\n\n".join("\n".join(block) for block in blocks.values())
+
+
+class BM25Index:
+    """
+    In-memory Okapi BM25 index over a list of text chunks.
+    """
+
+    def __init__(self, chunks: list, k1: float = 1.5, b: float = 0.75, get_text: Callable[[Any], str] | None = None):
+        """
+        Args:
+            chunks (list): The chunks, text or objects holding the text.
+            k1 (float): Term frequency saturation.
+            b (float): Length normalization.
+            get_text (Callable[[Any], str], optional): Gets the indexed text of a chunk, the chunk itself by default.
+        """
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        get_text = get_text or (lambda chunk: chunk)
+        self._term_freqs = [Counter(tokenize(get_text(chunk))) for chunk in chunks]
+        self._lengths = [sum(freqs.values()) for freqs in self._term_freqs]
+        self._avg_length = (sum(self._lengths) / len(chunks)) if chunks else 0
+        self._postings: dict[str, list[int]] = defaultdict(list)
+        for i, freqs in enumerate(self._term_freqs):
+            for term in freqs:
+                self._postings[term].append(i)
+        n = len(chunks)
+        self._idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self._postings.items()
+        }
+
+    def search(self, query: str, top_k: int = 5) -> list[tuple[float, Any]]:
+        """
+        Get the chunks that best match a query.
+
+        Returns:
+            list[tuple[float, Any]]: Up to `top_k` best (score, chunk) pairs, in sheet order.
+        """
+        scores: dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for i in self._postings[term]:
+                freq = self._term_freqs[i][term]
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[i] / self._avg_length)
+                scores[i] += idf * freq * (self.k1 + 1) / (freq + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        # Keep the original sheet order so related rows read naturally.
+        best.sort(key=lambda item: item[0])
+        return [(score, self.chunks[i]) for i, score in best]
+
+
+class PriceSheetRetriever:
+    """
+    Selects the price sheet rows relevant to the latest user messages.
+
+    Rows scoring below `min_score`, or below `min_relative_score` times the best
+    score, are dropped, so a question that matches nothing, e.g. a greeting, gets
+    no rows at all instead of the rows that share a few common bigrams with it.
+    """
+
+    def __init__(
+            self,
+            markdown: str,
+            top_k: int = 8,
+            query_messages: int = 2,
+            min_score: float = RETRIEVAL_MIN_SCORE,
+            min_relative_score: float = RETRIEVAL_MIN_RELATIVE_SCORE,
+        ):
+        """
+        Args:
+            markdown (str): The price sheet in Markdown format.
+            top_k (int): Maximum number of chunks to retrieve.
+            query_messages (int): Number of latest user messages used as the query.
+            min_score (float): Minimum BM25 score of a retrieved chunk.
+            min_relative_score (float): Minimum score of a retrieved chunk relative to the best one.
+        """
+        self.chunks = chunk_price_sheet(markdown)
+        self.index = BM25Index(self.chunks, get_text=attrgetter("text"))
+        self.top_k = top_k
+        self.query_messages = query_messages
+        self.min_score = min_score
+        self.min_relative_score = min_relative_score
+
+    def search(self, query: str) -> list[tuple[float, PriceChunk]]:
+        """
+        Get the relevant chunks of a query.
+
+        Returns:
+            list[tuple[float, PriceChunk]]: The (score, chunk) pairs, in sheet order.
+        """
+        results = self.index.search(query, top_k=self.top_k)
+        if not results:
+            return []
+        cutoff = max(self.min_score, self.min_relative_score * max(score for score, _ in results))
+        return [(score, chunk) for score, chunk in results if score >= cutoff]
+
+    def get_context_message(self, messages: list[Message]) -> Message | None:
+        """
+        Build the message holding the price sheet rows relevant to the conversation.
+
+        Returns:
+            Message | None: A system message, or None if no row is relevant.
+        """
+        user_messages = [msg.content for msg in messages if msg.role == "user"]
+        query = QUERY_STOPWORDS_PATTERN.sub(" ", "\n".join(user_messages[-self.query_messages:]))
+        results = self.search(query)
+        if not results:
+            return None
+        rows = render_chunks([chunk for _, chunk in results])
+        return Message(role="system", content=f"## Relevant price sheet rows\n```\n{rows}\n```")
@@ -0,0 +1,61 @@
+from src.utils import cache
+from src.utils.answer_cache import AnswerCache, normalize_question
+
+
+def test_normalize_question_folds_trivial_differences():
+    assert normalize_question("ราคาขูดหินปูน เท่าไหร่ครับ?") == "ราคาขูดหินปูนเท่าไหร่"
+    assert normalize_question("ราคาขูดหินปูนเท่าไหร่คะะะ") == "ราคาขูดหินปูนเท่าไหร่"
+    assert normalize_question("Price of ๒ Implants?") == "priceof2implants"
+
+
+def test_exact_and_near_duplicate_hits():
+    answers = AnswerCache(threshold=0.6)
+    answers.set("ราคาขูดหินปูนเท่าไหร่ครับ", "800 บาท")
+
+    assert answers.get("ราคาขูดหินปูน เท่าไหร่ คะ") == "800 บาท"
+    assert answers.get("ราคาขูดหินปูนเท่าไหร่หรอ") == "800 บาท"
+    assert answers.get("จัดฟันราคาเท่าไหร่") is None
+    stats = answers.stats()
+    assert (stats["entries"], stats["hits"], stats["near_hits"], stats["misses"]) == (1, 1, 1, 1)
+
+
+def test_different_numbers_never_match():
+    answers = AnswerCache(threshold=0.5)
+    answers.set("รากฟันเทียม 2 ซี่ราคาเท่าไหร่", "80,000 บาท")
+
+    assert answers.get("รากฟันเทียม 3 ซี่ราคาเท่าไหร่") is None
+    assert answers.get("รากฟันเทียม ๒ ซี่ ราคาเท่าไหร่") == "80,000 บาท"
+
+
+def test_long_questions_and_empty_answers_are_not_cached():
+    answers = AnswerCache(max_question_chars=10)
+    answers.set("this question is far too long", "answer")
+    answers.set("short", "")
+
+    assert answers.get("this question is far too long") is None
+    assert answers.get("short") is None
+    assert answers.stats()["entries"] == 0
+
+
+def test_expired_answers_are_dropped_from_the_index(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    answers = AnswerCache(ttl=60, threshold=0.5)
+    answers.set("ราคาอุดฟันเท่าไหร่", "500 บาท")
+
+    now[0] += 61
+
+    assert answers.get("ราคาอุดฟันเท่าไหร่หรอ") is None
+    assert answers._indexed == set()
+    assert answers._index == {}
+
+
+def test_evicted_questions_are_pruned():
+    answers = AnswerCache(max_entries=2, threshold=1.0)
+    for i in range(5):
+        answers.set(f"question number {'abcde'[i]}", f"answer {i}")
+
+    assert len(answers.entries) == 2
+    assert answers._indexed == set(answers.entries.keys())
+    assert answers.get("question number e") == "answer 4"
+    assert answers.get("question number a") is None
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+
+import pandas as pd
+
+from src.gcp.gsheet import ClientTagIndex
+
+
+class FakeWorksheet:
+    def __init__(self, values):
+        self.values = values
+        self.reads = 0
+        self.threads = []
+        self.on_read = None
+
+    def get_all_values(self):
+        self.reads += 1
+        self.threads.append(threading.current_thread())
+        values = [list(row) for row in self.values]
+        if self.on_read:
+            self.on_read()
+        return values
+
+
+class FakeClientTagSheet:
+    speadsheet_name = "Client-detail-spread-sheet"
+    sheet_name = "Client tag"
+
+    def __init__(self, values):
+        self.worksheet = FakeWorksheet(values)
+
+    def get_sheet(self):
+        return self.worksheet
+
+
+class FakeWriteBuffer:
+    def __init__(self):
+        self.appends = []
+        self.cells = []
+
+    def append_row(self, sheet, values, on_written=None):
+        self.appends.append(values)
+        if on_written:
+            on_written(None)
+
+    def update_cell(self, sheet, row, col, value):
+        self.cells.append((row, col, value))
+
+
+HEADER = ["profile name", "tag", "last message timestamp", "user id", "platform"]
+
+
+def make_index(rows) -> tuple[ClientTagIndex, FakeWriteBuffer]:
+    buffer = FakeWriteBuffer()
+    index = ClientTagIndex(sheet=FakeClientTagSheet([HEADER, *rows]), write_buffer=buffer)
+    index.rebuild()
+    return index, buffer
+
+
+def test_profile_without_name_refreshes_the_row_of_its_user_id():
+    index, buffer = make_index([["Somchai", "inprogress", "2024-01-01", "U1", "line"]])
+
+    asyncio.run(index.save_profile(profile_name=None, user_id="U1", platform="line"))
+
+    today = pd.Timestamp.now().strftime('%Y-%m-%d')
+    assert buffer.cells == [(2, ClientTagIndex.DATE_COL, today)]
+    assert buffer.appends == []
+    assert index.get_by_user_id("U1").profile_name == "Somchai"
+
+
+def test_unknown_user_without_name_is_not_added():
+    index, buffer = make_index([])
+
+    asyncio.run(index.save_profile(profile_name=None, user_id="U2", platform="line"))
+
+    assert buffer.appends == []
+    assert index.get_by_user_id("U2") is None
+
+
+def test_index_is_built_off_the_event_loop_and_served_while_rebuilt():
+    buffer = FakeWriteBuffer()
+    sheet = FakeClientTagSheet([HEADER, ["Somchai", "inprogress", "2024-01-01", "U1", "line"]])
+    index = ClientTagIndex(sheet=sheet, write_buffer=buffer)
+
+    async def run():
+        await index.save_profile(profile_name="Somchai", user_id="U1", platform="line")
+        assert sheet.worksheet.threads[-1] is not threading.main_thread()
+
+        index.invalidate()
+        sheet.worksheet.values.append(["Malee", "inprogress", "2024-01-01", "U2", "line"])
+        # The stale index answers at once, the rebuild runs in the background.
+        await index.save_profile(profile_name="Somchai", user_id="U1", platform="line")
+        assert index.get_profile("Malee") is None
+        await index._rebuild_task
+        return index.get_profile("Malee")
+
+    assert asyncio.run(run()).row == 3
+    assert sheet.worksheet.reads == 2
+
+
+def test_rebuild_keeps_updates_made_while_reading_the_sheet():
+    index, buffer = make_index([["Somchai", "inprogress", "2024-01-01", "U1", "line"]])
+    # Our write lands while the sheet is read, so the read still has the old date.
+    index.get_sheet().worksheet.on_read = lambda: index.update_timestamp("Somchai")
+
+    index.rebuild()
+
+    today = pd.Timestamp.now().strftime('%Y-%m-%d')
+    assert index.get_profile("Somchai").last_contact == today
+    assert buffer.cells == [(2, ClientTagIndex.DATE_COL, today)]
+
+
+def test_rebuild_keeps_profiles_appended_while_reading_the_sheet():
+    index, buffer = make_index([["Somchai", "inprogress", "2024-01-01", "U1", "line"]])
+    written = []
+    buffer.append_row = lambda sheet, values, on_written=None: written.append(on_written)
+    index.add_new_profile("Malee", user_id="U2", platform="line")
+    # The append lands while the sheet is read, so the read does not have the row yet.
+    index.get_sheet().worksheet.on_read = lambda: written[0](3)
+
+    index.rebuild()
+
+    assert index.has_profile("Malee")
+    assert index.get_by_user_id("U2").row == 3
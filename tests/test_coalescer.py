@@ -0,0 +1,113 @@
+import asyncio
+from operator import attrgetter
+
+from src.chat.coalescer import MessageCoalescer
+from src._types import IncomingMessage
+
+
+def test_burst_is_handled_once_with_the_latest_handler():
+    coalescer = MessageCoalescer(quiet_period=0.02, max_wait=1)
+    calls = []
+
+    def make_handler(name):
+        async def handler(items):
+            calls.append((name, items))
+            return name
+        return handler
+
+    async def run():
+        first = asyncio.create_task(coalescer.submit("u1", "a", make_handler("first")))
+        await asyncio.sleep(0.005)
+        second = asyncio.create_task(coalescer.submit("u1", "b", make_handler("second")))
+        other = asyncio.create_task(coalescer.submit("u2", "c", make_handler("other")))
+        return await asyncio.gather(first, second, other)
+
+    assert asyncio.run(run()) == ["second", "second", "other"]
+    assert sorted(calls) == [("other", ["c"]), ("second", ["a", "b"])]
+    assert coalescer.stats() == {"open_batches": 0, "messages": 3, "batches": 2}
+
+
+def test_batch_is_closed_after_max_wait():
+    coalescer = MessageCoalescer(quiet_period=0.03, max_wait=0.05)
+    batches = []
+
+    async def handler(items):
+        batches.append(items)
+
+    async def run():
+        futures = []
+        # A message every 20 ms never leaves a quiet period.
+        for i in range(6):
+            futures.append(coalescer.add("u", i, handler))
+            await asyncio.sleep(0.02)
+        await asyncio.gather(*futures)
+
+    asyncio.run(run())
+    assert len(batches) >= 2
+    assert [item for batch in batches for item in batch] == list(range(6))
+
+
+def test_errors_reach_every_waiter_and_cancel_is_isolated():
+    coalescer = MessageCoalescer(quiet_period=0.01, max_wait=1)
+
+    async def handler(items):
+        raise ValueError("failed")
+
+    async def run():
+        cancelled = asyncio.create_task(coalescer.submit("u", "a", handler))
+        waiting = asyncio.create_task(coalescer.submit("u", "b", handler))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        return await asyncio.gather(cancelled, waiting, return_exceptions=True)
+
+    cancelled, waiting = asyncio.run(run())
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert isinstance(waiting, ValueError)
+
+
+def test_no_quiet_period_disables_coalescing():
+    coalescer = MessageCoalescer(quiet_period=0)
+
+    async def handler(items):
+        return items
+
+    async def run():
+        return await asyncio.gather(coalescer.submit("u", "a", handler), coalescer.submit("u", "b", handler))
+
+    assert asyncio.run(run()) == [["a"], ["b"]]
+
+
+def test_drain_closes_open_batches_at_once():
+    coalescer = MessageCoalescer(quiet_period=10, max_wait=10)
+    handled = []
+
+    async def handler(items):
+        await asyncio.sleep(0.01)
+        handled.append(items)
+
+    async def run():
+        future = coalescer.add("u", "a", handler)
+        coalescer.add("u", "b", handler)
+        # Without the drain the batch would wait for its 10 second quiet period.
+        await asyncio.wait_for(coalescer.drain(timeout=1), timeout=1)
+        return future.done()
+
+    assert asyncio.run(run()) is True
+    assert handled == [["a", "b"]]
+    assert coalescer.stats()["open_batches"] == 0
+
+
+def test_batch_items_are_ordered_by_platform_timestamp():
+    coalescer = MessageCoalescer(quiet_period=0.01, max_wait=1, sort_key=attrgetter("sort_key"))
+
+    async def handler(items):
+        return [item.text for item in items]
+
+    async def run():
+        # The later message reached the coalescer first, e.g. from another ingest worker.
+        later = coalescer.add("u", IncomingMessage("second", "1700000000500"), handler)
+        coalescer.add("u", IncomingMessage("no time", ""), handler)
+        coalescer.add("u", IncomingMessage("first", "1700000000100"), handler)
+        return await later
+
+    assert asyncio.run(run()) == ["first", "second", "no time"]
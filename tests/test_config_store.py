@@ -0,0 +1,71 @@
+from datetime import time
+
+import pandas as pd
+
+from src.gcp import gsheet
+from src.gcp.gsheet import DEFAULT_CONFIG, ConfigSheet, ConfigSnapshot, ConfigStore
+
+
+def make_config_sheet(records: list[dict]) -> ConfigSheet:
+    """Build a ConfigSheet from rows as `get_all_records` returns them, without Google Sheets"""
+    sheet = ConfigSheet.__new__(ConfigSheet)
+    sheet.df = pd.DataFrame(records)
+    sheet.transposed_df = sheet.df.T
+    sheet.transposed_df.columns = sheet.transposed_df.iloc[0]
+    sheet.transposed_df = sheet.transposed_df[1:]
+    return sheet
+
+
+GOOD_RECORDS = [
+    {"key": "start time", "value": "09:00"},
+    {"key": "end time", "value": "18:30"},
+    {"key": "follow up within (day)", "value": 3},
+    {"key": "follow up message", "value": "สวัสดีค่ะ"},
+]
+
+
+def test_snapshot_from_sheet():
+    snapshot = ConfigSnapshot.from_sheet(make_config_sheet(GOOD_RECORDS))
+    assert (snapshot.start_time, snapshot.end_time) == (time(9, 0), time(18, 30))
+    assert snapshot.follow_up_threshold == 3
+    assert snapshot.follow_up_message == "สวัสดีค่ะ"
+    assert snapshot.invalid_fields == ()
+
+
+def test_malformed_field_keeps_the_previous_value():
+    previous = ConfigSnapshot.from_sheet(make_config_sheet(GOOD_RECORDS))
+    records = [
+        {"key": "start time", "value": "10:00"},
+        {"key": "end time", "value": "not a time"},
+        {"key": "follow up within (day)", "value": ""},
+    ]
+    snapshot = ConfigSnapshot.from_sheet(make_config_sheet(records), fallback=previous)
+
+    assert snapshot.start_time == time(10, 0)
+    assert snapshot.end_time == time(18, 30)
+    assert snapshot.follow_up_threshold == 3
+    assert snapshot.follow_up_message == "สวัสดีค่ะ"
+    assert snapshot.invalid_fields == ("end_time", "follow_up_threshold", "follow_up_message")
+
+
+def test_store_never_loads_inline_and_keeps_last_good_snapshot(monkeypatch):
+    store = ConfigStore()
+    loads = []
+
+    def fake_config_sheet():
+        loads.append(1)
+        if len(loads) > 1:
+            raise ConnectionError("quota exceeded")
+        return make_config_sheet(GOOD_RECORDS)
+
+    monkeypatch.setattr(gsheet, "ConfigSheet", fake_config_sheet)
+
+    # Nothing loaded yet: defaults, without touching the sheet.
+    assert store.get() is DEFAULT_CONFIG
+    assert loads == []
+
+    good = store.load()
+    assert store.get() is good
+    assert store.load() is good
+    assert store.get() is good
+    assert store.last_error == "quota exceeded"
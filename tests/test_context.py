@@ -0,0 +1,75 @@
+import pytest
+
+from src.agents import context
+from src.agents.context import ContextBuilder, MESSAGE_OVERHEAD_TOKENS, count_tokens, preload_encodings
+from src._types import Message
+
+
+class FakeEncoding:
+    """One token per word."""
+
+    def encode(self, text):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def clear_encodings(monkeypatch):
+    monkeypatch.setattr(context, "_encodings", {})
+    count_tokens.cache_clear()
+    yield
+    count_tokens.cache_clear()
+
+
+def test_count_tokens_estimates_without_a_preloaded_encoding(monkeypatch):
+    def fail(model):
+        raise AssertionError("must not load a tokenizer inside a request")
+
+    monkeypatch.setattr(context, "load_encoding", fail)
+    assert count_tokens("abcdefgh", "gpt-4o") == 2
+    # Thai characters are three UTF-8 bytes each.
+    assert count_tokens("สวัสดี", "gpt-4o") == 5
+
+
+def test_failed_preload_falls_back_to_the_estimate(monkeypatch):
+    def fail(model):
+        raise OSError("offline")
+
+    monkeypatch.setattr(context, "load_encoding", fail)
+    assert preload_encodings(["gpt-4o"]) == {"gpt-4o": False}
+    assert count_tokens("one two three four", "gpt-4o") == 5
+
+
+def test_preload_replaces_estimated_counts(monkeypatch):
+    assert count_tokens("one two three four", "gpt-4o") == 5
+    monkeypatch.setattr(context, "load_encoding", lambda model: FakeEncoding())
+    assert preload_encodings(["gpt-4o"]) == {"gpt-4o": True}
+    assert count_tokens("one two three four", "gpt-4o") == 4
+
+
+def test_build_drops_oldest_turns_to_fit(monkeypatch):
+    monkeypatch.setattr(context, "load_encoding", lambda model: FakeEncoding())
+    preload_encodings(["gpt-4o"])
+    per_message = 2 + MESSAGE_OVERHEAD_TOKENS
+    system = [Message(role="system", content="be nice")]
+    history = [Message(role="user", content=f"turn {i}") for i in range(5)]
+    builder = ContextBuilder(model="gpt-4o", budget=per_message * 3)
+
+    messages, report = builder.build(system, history)
+
+    assert [msg.content for msg in messages] == ["be nice", "turn 3", "turn 4"]
+    assert report.kept_turns == 2
+    assert report.dropped_turns == 3
+    assert report.dropped_tokens == per_message * 3
+    assert report.used_tokens == per_message * 3
+
+
+def test_build_always_keeps_the_latest_turn(monkeypatch):
+    monkeypatch.setattr(context, "load_encoding", lambda model: FakeEncoding())
+    preload_encodings(["gpt-4o"])
+    history = [Message(role="user", content="older"), Message(role="user", content="a very long latest question")]
+    builder = ContextBuilder(model="gpt-4o", budget=1)
+
+    messages, report = builder.build([], history)
+
+    assert [msg.content for msg in messages] == ["a very long latest question"]
+    assert report.dropped_turns == 1
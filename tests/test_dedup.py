@@ -0,0 +1,137 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.chat.dedup import EventProgress, WebhookDeduplicator
+
+
+class FakeWebhookEventTable:
+    def __init__(self, recorded=(), fail: bool = False):
+        self.recorded = set(recorded)
+        self.fail = fail
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.progress = {}
+
+    async def claim(self, platform, event_id):
+        self.started.set()
+        await self.release.wait()
+        if self.fail:
+            raise ConnectionError("database down")
+        if (platform, event_id) in self.recorded:
+            return False
+        self.recorded.add((platform, event_id))
+        return True
+
+    async def delete(self, platform, event_id):
+        self.recorded.discard((platform, event_id))
+
+    async def get_progress(self, platform, event_ids):
+        if self.fail:
+            raise ConnectionError("database down")
+        return [
+            SimpleNamespace(**{"event_id": event_id, "replied_at": None, "persisted_at": None, **self.progress.get((platform, event_id), {})})
+            for event_id in event_ids if (platform, event_id) in self.recorded
+        ]
+
+    async def set_progress(self, platform, event_ids, replied=False, persisted=False):
+        if self.fail:
+            raise ConnectionError("database down")
+        for event_id in event_ids:
+            progress = self.progress.setdefault((platform, event_id), {})
+            if replied:
+                progress["replied_at"] = "now"
+            if persisted:
+                progress["persisted_at"] = "now"
+
+
+def test_claim_does_not_wait_for_the_database():
+    async def run():
+        table = FakeWebhookEventTable()
+        dedup = WebhookDeduplicator(table=table)
+        # The database has not answered yet, the webhook is acknowledged anyway.
+        assert dedup.claim("messenger", "m1") is True
+        assert dedup.claim("messenger", "m1") is False
+        await table.started.wait()
+        assert table.recorded == set()
+
+        table.release.set()
+        assert await dedup.confirm("messenger", "m1") is True
+        assert table.recorded == {("messenger", "m1")}
+        return dedup.stats()
+
+    assert asyncio.run(run()) == {"remembered": 1, "unconfirmed": 0, "duplicates": 1}
+
+
+def test_event_received_by_another_instance_is_dropped_in_the_worker():
+    async def run():
+        table = FakeWebhookEventTable(recorded={("line", "e1")})
+        table.release.set()
+        dedup = WebhookDeduplicator(table=table)
+        assert dedup.claim("line", "e1") is True
+        return await dedup.confirm("line", "e1")
+
+    assert asyncio.run(run()) is False
+
+
+def test_database_errors_do_not_drop_events():
+    async def run():
+        table = FakeWebhookEventTable(fail=True)
+        table.release.set()
+        dedup = WebhookDeduplicator(table=table)
+        dedup.claim("line", "e1")
+        return await dedup.confirm("line", "e1")
+
+    assert asyncio.run(run()) is True
+
+
+def test_replayed_and_released_events():
+    async def run():
+        table = FakeWebhookEventTable()
+        table.release.set()
+        dedup = WebhookDeduplicator(table=table)
+        # Claimed by a previous process, the job was replayed from the queue.
+        assert await dedup.confirm("line", "old") is True
+        assert await dedup.confirm("line", None) is True
+
+        dedup.claim("line", "e1")
+        await dedup.release("line", "e1")
+        assert table.recorded == set()
+        return dedup.claim("line", "e1")
+
+    assert asyncio.run(run()) is True
+
+
+def test_retried_job_reads_the_progress_of_its_events():
+    async def run():
+        table = FakeWebhookEventTable()
+        table.release.set()
+        dedup = WebhookDeduplicator(table=table)
+        for event_id in ("e1", "e2", "e3"):
+            dedup.claim("line", event_id)
+        first = await dedup.confirm_events("line", ["e1", "e2", "e3", None])
+
+        # The first attempt answered e1 and e2 and persisted e1, then failed.
+        await dedup.mark_replied("line", ["e1", "e2", None])
+        await dedup.mark_persisted("line", ["e1"])
+        retry = await dedup.confirm_events("line", ["e1", "e2", "e3"])
+        return first, retry
+
+    first, retry = asyncio.run(run())
+    assert first == {"e1": EventProgress(), "e2": EventProgress(), "e3": EventProgress(), None: EventProgress()}
+    assert retry == {
+        "e1": EventProgress(replied=True, persisted=True),
+        "e2": EventProgress(replied=True),
+        "e3": EventProgress(),
+    }
+
+
+def test_progress_errors_do_not_drop_events():
+    async def run():
+        table = FakeWebhookEventTable(recorded={("line", "e1")}, fail=True)
+        table.release.set()
+        dedup = WebhookDeduplicator(table=table)
+        # Recording the progress fails quietly, the retry processes the event again.
+        await dedup.mark_replied("line", ["e1"])
+        return await dedup.confirm_events("line", ["e1"])
+
+    assert asyncio.run(run()) == {"e1": EventProgress()}
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from src.chat.executor import ConversationExecutor, LaneFullError
+
+
+def test_work_of_a_user_runs_in_order_and_users_run_concurrently():
+    executor = ConversationExecutor(lanes=8, max_queue=10)
+    events = []
+
+    def work(key, n, delay):
+        async def run():
+            events.append(("start", key, n))
+            await asyncio.sleep(delay)
+            events.append(("end", key, n))
+            return n
+        return run
+
+    async def run():
+        await executor.start()
+        users = ["line:a", "line:b"]
+        assert executor.get_lane(users[0]) != executor.get_lane(users[1])
+        results = await asyncio.gather(
+            executor.run(users[0], work(users[0], 1, 0.03)),
+            executor.run(users[0], work(users[0], 2, 0)),
+            executor.run(users[1], work(users[1], 1, 0)),
+        )
+        await executor.stop()
+        return results
+
+    assert asyncio.run(run()) == [1, 2, 1]
+    a_events = [event for event in events if event[1] == "line:a"]
+    assert a_events == [("start", "line:a", 1), ("end", "line:a", 1), ("start", "line:a", 2), ("end", "line:a", 2)]
+    # The other user finished while the first work of a was still running.
+    assert events.index(("end", "line:b", 1)) < events.index(("end", "line:a", 1))
+
+
+def test_full_lane_rejects_work():
+    executor = ConversationExecutor(lanes=1, max_queue=1)
+
+    async def run():
+        await executor.start()
+        release = asyncio.Event()
+        running = asyncio.create_task(executor.run("u", release.wait))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(executor.run("u", release.wait))
+        await asyncio.sleep(0)
+        with pytest.raises(LaneFullError):
+            await executor.run("u", release.wait)
+        release.set()
+        await asyncio.gather(running, queued)
+        await executor.stop()
+
+    asyncio.run(run())
+    assert executor.stats()["rejected"] == 1
+
+
+def test_errors_are_returned_to_the_caller_and_lane_keeps_running():
+    executor = ConversationExecutor(lanes=1)
+
+    async def fail():
+        raise ValueError("failed")
+
+    async def ok():
+        return "ok"
+
+    async def run():
+        await executor.start()
+        with pytest.raises(ValueError):
+            await executor.run("u", fail)
+        result = await executor.run("u", ok)
+        await executor.stop()
+        return result
+
+    assert asyncio.run(run()) == "ok"
+
+
+def test_not_started_runs_in_caller():
+    executor = ConversationExecutor(lanes=2)
+
+    async def ok():
+        return 1
+
+    assert asyncio.run(executor.run("u", ok)) == 1
+
+
+def test_drain_runs_queued_work_before_stop():
+    executor = ConversationExecutor(lanes=1)
+    done = []
+
+    def work(n):
+        async def run():
+            await asyncio.sleep(0.01)
+            done.append(n)
+        return run
+
+    async def run():
+        await executor.start()
+        tasks = [asyncio.create_task(executor.run("u", work(n))) for n in range(3)]
+        await asyncio.sleep(0)
+        drained = await executor.drain(timeout=1)
+        await executor.stop()
+        await asyncio.gather(*tasks)
+        return drained
+
+    assert asyncio.run(run()) is True
+    assert done == [0, 1, 2]
+
+
+def test_drain_gives_up_after_the_timeout():
+    executor = ConversationExecutor(lanes=1)
+
+    async def run():
+        await executor.start()
+        blocked = asyncio.create_task(executor.run("u", asyncio.Event().wait))
+        await asyncio.sleep(0)
+        drained = await executor.drain(timeout=0.01)
+        await executor.stop()
+        await asyncio.gather(blocked, return_exceptions=True)
+        return drained
+
+    assert asyncio.run(run()) is False
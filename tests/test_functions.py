@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from src.agents import functions
+from src.agents.deferred import DeferredToolRunner
+from src.agents.tools import tool_registry
+from src.gcp.gsheet import Sheet
+
+
+class FakeWorksheet:
+    def __init__(self, rows=None):
+        self.rows = [["name", "email", "phone", "address", "notes"]] + (rows or [])
+        self.timeouts = 0
+        self.reads = 0
+
+    def get_all_values(self):
+        self.reads += 1
+        return [list(row) for row in self.rows]
+
+    def append_row(self, values):
+        self.rows.append(list(values))
+        if self.timeouts:
+            self.timeouts -= 1
+            raise TimeoutError("read timed out")
+
+
+class FakeToolJobTable:
+    def __init__(self):
+        self.jobs = {}
+
+    async def insert(self, tool_name, arguments, status):
+        job_id = len(self.jobs) + 1
+        self.jobs[job_id] = {"status": status}
+        return job_id
+
+    async def update(self, job_id, **values):
+        self.jobs[job_id].update(values)
+
+
+@pytest.fixture
+def worksheet(monkeypatch):
+    worksheet = FakeWorksheet()
+    sheet = Sheet.__new__(Sheet)
+    sheet.sheet = worksheet
+    monkeypatch.setattr(functions, "_client_info_sheet", sheet)
+    return worksheet
+
+
+def test_has_row_ignores_spaces_and_trailing_empty_cells(worksheet):
+    worksheet.rows.append(["Sam", "sam@gmail.com", "0812345678", "", ""])
+    sheet = functions.get_client_info_sheet()
+
+    assert sheet.has_row([" Sam", "sam@gmail.com", "0812345678 ", "", ""])
+    assert not sheet.has_row(["Sam", "sam@gmail.com", "0899999999", "", ""])
+
+
+def test_retry_after_a_landed_write_does_not_append_twice(worksheet):
+    worksheet.timeouts = 1
+    table = FakeToolJobTable()
+    runner = DeferredToolRunner(get_tool=tool_registry.get_tool, retry_delay=0, table=table)
+    tool = tool_registry.get_tool("add_contact_info")
+
+    ok = asyncio.run(runner.run_job(tool, {"name": "Sam", "phone": "0812345678"}))
+
+    assert ok
+    assert worksheet.rows[1:] == [["Sam", "", "0812345678", "", ""]]
+    assert table.jobs[1]["status"] == "succeeded"
+    assert table.jobs[1]["attempts"] == 2
+    assert worksheet.reads == 1
+
+
+def test_different_contact_is_appended(worksheet):
+    worksheet.rows.append(["Sam", "", "0812345678", "", ""])
+
+    functions.add_contact_info(name="Sam", phone="0899999999", attempt=2)
+
+    assert worksheet.rows[-1] == ["Sam", "", "0899999999", "", ""]
+
+
+def test_first_attempt_appends_without_reading_the_sheet(worksheet):
+    table = FakeToolJobTable()
+    runner = DeferredToolRunner(get_tool=tool_registry.get_tool, retry_delay=0, table=table)
+    tool = tool_registry.get_tool("add_contact_info")
+
+    # The same contact submitted twice is appended twice.
+    for _ in range(2):
+        assert asyncio.run(runner.run_job(tool, {"name": "Sam", "phone": "0812345678"}))
+
+    assert worksheet.rows[1:] == [["Sam", "", "0812345678", "", ""]] * 2
+    assert worksheet.reads == 0
+
+
+def test_replayed_job_does_not_append_a_landed_row(worksheet):
+    worksheet.rows.append(["Sam", "", "0812345678", "", ""])
+    table = FakeToolJobTable()
+    table.jobs[1] = {"status": "failed"}
+    runner = DeferredToolRunner(get_tool=tool_registry.get_tool, retry_delay=0, table=table)
+    tool = tool_registry.get_tool("add_contact_info")
+
+    assert asyncio.run(runner.run_job(tool, {"name": "Sam", "phone": "0812345678"}, job_id=1))
+
+    assert worksheet.rows[1:] == [["Sam", "", "0812345678", "", ""]]
@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+from src.chat.executor import LaneFullError
+from src.chat.ingest import IngestWorkerPool, WebhookQueue
+
+
+def make_queue(tmp_path, **kwargs) -> WebhookQueue:
+    return WebhookQueue(path=tmp_path / "ingest.db", **kwargs)
+
+
+def test_claimed_job_is_hidden_until_visibility_timeout(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout=0.05)
+    job_id = queue.enqueue("line", {"body": "ไทย"})
+
+    [job] = queue.claim()
+    assert (job.id, job.payload, job.attempts) == (job_id, {"body": "ไทย"}, 1)
+    assert queue.claim() == []
+    assert queue.depth()["in_flight"] == 1
+
+    time.sleep(0.06)
+    [job] = queue.claim()
+    assert job.attempts == 2
+    queue.ack(job.id)
+    assert queue.depth() == {"queued": 0, "in_flight": 0, "dead": 0, "oldest_age": 0}
+
+
+def test_failed_job_is_retried_then_dead(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=2, retry_delay=0)
+    queue.enqueue("line", {})
+
+    [job] = queue.claim()
+    queue.nack(job, "boom")
+    [job] = queue.claim()
+    queue.nack(job, "boom")
+
+    assert queue.claim() == []
+    assert queue.depth()["dead"] == 1
+
+
+def test_jobs_survive_a_restart(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("messenger", {"n": 1})
+    queue.close()
+
+    [job] = make_queue(tmp_path).claim()
+    assert job.payload == {"n": 1}
+
+
+def run_pool(tmp_path, handler, scenario=None, visibility_timeout: float = 120, stop_timeout: float = 1):
+    queue = make_queue(tmp_path, retry_delay=60, visibility_timeout=visibility_timeout)
+    pool = IngestWorkerPool(queue=queue, workers=1, poll_interval=0.01)
+    pool.register_handler("line", handler)
+
+    async def run():
+        await pool.start()
+        await pool.enqueue("line", {})
+        await asyncio.sleep(0.05)
+        if scenario is not None:
+            await scenario(pool)
+        stats = pool.stats()
+        await pool.stop(timeout=stop_timeout)
+        return stats
+
+    pool.last_stats = asyncio.run(run())
+    return pool, queue
+
+
+def test_job_stays_claimed_until_its_work_is_done(tmp_path):
+    started = []
+
+    async def handler(payload):
+        future = asyncio.get_running_loop().create_future()
+        started.append(future)
+        # Messages of one batch share a future.
+        return [future, future]
+
+    async def scenario(pool):
+        # The worker is free while the reply runs, but the job is not acked.
+        assert pool.stats()["in_progress"] == 1
+        assert pool.stats()["in_flight"] == 1
+        assert pool.stats()["processed"] == 0
+        started[0].set_result(None)
+        await asyncio.sleep(0.05)
+
+    pool, queue = run_pool(tmp_path, handler, scenario)
+    assert len(started) == 1
+    assert pool.last_stats["processed"] == 1
+    assert pool.last_stats["in_progress"] == 0
+    assert pool.last_stats["queued"] == pool.last_stats["in_flight"] == 0
+
+
+def test_lock_is_extended_while_work_runs(tmp_path):
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+        future = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().call_later(0.3, future.set_result, None)
+        return [future]
+
+    async def scenario(pool):
+        await asyncio.sleep(0.4)
+
+    pool, _ = run_pool(tmp_path, handler, scenario, visibility_timeout=0.1)
+    # Without the extension the job would have been claimed again after 0.1 seconds.
+    assert len(calls) == 1
+    assert pool.last_stats["processed"] == 1
+
+
+def test_failure_after_hand_off_is_retried(tmp_path):
+    async def handler(payload):
+        future = asyncio.get_running_loop().create_future()
+        future.set_exception(LaneFullError("lane is full"))
+        return [future]
+
+    pool, _ = run_pool(tmp_path, handler)
+    assert pool.last_stats["failed"] == 1
+    assert pool.last_stats["processed"] == 0
+    # Waiting for its retry delay.
+    assert pool.last_stats["queued"] == 1
+
+
+def test_failed_hand_off_is_retried(tmp_path):
+    async def handler(payload):
+        raise RuntimeError("bad payload")
+
+    pool, _ = run_pool(tmp_path, handler)
+    assert pool.last_stats["failed"] == 1
+    assert pool.last_stats["processed"] == 0
+    # Waiting for its retry delay.
+    assert pool.last_stats["queued"] == 1
+
+
+def test_stop_keeps_unfinished_jobs(tmp_path):
+    async def handler(payload):
+        return [asyncio.get_running_loop().create_future()]
+
+    pool, _ = run_pool(tmp_path, handler, stop_timeout=0.05)
+    assert pool.last_stats["processed"] == pool.last_stats["failed"] == 0
+
+    # Neither acked nor failed, the job is processed again once its lock expires.
+    queue = make_queue(tmp_path)
+    assert queue.depth()["in_flight"] == 1
+    assert queue.claim() == []
@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.chat import messenger as messenger_module
+from src.chat.messenger import Messenger
+from src._types import IncomingMessage
+
+
+class FakeHistoryTable:
+    async def get_chat_history(self, user_uuid):
+        return []
+
+
+class FakeWriteBehind:
+    def __init__(self):
+        self.records = []
+        self.synced = 0
+
+    def add_user(self, user_uuid, name=None, metadata=None):
+        self.records.append(("user", user_uuid))
+
+    def add_chat_message(self, user_uuid, role, content, messenger_timestamp=None):
+        self.records.append((role, content))
+
+    async def sync(self):
+        self.synced = len(self.records)
+
+
+class FakeDeduplicator:
+    def __init__(self):
+        self.replied = []
+        self.persisted = []
+
+    async def mark_replied(self, platform, event_ids):
+        self.replied.extend(event_ids)
+
+    async def mark_persisted(self, platform, event_ids):
+        self.persisted.extend(event_ids)
+
+
+class FakeSummarizer:
+    async def get_prompt_messages(self, user_uuid, history):
+        return []
+
+    def schedule(self, user_uuid, history):
+        pass
+
+
+@pytest.fixture
+def app(monkeypatch):
+    write_behind = FakeWriteBehind()
+    dedup = FakeDeduplicator()
+    monkeypatch.setattr(messenger_module, "AsyncChatHistoryTable", FakeHistoryTable)
+    monkeypatch.setattr(messenger_module, "chat_write_behind", write_behind)
+    monkeypatch.setattr(messenger_module, "webhook_deduplicator", dedup)
+    monkeypatch.setattr(messenger_module, "conversation_summarizer", FakeSummarizer())
+    monkeypatch.setattr(messenger_module, "config_store", SimpleNamespace(is_working_hour=lambda: True))
+
+    app = Messenger(page_access_token="token")
+    app.turns = []
+
+    async def get_display_name(user_id):
+        return "Somchai"
+
+    async def get_bot_response(messages, sender_id=None):
+        app.turns.append(messages[-1].content)
+        return "reply"
+
+    async def save_to_gsheet(name, sender_id):
+        pass
+
+    app.get_display_name = get_display_name
+    app.get_bot_response = get_bot_response
+    app.save_to_gsheet = save_to_gsheet
+    app.write_behind, app.dedup = write_behind, dedup
+    return app
+
+
+def test_reply_records_progress_after_reply_and_spool(app):
+    messages = [IncomingMessage("a", "1", "m1"), IncomingMessage("b", "2", "m2")]
+    asyncio.run(app.reply_messages("u1", messages))
+
+    assert app.turns == ["a\nb"]
+    assert app.dedup.replied == ["m1", "m2"]
+    assert app.dedup.persisted == ["m1", "m2"]
+    # Marked as persisted only once every record was synced to the spool.
+    assert app.write_behind.synced == len(app.write_behind.records)
+    assert app.write_behind.records[1:] == [("user", "a"), ("user", "b"), ("assistant", "reply")]
+
+
+def test_retry_does_not_answer_replied_messages_again(app):
+    # The first attempt answered m1 and failed before persisting it.
+    messages = [IncomingMessage("a", "1", "m1", replied=True), IncomingMessage("b", "2", "m2")]
+    asyncio.run(app.reply_messages("u1", messages))
+    assert app.turns == ["b"]
+    assert app.dedup.replied == ["m2"]
+
+    app.turns.clear()
+    asyncio.run(app.reply_messages("u1", [IncomingMessage("a", "1", "m1", replied=True)]))
+    assert app.turns == []
+    assert app.write_behind.records[-1] == ("user", "a")
+    assert app.dedup.persisted[-1] == "m1"
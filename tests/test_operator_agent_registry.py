@@ -0,0 +1,72 @@
+import asyncio
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents import customer_service
+from src.agents.customer_service import OperatorAgentRegistry
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    builds = SimpleNamespace(threads=[], fail=False)
+
+    def fake_build():
+        time.sleep(0.02)
+        if builds.fail:
+            raise ValueError("broken price sheet")
+        builds.threads.append(threading.current_thread())
+        return f"agent {len(builds.threads)}"
+
+    monkeypatch.setattr(customer_service, "build_operator_agent", fake_build)
+    return builds
+
+
+def touch(path, content: str):
+    path.write_text(content)
+    # Make sure the mtime changes even on coarse clocks.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_rebuild_runs_off_loop_and_serves_the_previous_agent(tmp_path, builds):
+    source = tmp_path / "prompt.txt"
+    touch(source, "v1")
+    registry = OperatorAgentRegistry(source_files=[source])
+
+    async def run():
+        assert await registry.aget_agent() == "agent 1"
+        assert await registry.aget_agent() == "agent 1"
+
+        touch(source, "v2")
+        # The new agent is still building, the previous one answers.
+        assert await registry.aget_agent() == "agent 1"
+        await registry._rebuild_task
+        return await registry.aget_agent()
+
+    assert asyncio.run(run()) == "agent 2"
+    assert len(builds.threads) == 2
+    assert all(thread is not threading.main_thread() for thread in builds.threads)
+
+
+def test_failed_rebuild_keeps_the_agent_and_is_not_retried(tmp_path, builds):
+    source = tmp_path / "prompt.txt"
+    touch(source, "v1")
+    registry = OperatorAgentRegistry(source_files=[source])
+
+    async def run():
+        await registry.aget_agent()
+        builds.fail = True
+        touch(source, "v2")
+        assert await registry.aget_agent() == "agent 1"
+        await asyncio.gather(registry._rebuild_task, return_exceptions=True)
+        await asyncio.sleep(0)
+        # The same broken sources are not built again on every message.
+        assert await registry.aget_agent() == "agent 1"
+        assert registry._rebuild_task is None
+
+    asyncio.run(run())
+    assert registry.last_error == "broken price sheet"
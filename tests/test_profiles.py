@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.chat.profiles import ProfileCache
+
+
+class FakeUserTable:
+    def __init__(self, users=None):
+        self.users = users or {}
+
+    async def read(self, user_id):
+        name = self.users.get(user_id)
+        return SimpleNamespace(user_name=name) if name is not None else None
+
+
+def make_cache(**kwargs) -> ProfileCache:
+    kwargs.setdefault("user_table", FakeUserTable())
+    return ProfileCache(max_entries=10, ttl=60, negative_ttl=60, **kwargs)
+
+
+def test_concurrent_lookups_share_one_fetch():
+    cache = make_cache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "Somchai"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_name("line", "U1", fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["Somchai"] * 5
+    assert len(calls) == 1
+    assert asyncio.run(cache.get_name("line", "U1", fetch)) == "Somchai"
+    assert len(calls) == 1
+
+
+def test_failed_fetch_returns_none_not_the_user_id():
+    cache = make_cache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        raise ConnectionError("profile API down")
+
+    assert asyncio.run(cache.get_name("messenger", "123", fetch)) is None
+    # The failure is cached for the negative TTL.
+    assert asyncio.run(cache.get_name("messenger", "123", fetch)) is None
+    assert len(calls) == 1
+
+
+def test_stored_name_is_used_before_fetching():
+    # A name equal to the user id was a fallback, not a real name.
+    cache = make_cache(seed_from_db=True, user_table=FakeUserTable({"U1": "Somchai", "U2": "U2"}))
+
+    async def fetch():
+        return "Fetched"
+
+    assert asyncio.run(cache.get_name("line", "U1", fetch)) == "Somchai"
+    assert asyncio.run(cache.get_name("line", "U2", fetch)) == "Fetched"
+    assert cache.stats()["seeded"] == 1
@@ -0,0 +1,107 @@
+import pytest
+
+from src.settings import PRICE_SHEET_PATH
+from src.utils.loader import PdfFile
+from src.utils.retrieval import BM25Index, PriceSheetRetriever, chunk_price_sheet, render_chunks, tokenize
+from src._types import Message
+
+
+SHEET = """\
+# ราคา
+
+|ลำดับ|รายการ|ในเวลา|นอกเวลา|เบิกได้|
+|---|---|---|---|---|
+|**1**|**ค่าบริการทางการแพทย์**|120|150|50|
+|**4**|**ทันตกรรมหัตถการ**||||
+||1.อุดฟันด้วยวัสดุ อะมัลกัม||||
+||1 ด้าน|550|780|260|
+||2.อุดฟันด้วยวัสดุสีเหมือนฟัน||||
+||2 ด้าน|800|1,300|500|
+||3.เคลือบฟัน|300|500|0|
+
+หมายเหตุ ไม่รวมค่าวัสดุ
+"""
+
+
+@pytest.fixture(scope="module")
+def price_sheet() -> str:
+    return PdfFile(file_path=PRICE_SHEET_PATH).get_markdown()
+
+
+def test_tokenize_splits_thai_into_bigrams():
+    assert tokenize("ขูดหินปูน 1,200") == ["ขู", "ูด", "ดห", "หิ", "ิน", "นป", "ปู", "ูน", "1,200"]
+
+
+def test_sub_rows_carry_their_parent_rows():
+    chunks = chunk_price_sheet(SHEET)
+    two_sides = next(chunk for chunk in chunks if chunk.body.startswith("||2 ด้าน"))
+    assert two_sides.parents == ("|**4**|**ทันตกรรมหัตถการ**||||", "||2.อุดฟันด้วยวัสดุสีเหมือนฟัน||||")
+    assert two_sides.header == "|ลำดับ|รายการ|ในเวลา|นอกเวลา|เบิกได้|\n|---|---|---|---|---|"
+    # The table header is not indexed.
+    assert two_sides.text.split() == ["4", "ทันตกรรมหัตถการ", "2.อุดฟันด้วยวัสดุสีเหมือนฟัน", "2", "ด้าน", "800", "1,300", "500"]
+    # A numbered item closes the sub-rows of the previous item.
+    coating = next(chunk for chunk in chunks if "เคลือบฟัน" in chunk.body)
+    assert "อุดฟัน" not in coating.text and "ทันตกรรมหัตถการ" in coating.text
+    # A priced category stands alone and rows without prices are not chunks of their own.
+    assert chunks[0].body == "|**1**|**ค่าบริการทางการแพทย์**|120|150|50|" and chunks[0].parents == ()
+    assert not any(chunk.body.endswith("||||") for chunk in chunks)
+    assert (chunks[-1].header, chunks[-1].body) == ("# ราคา", "หมายเหตุ ไม่รวมค่าวัสดุ")
+
+
+def test_repeated_paragraphs_are_kept_once():
+    chunks = chunk_price_sheet(SHEET + "\n# หน้า 2\n\nหมายเหตุ ไม่รวมค่าวัสดุ\n")
+    assert [chunk.body for chunk in chunks].count("หมายเหตุ ไม่รวมค่าวัสดุ") == 1
+
+
+def test_render_writes_headers_and_parents_once():
+    chunks = chunk_price_sheet(SHEET)
+    rows = [chunk for chunk in chunks if chunk.parents]
+    assert render_chunks(rows + chunks[-1:]).splitlines() == [
+        "|ลำดับ|รายการ|ในเวลา|นอกเวลา|เบิกได้|",
+        "|---|---|---|---|---|",
+        "|**4**|**ทันตกรรมหัตถการ**||||",
+        "||1.อุดฟันด้วยวัสดุ อะมัลกัม||||",
+        "||1 ด้าน|550|780|260|",
+        "||2.อุดฟันด้วยวัสดุสีเหมือนฟัน||||",
+        "||2 ด้าน|800|1,300|500|",
+        "||3.เคลือบฟัน|300|500|0|",
+        "",
+        "# ราคา",
+        "หมายเหตุ ไม่รวมค่าวัสดุ",
+    ]
+
+
+def test_search_keeps_sheet_order():
+    index = BM25Index(["ขูดหินปูน 500", "ถอนฟัน 350", "ขูดหินปูนทั้งปาก 700"])
+    assert [chunk for _, chunk in index.search("ขูดหินปูน", top_k=2)] == ["ขูดหินปูน 500", "ขูดหินปูนทั้งปาก 700"]
+    assert index.search("xyz") == []
+
+
+@pytest.mark.parametrize("query, parent, priced_row", [
+    ("อุดฟันสีเหมือนฟัน 2 ด้านราคาเท่าไหร่", "2.อุดฟันด้วยวัสดุสีเหมือนฟัน", "||2 ด้าน|800|1,300|500|"),
+    ("อุดฟันอะมัลกัม 1 ด้าน", "1.อุดฟันด้วยวัสดุ อะมัลกัม", "||1 ด้าน|550|780|260|"),
+    ("รักษารากฟันกรามใหญ่", "การรักษาคลองรากฟัน", "||3.ฟันกรามใหญ่|5,000-6,000|7,500-9,000|3,500|"),
+    ("ขูดหินปูนราคา", "งานปริทันต์บำบัด", "||1.ขูดหินปูนทั้งปาก|500|700|280|"),
+])
+def test_price_sheet_queries_return_priced_rows(price_sheet, query, parent, priced_row):
+    retriever = PriceSheetRetriever(price_sheet)
+    context = retriever.get_context_message([Message(role="user", content=query)])
+    assert context is not None
+    best_score, best_chunk = max(retriever.search(query), key=lambda result: result[0])
+    assert best_chunk.body == priced_row
+    assert any(parent in row for row in best_chunk.parents)
+    assert priced_row in context.content
+
+
+@pytest.mark.parametrize("query", ["ราคาขูดหินปูนเท่าไหร่", "ถอนฟันราคาเท่าไหร่"])
+def test_price_questions_get_a_small_context(price_sheet, query):
+    retriever = PriceSheetRetriever(price_sheet)
+    context = retriever.get_context_message([Message(role="user", content=query)])
+    assert context is not None
+    assert len(context.content.encode("utf-8")) < 1000
+
+
+@pytest.mark.parametrize("query", ["สวัสดีครับ", "ขอบคุณค่ะ", "สวัสดีค่ะ สอบถามหน่อยค่ะ"])
+def test_questions_without_a_treatment_get_no_context(price_sheet, query):
+    retriever = PriceSheetRetriever(price_sheet)
+    assert retriever.get_context_message([Message(role="user", content=query)]) is None
@@ -0,0 +1,74 @@
+import pytest
+
+from src.gcp.sheet_buffer import SheetWriteBuffer, get_first_appended_row
+
+
+class FakeWorksheet:
+    def __init__(self):
+        self.rows = []
+        self.cells = {}
+        self.fail_updates = 0
+
+    def append_rows(self, values):
+        first = len(self.rows) + 2
+        self.rows.extend(values)
+        return {"updates": {"updatedRange": f"'Client tag'!A{first}:E{first + len(values) - 1}"}}
+
+    def batch_update(self, updates):
+        if self.fail_updates:
+            self.fail_updates -= 1
+            raise RuntimeError("quota exceeded")
+        for update in updates:
+            self.cells[update["range"]] = update["values"][0][0]
+
+
+class FakeSheet:
+    speadsheet_name = "spreadsheet"
+    sheet_name = "Client tag"
+
+    def __init__(self):
+        self.worksheet = FakeWorksheet()
+
+    def get_sheet(self):
+        return self.worksheet
+
+
+def test_get_first_appended_row():
+    assert get_first_appended_row({"updates": {"updatedRange": "'Client tag'!A12:E14"}}) == 12
+    assert get_first_appended_row({}) is None
+
+
+def test_flush_coalesces_and_deduplicates_cells():
+    buffer = SheetWriteBuffer()
+    buffer._task = object()  # Queue instead of writing through.
+    sheet = FakeSheet()
+    rows = []
+    buffer.append_row(sheet, ["u1"], on_written=rows.append)
+    buffer.append_row(sheet, ["u2"], on_written=rows.append)
+    buffer.update_cell(sheet, 2, 3, "a")
+    buffer.update_cell(sheet, 2, 3, "b")
+
+    assert buffer.flush() == 3
+    assert sheet.worksheet.rows == [["u1"], ["u2"]]
+    assert sheet.worksheet.cells == {"C2": "b"}
+    assert rows == [2, 3]
+    assert buffer.deduplicated_cells == 1
+    assert buffer.flush() == 0
+
+
+def test_failed_update_does_not_repeat_written_appends():
+    buffer = SheetWriteBuffer()
+    buffer._task = object()
+    sheet = FakeSheet()
+    sheet.worksheet.fail_updates = 1
+    buffer.append_row(sheet, ["u1"])
+    buffer.update_cell(sheet, 2, 3, "old")
+
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert buffer.status()["pending"] == {"spreadsheet/Client tag": {"appends": 0, "cells": 1}}
+
+    buffer.update_cell(sheet, 2, 3, "new")
+    assert buffer.flush() == 1
+    assert sheet.worksheet.rows == [["u1"]]
+    assert sheet.worksheet.cells == {"C2": "new"}
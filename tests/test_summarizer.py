@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from src.agents.summarizer import ConversationSummarizer, ConversationSummary, NO_SUMMARY
+from src._types import Message
+
+
+START = datetime(2025, 1, 1)
+
+
+def make_row(i: int):
+    return SimpleNamespace(id=i, role="user" if i % 2 else "assistant", content=f"m{i}", timestamp=START + timedelta(seconds=i))
+
+
+class FakeHistoryTable:
+    def __init__(self, rows):
+        self.rows = rows
+        self.limits = []
+
+    async def read_after(self, user_uuid, after_id, limit=None):
+        self.limits.append(limit)
+        rows = [row for row in self.rows if row.id > after_id]
+        return rows[:limit] if limit else rows
+
+
+class FakeSummaryTable:
+    def __init__(self):
+        self.rows = {}
+
+    async def read(self, user_uuid):
+        return self.rows.get(user_uuid)
+
+    async def upsert(self, user_uuid, summary, last_message_id, last_message_at=None):
+        self.rows[user_uuid] = SimpleNamespace(
+            summary=summary, last_message_id=last_message_id, last_message_at=last_message_at
+        )
+
+
+class FakeAgent:
+    def __init__(self):
+        self.prompts = []
+
+    async def ainvoke(self, messages):
+        self.prompts.append(messages[0].content)
+        return f"summary {len(self.prompts)}"
+
+
+def make_summarizer(rows, **kwargs) -> tuple[ConversationSummarizer, FakeAgent, FakeHistoryTable]:
+    history = FakeHistoryTable(rows)
+    summarizer = ConversationSummarizer(summary_table=FakeSummaryTable(), history_table=history, **kwargs)
+    agent = FakeAgent()
+    summarizer._agent = agent
+    return summarizer, agent, history
+
+
+def test_queued_messages_are_covered_by_timestamp():
+    summary = ConversationSummary("s", last_message_id=10, last_message_at=START + timedelta(seconds=10))
+    # Write-behind messages have no id yet, only the timestamp their row gets.
+    history = [
+        Message(role="user", content=f"m{i}", timestamp=START + timedelta(seconds=i))
+        for i in range(5, 15)
+    ]
+    unsummarized = ConversationSummarizer.get_unsummarized(history, summary)
+    assert [msg.content for msg in unsummarized] == ["m11", "m12", "m13", "m14"]
+
+
+def test_id_coverage_for_summaries_without_timestamp():
+    summary = ConversationSummary("s", last_message_id=3)
+    history = [Message(role="user", content="a", id=3), Message(role="user", content="b", id=4), Message(role="user", content="c")]
+    assert [msg.content for msg in ConversationSummarizer.get_unsummarized(history, summary)] == ["b", "c"]
+
+
+def test_summarized_turns_are_not_resummarized():
+    rows = [make_row(i) for i in range(1, 31)]
+    summarizer, agent, _ = make_summarizer(rows, threshold=16, keep_recent=8)
+
+    async def run():
+        calls = 0
+        for n in range(1, 31):
+            history = [
+                Message(role=row.role, content=row.content, timestamp=row.timestamp)
+                for row in rows[max(0, n - 20):n]
+            ]
+            summarizer.history_table.rows = rows[:n]
+            await summarizer.get_prompt_messages("u", history)
+            summarizer.schedule("u", history)
+            if summarizer._in_flight:
+                await asyncio.gather(*summarizer._in_flight.values())
+                calls += 1
+        return calls
+
+    calls = asyncio.run(run())
+    # Summaries fire at 16 and 24 turns, not on every other turn.
+    assert calls == len(agent.prompts) == 2
+    summary = asyncio.run(summarizer.get_summary("u"))
+    assert summary.last_message_id == 16
+    assert summary.last_message_at == rows[15].timestamp
+
+
+def test_long_history_is_folded_in_chunks():
+    rows = [make_row(i) for i in range(1, 251)]
+    summarizer, agent, history = make_summarizer(rows, keep_recent=8, fold_chunk=100)
+
+    summary = asyncio.run(summarizer.summarize("u"))
+
+    assert history.limits and all(limit == 108 for limit in history.limits)
+    assert len(agent.prompts) == 3
+    assert all(prompt.count("\n") <= 104 for prompt in agent.prompts)
+    assert "summary 2" in agent.prompts[2]
+    assert summary.last_message_id == 242
+
+
+def test_summarize_without_enough_messages_keeps_summary():
+    summarizer, agent, _ = make_summarizer([make_row(i) for i in range(1, 5)], keep_recent=8)
+    assert asyncio.run(summarizer.summarize("u")) == NO_SUMMARY
+    assert agent.prompts == []
@@ -0,0 +1,190 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from src.gcp.write_behind import ChatWriteBehind
+from src.utils.cache import ConversationCache
+
+
+class FakeWriteBehind(ChatWriteBehind):
+    """Writes to a list instead of Cloud SQL"""
+
+    def __init__(self, tmp_path, **kwargs):
+        kwargs.setdefault("cache", None)
+        super().__init__(
+            spool_path=tmp_path / "spool.jsonl",
+            dead_letter_path=tmp_path / "dead.jsonl",
+            flush_interval_ms=10_000,
+            **kwargs,
+        )
+        self.rows = []
+        self.error = None
+
+    async def _write_batch(self, records):
+        if self.error is not None:
+            raise self.error
+        bad = [record for record in records if record.get("content") == "bad"]
+        if bad:
+            raise IntegrityError("INSERT", {}, Exception("violates check constraint"))
+        self.rows.extend(records)
+
+
+def read_jsonl(path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()] if path.exists() else []
+
+
+def spooled(write_behind) -> list[dict]:
+    # Wait for the spool thread.
+    write_behind._spool_executor.submit(lambda: None).result()
+    return read_jsonl(write_behind.spool_path)
+
+
+def test_sync_waits_until_records_are_in_the_spool(tmp_path):
+    write_behind = FakeWriteBehind(tmp_path)
+
+    async def run():
+        await write_behind.start()
+        write_behind.add_chat_message("u1", "user", "a")
+        write_behind.add_chat_message("u1", "user", "b")
+        await write_behind.sync()
+        # Read without waiting for the spool thread.
+        records = read_jsonl(write_behind.spool_path)
+        await write_behind.stop()
+        return records
+
+    assert [record["content"] for record in asyncio.run(run())] == ["a", "b"]
+
+
+def test_records_are_spooled_then_flushed(tmp_path):
+    write_behind = FakeWriteBehind(tmp_path)
+
+    async def run():
+        await write_behind.start()
+        write_behind.add_user("u1", name="Somchai")
+        write_behind.add_chat_message("u1", "user", "สวัสดี", messenger_timestamp="1")
+        assert [record["kind"] for record in spooled(write_behind)] == ["user", "chat"]
+
+        assert await write_behind.flush() == 2
+        assert spooled(write_behind) == []
+        await write_behind.stop()
+
+    asyncio.run(run())
+    assert [record["kind"] for record in write_behind.rows] == ["user", "chat"]
+    assert write_behind.stats()["pending"] == 0
+
+
+def test_spool_is_replayed_on_start(tmp_path):
+    first = FakeWriteBehind(tmp_path)
+    first.add_chat_message("u1", "user", "hello")
+    assert len(spooled(first)) == 1
+
+    second = FakeWriteBehind(tmp_path)
+
+    async def run():
+        await second.start()
+        await second.stop()
+
+    asyncio.run(run())
+    assert [record["content"] for record in second.rows] == ["hello"]
+    assert spooled(second) == []
+
+
+def test_poison_record_is_dead_lettered_after_max_attempts(tmp_path):
+    write_behind = FakeWriteBehind(tmp_path, max_attempts=2)
+
+    async def run():
+        await write_behind.start()
+        write_behind.add_chat_message("u1", "user", "first")
+        write_behind.add_chat_message("u1", "user", "bad")
+        write_behind.add_chat_message("u1", "user", "last")
+        with pytest.raises(IntegrityError):
+            await write_behind.flush()
+        assert write_behind.rows == []
+
+        assert await write_behind.flush() == 2
+        await write_behind.stop()
+
+    asyncio.run(run())
+    assert [record["content"] for record in write_behind.rows] == ["first", "last"]
+    dead = read_jsonl(write_behind.dead_letter_path)
+    assert [record["content"] for record in dead] == ["bad"]
+    assert "violates check constraint" in dead[0]["error"]
+    assert write_behind.stats()["dead_records"] == 1
+    assert spooled(write_behind) == []
+
+
+def test_connection_errors_never_dead_letter(tmp_path):
+    write_behind = FakeWriteBehind(tmp_path, max_attempts=1)
+    write_behind.error = OperationalError("INSERT", {}, Exception("connection refused"))
+
+    async def run():
+        await write_behind.start()
+        write_behind.add_chat_message("u1", "user", "hello")
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                await write_behind.flush()
+        write_behind.error = None
+        assert await write_behind.flush() == 1
+        await write_behind.stop()
+
+    asyncio.run(run())
+    assert not write_behind.dead_letter_path.exists()
+    assert write_behind.stats()["failed_flushes"] == 3
+
+
+def test_cached_messages_carry_the_row_timestamp(tmp_path):
+    cache = ConversationCache(window=10)
+    cache.set_messages("u1", [])
+    write_behind = FakeWriteBehind(tmp_path, cache=cache)
+    write_behind.add_chat_message("u1", "user", "hello")
+
+    [message] = cache.get_messages("u1")
+    [record] = spooled(write_behind)
+    assert message.id is None
+    assert message.timestamp.isoformat() == record["timestamp"]
+
+
+class RecordingEngine:
+    """Records the statements of `engine.begin()` transactions"""
+
+    def __init__(self):
+        self.statements = []
+
+    def begin(self):
+        engine = self
+
+        class Transaction:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc_info):
+                return False
+
+            async def execute(self, statement, params=None):
+                engine.statements.append((statement, params))
+
+        return Transaction()
+
+
+def test_user_upsert_without_name_keeps_the_stored_name(tmp_path):
+    from sqlalchemy.dialects import postgresql
+
+    engine = RecordingEngine()
+    write_behind = ChatWriteBehind(
+        engine=engine, spool_path=tmp_path / "spool.jsonl", dead_letter_path=tmp_path / "dead.jsonl", cache=None
+    )
+    records = [
+        {"kind": "user", "user_uuid": "U1", "user_name": "Somchai", "user_metadata": "{}"},
+        # The profile could not be fetched for the next message.
+        {"kind": "user", "user_uuid": "U1", "user_name": "", "user_metadata": "{}"},
+        {"kind": "user", "user_uuid": "U2", "user_name": "", "user_metadata": "{}"},
+    ]
+    asyncio.run(write_behind._write_batch(records))
+
+    [(statement, _)] = engine.statements
+    compiled = statement.compile(dialect=postgresql.dialect())
+    assert "coalesce(nullif(excluded.user_name" in str(compiled)
+    names = {value for key, value in compiled.params.items() if key.startswith("user_name")}
+    assert names == {"Somchai", ""}